@@ -0,0 +1,184 @@
+"""
+The admission module contains the AdmissionController, which decides whether
+a rider request is let in to a live Dispatcher.
+
+Without admission control, every rider who cannot be matched waits on the
+dispatcher's waiting list and adds a Cancellation to the pending events, so
+during a spike both grow without limit, and so does the time every rider
+waits. The controller sheds requests instead:
+
+    rejected: the number of waiting riders or of pending events is at its
+        bound.
+    infeasible: no driver is idle, and the rider would not be picked up
+        before their patience runs out, going by the current number of
+        waiting riders and the recent time between pickups.
+    coalesced: the rider already has a request that has not been picked up
+        or cancelled, which goes on being served.
+
+Since the waiting list is bounded, so is the time an admitted rider waits.
+
+=== Constants ===
+@type REJECTED: str
+    A request shed because a bound was reached.
+@type INFEASIBLE: str
+    A request shed because the rider's patience could not be met.
+@type COALESCED: str
+    A duplicate request shed in favour of the rider's earlier one.
+"""
+
+REJECTED = 'rejected'
+INFEASIBLE = 'infeasible'
+COALESCED = 'coalesced'
+
+
+class AdmissionController:
+    """A policy for letting rider requests in to a dispatcher.
+
+    === Attributes ===
+    @type max_waiting: int | None
+        The most riders who may wait to be matched, or None for no bound.
+    @type max_pending: int | None
+        The most events that may be pending, or None for no bound.
+    @type shed_infeasible: bool
+        Whether riders whose patience cannot be met are shed.
+    @type coalesce: bool
+        Whether duplicate requests from the same rider are shed.
+    @type smoothing: float
+        The weight of the newest time between pickups in its moving average,
+        in (0, 1].
+    @type counters: dict[str, int]
+        The number of requests admitted, under 'admitted', and shed for each
+        reason.
+    """
+
+    # === Private Attributes ===
+    # @type _interval: float | None
+    #     The exponentially weighted moving average of the simulated time
+    #     between pickups, or None before two pickups have been seen.
+    # @type _last_pickup: int | None
+    #     The time of the last pickup, or None before the first one.
+
+    def __init__(self, max_waiting=None, max_pending=None,
+                 shed_infeasible=False, coalesce=False, smoothing=0.2):
+        """Initialize an AdmissionController.
+
+        @type self: AdmissionController
+        @type max_waiting: int | None
+        @type max_pending: int | None
+        @type shed_infeasible: bool
+        @type coalesce: bool
+        @type smoothing: float
+        @rtype: None
+        """
+        self.max_waiting = max_waiting
+        self.max_pending = max_pending
+        self.shed_infeasible = shed_infeasible
+        self.coalesce = coalesce
+        self.smoothing = smoothing
+        self.counters = {'admitted': 0, REJECTED: 0, INFEASIBLE: 0,
+                         COALESCED: 0}
+        self._interval = None
+        self._last_pickup = None
+
+    def admit(self, rider, dispatcher, pending):
+        """Decide whether the request of <rider> is let in to <dispatcher>,
+        which has <pending> events pending, and count the decision.
+
+        Return None if it is admitted, or the reason it is shed.
+
+        @type self: AdmissionController
+        @type rider: Rider
+        @type dispatcher: Dispatcher
+        @type pending: int
+        @rtype: str | None
+
+        >>> from dispatcher import Dispatcher
+        >>> from location import Location
+        >>> from rider import Rider
+        >>> d = Dispatcher()
+        >>> admission = AdmissionController(max_waiting=1, coalesce=True)
+        >>> ann = Rider('Ann', Location(1, 1), Location(2, 2), 10)
+        >>> admission.admit(ann, d, 0) is None
+        True
+        >>> d.request_driver(ann)
+        >>> d.num_waiting_riders()
+        1
+        >>> admission.admit(Rider('Bo', Location(1, 1), Location(2, 2), 10),
+        ...                 d, 0)
+        'rejected'
+        >>> admission.counters
+        {'admitted': 1, 'rejected': 1, 'infeasible': 0, 'coalesced': 0}
+        """
+        reason = self._shed(rider, dispatcher, pending)
+        self.counters[reason or 'admitted'] += 1
+        return reason
+
+    def _shed(self, rider, dispatcher, pending):
+        """Return the reason the request of <rider> is shed, or None if it
+        is not.
+
+        @type self: AdmissionController
+        @type rider: Rider
+        @type dispatcher: Dispatcher
+        @type pending: int
+        @rtype: str | None
+        """
+        if self.coalesce and \
+                dispatcher.pending_cancellation(rider.rider_id) is not None:
+            return COALESCED
+        waiting = dispatcher.num_waiting_riders()
+        if self.max_waiting is not None and waiting >= self.max_waiting:
+            return REJECTED
+        if self.max_pending is not None and pending >= self.max_pending:
+            return REJECTED
+        if self.shed_infeasible and dispatcher.num_idle_drivers() == 0 and \
+                self.expected_wait(waiting) > rider.patience:
+            return INFEASIBLE
+        return None
+
+    def expected_wait(self, waiting):
+        """Return the expected time until a rider who joins <waiting> other
+        waiting riders is picked up, or 0 if it is not known yet.
+
+        @type self: AdmissionController
+        @type waiting: int
+        @rtype: float
+
+        >>> admission = AdmissionController(smoothing=0.5)
+        >>> for timestamp in [0, 2, 6]:
+        ...     admission.observe_pickup(timestamp)
+        >>> admission.expected_wait(2)
+        9.0
+        """
+        if self._interval is None:
+            return 0.0
+        return (waiting + 1) * self._interval
+
+    def observe_pickup(self, timestamp):
+        """Record that a rider was picked up at <timestamp>.
+
+        @type self: AdmissionController
+        @type timestamp: int
+        @rtype: None
+        """
+        if self._last_pickup is not None:
+            interval = timestamp - self._last_pickup
+            if self._interval is None:
+                self._interval = float(interval)
+            else:
+                self._interval += self.smoothing * (interval - self._interval)
+        self._last_pickup = timestamp
+
+    def shed(self):
+        """Return the number of requests shed for any reason.
+
+        @type self: AdmissionController
+        @rtype: int
+        """
+        return sum(count for reason, count in self.counters.items()
+                   if reason != 'admitted')
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,180 @@
+"""
+Benchmark the memory used per rider, driver and pending event.
+
+Each kind of entity is created <count> times with tracemalloc running, and
+the memory allocated is divided by <count>. The attribute values (locations,
+identifiers and numbers) are made before tracing starts and shared, as they
+are in a simulation, so only the entities themselves are measured.
+
+Riders, drivers and events declare __slots__. For comparison, the benchmark
+also measures 'before' copies of each entity: instances of a plain class
+with the attributes the entity had when it had a __dict__, set in the same
+order.
+
+A pending event also costs its entry in the event queue, which used to hold
+the events themselves and now holds (priority, sequence number, event)
+tuples. The figure for a pending event counts the entry, and its sequence
+number, after but not before. The entry costs more than __slots__ saves, so
+a pending event takes more memory than it did, though the event is smaller.
+
+Run it as a script, e.g.
+
+    python benchmark_memory.py --count 200000 --json memory.json
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from container import PriorityQueue
+from driver import Driver
+from event import (RiderRequest, DriverRequest, Cancellation, Pickup,
+                   Dropoff)
+from location import Location
+from rider import Rider
+from simulation import event_time
+
+# The attributes of each kind of entity when it had a __dict__, in the order
+# they were set.
+BASELINE_ATTRIBUTES = {
+    Rider: ('rider_id', 'origin', 'destination', 'status', 'patience'),
+    Driver: ('identifier', 'location', 'speed', 'destination', 'is_idle'),
+    RiderRequest: ('timestamp', 'rider'),
+    DriverRequest: ('timestamp', 'driver'),
+    Cancellation: ('timestamp', 'rider'),
+    Pickup: ('timestamp', 'driver', 'rider'),
+    Dropoff: ('timestamp', 'driver', 'rider'),
+}
+
+# The classes of the copies that stand in for dict-backed entities, by the
+# class of the entity.
+_plain_classes = {}
+
+
+def dict_backed(entity):
+    """Return a copy of <entity> laid out as it was when it had a __dict__.
+
+    @type entity: object
+    @rtype: object
+
+    >>> rider = dict_backed(Rider('Ann', Location(1, 1), Location(2, 2), 4))
+    >>> rider.rider_id, rider.status, hasattr(rider, '__dict__')
+    ('Ann', 'waiting', True)
+    >>> sorted(vars(dict_backed(Driver('Jum', Location(3, 3), 2))))
+    ['destination', 'identifier', 'is_idle', 'location', 'speed']
+    """
+    cls = type(entity)
+    plain = _plain_classes.get(cls)
+    if plain is None:
+        plain = _plain_classes[cls] = type(cls.__name__, (), {})
+    copy = plain()
+    for name in BASELINE_ATTRIBUTES[cls]:
+        setattr(copy, name, getattr(entity, name))
+    return copy
+
+
+def _measure(make, count):
+    """Return the bytes allocated per entity by calling <make> <count> times
+    and keeping every result.
+
+    @type make: callable
+    @type count: int
+    @rtype: float
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        entities = [make(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    # The list holding the entities is not part of their cost.
+    list_size = entities.__sizeof__()
+    del entities
+    return (after - before - list_size) / count
+
+
+def _factories(count):
+    """Return (name, factory) pairs that each make one kind of entity from
+    an index, using attribute values made in advance.
+
+    @type count: int
+    @rtype: list[(str, callable)]
+    """
+    ids = ['id{}'.format(i) for i in range(count)]
+    locations = [Location(i % 1000, i // 1000 % 1000) for i in range(count)]
+    rider = Rider('Ann', Location(1, 1), Location(2, 2), 4)
+    driver = Driver('Jum', Location(3, 3), 2)
+    return [
+        ('Rider', lambda i: Rider(ids[i], locations[i], locations[-i], 30)),
+        ('Driver', lambda i: Driver(ids[i], locations[i], 2)),
+        ('RiderRequest', lambda i: RiderRequest(i, rider)),
+        ('DriverRequest', lambda i: DriverRequest(i, driver)),
+        ('Cancellation', lambda i: Cancellation(i, rider)),
+        ('Pickup', lambda i: Pickup(i, rider, driver)),
+        ('Dropoff', lambda i: Dropoff(i, driver, rider)),
+    ]
+
+
+def run(count):
+    """Measure every kind of entity and return the bytes per entity before
+    and after, keyed by the name of the entity's class.
+
+    'Event' is the cost of a pending event: the mean over the event
+    classes, plus, after, the event queue's entry for the event.
+
+    @type count: int
+    @rtype: dict[str, dict[str, float]]
+
+    >>> results = run(1000)
+    >>> all(results[name]['after'] < results[name]['before']
+    ...     for name in ('Rider', 'Driver', 'RiderRequest', 'Pickup'))
+    True
+    >>> results['Event']['after'] > results['Pickup']['after']
+    True
+    """
+    results = {}
+    for name, make in _factories(count):
+        results[name] = {
+            'before': _measure(lambda i: dict_backed(make(i)), count),
+            'after': _measure(make, count)}
+    events = [results[name] for name in results
+              if name not in ('Rider', 'Driver')]
+    results['Event'] = {
+        key: sum(result[key] for result in events) / len(events)
+        for key in ('before', 'after')}
+    rider = Rider('Ann', Location(1, 1), Location(2, 2), 4)
+    pending = [Cancellation(i, rider) for i in range(count)]
+    queue = PriorityQueue(key=event_time)
+    results['Event']['after'] += _measure(
+        lambda i: queue._entry(pending[i]), count)
+    return results
+
+
+def main(argv=None):
+    """Run the benchmark with the command line arguments <argv> and print a
+    table of results.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=100000,
+                        help='entities of each kind to create')
+    parser.add_argument('--json', help='file to save the results to')
+    args = parser.parse_args(argv)
+
+    results = run(args.count)
+    print('{:<14} {:>8} {:>8} {:>7}'.format(
+        'bytes per', 'before', 'after', 'saved'))
+    for name, result in results.items():
+        print('{:<14} {:8.1f} {:8.1f} {:6.0%}'.format(
+            name, result['before'], result['after'],
+            1 - result['after'] / result['before']))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark the event schedulers in the container module against each other.
+
+The benchmark is the classic "hold" model of a discrete event simulation: the
+queue is filled with <pending> events, and then, <operations> times, the next
+event is removed and a new one is scheduled a short, random time after it,
+the way Event.do schedules Pickups, Dropoffs and Cancellations. Delays are
+drawn from the same ranges as driver travel times and rider patience in
+typical traces.
+
+Run it as a script, e.g.
+
+    python benchmark_scheduler.py --pending 1000000 --operations 2000000
+
+or pass --trace with an event file to start from the timestamps of its
+events instead of random ones.
+"""
+import argparse
+import random
+import time
+from operator import attrgetter
+from container import PriorityQueue, CalendarQueue
+
+
+class _Event:
+    """A stand-in for an Event that only has a timestamp."""
+
+    __slots__ = ('timestamp',)
+
+    def __init__(self, timestamp):
+        """Initialize an event at <timestamp>.
+
+        @type self: _Event
+        @type timestamp: int
+        @rtype: None
+        """
+        self.timestamp = timestamp
+
+
+def _timestamps(trace, pending, horizon, rng):
+    """Return the timestamps of the initial events.
+
+    @type trace: str | None
+        An event file to take the timestamps from, or None for random ones.
+    @type pending: int
+    @type horizon: int
+    @type rng: random.Random
+    @rtype: list[int]
+    """
+    if trace is None:
+        return [rng.randrange(horizon) for _ in range(pending)]
+    timestamps = []
+    with open(trace) as file:
+        for line in file:
+            tokens = line.split()
+            if tokens and not tokens[0].startswith('#'):
+                timestamps.append(int(tokens[0]))
+    return timestamps
+
+
+def hold(queue, timestamps, operations, max_delay, seed):
+    """Run the hold model on <queue> and return the seconds it took.
+
+    @type queue: PriorityQueue | CalendarQueue
+    @type timestamps: list[int]
+    @type operations: int
+    @type max_delay: int
+    @type seed: int
+    @rtype: float
+
+    >>> queue = CalendarQueue(key=attrgetter('timestamp'))
+    >>> hold(queue, [3, 1, 2], 100, 10, 0) >= 0
+    True
+    >>> len(queue)
+    3
+    """
+    rng = random.Random(seed)
+    delays = [rng.randrange(max_delay + 1) for _ in range(1024)]
+    events = [_Event(timestamp) for timestamp in timestamps]
+    start = time.perf_counter()
+    queue.add_many(events)
+    add = queue.add
+    remove = queue.remove
+    for i in range(operations):
+        event = remove()
+        add(_Event(event.timestamp + delays[i & 1023]))
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    """Run the benchmark with the command line arguments <argv> and print a
+    table of results.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pending', type=int, default=100000,
+                        help='events in the queue at any time')
+    parser.add_argument('--operations', type=int, default=500000,
+                        help='remove/add pairs to time')
+    parser.add_argument('--horizon', type=int, default=86400,
+                        help='latest timestamp of the initial events')
+    parser.add_argument('--max-delay', type=int, default=60,
+                        help='latest time after now to schedule at')
+    parser.add_argument('--wheel-size', type=int, default=1024,
+                        help='ticks on the CalendarQueue wheel')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per queue; the best is reported')
+    parser.add_argument('--trace', help='event file to take timestamps from')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    timestamps = _timestamps(args.trace, args.pending, args.horizon,
+                             random.Random(args.seed))
+    key = attrgetter('timestamp')
+    queues = [('PriorityQueue', lambda: PriorityQueue(key=key)),
+              ('CalendarQueue',
+               lambda: CalendarQueue(key=key, size=args.wheel_size))]
+    print('{} pending events, {} operations, delays up to {}'.format(
+        len(timestamps), args.operations, args.max_delay))
+    baseline = None
+    for name, make_queue in queues:
+        best = min(hold(make_queue(), timestamps, args.operations,
+                        args.max_delay, args.seed)
+                   for _ in range(args.repeat))
+        baseline = baseline or best
+        print('{:<14} {:8.3f} s  {:10.0f} ops/s  {:5.2f}x'.format(
+            name, best, args.operations / best, baseline / best))
+
+
+if __name__ == '__main__':
+    main()
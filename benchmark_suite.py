@@ -0,0 +1,406 @@
+"""
+A benchmark suite for the hot paths of the simulation: the event and rider
+queues, the dispatcher, distances, the event file parser and whole runs.
+
+Each benchmark is run at several sizes, from a thousand to a million events
+or from ten to a hundred thousand drivers, to show how it scales. For each
+size, the benchmark is set up afresh and run <warmup> times untimed and then
+<repeat> times timed; the median and 95th percentile of the timed runs are
+reported. Setting up is never timed.
+
+The results can be saved as JSON and compared with those of an earlier run,
+e.g. on another commit, and a benchmark whose median got slower by more than
+<threshold> counts as a regression:
+
+    python benchmark_suite.py --json before.json
+    (change the code)
+    python benchmark_suite.py --baseline before.json --threshold 0.1
+
+The script exits with status 1 if there was a regression.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from container import PriorityQueue, RiderQueue
+from dispatcher import Dispatcher
+from driver import Driver
+from event import create_event_list
+from location import Location, manhattan_distance
+from rider import Rider
+from simulation import Simulation, event_time
+
+# The side of the grid the benchmarks place riders and drivers on.
+GRID = 1000
+
+EVENT_SIZES = (1000, 10000, 100000, 1000000)
+DRIVER_SIZES = (10, 100, 1000, 10000, 100000)
+
+# The number of requests timed by the dispatcher benchmarks.
+REQUESTS = 1000
+
+# The event files written for the parser benchmarks, by number of events.
+_event_files = {}
+
+
+def _location(rng):
+    """Return a random location on the grid.
+
+    @type rng: random.Random
+    @rtype: Location
+    """
+    return Location(rng.randrange(GRID), rng.randrange(GRID))
+
+
+def _riders(count, rng):
+    """Return <count> random riders.
+
+    @type count: int
+    @type rng: random.Random
+    @rtype: list[Rider]
+    """
+    return [Rider('R{}'.format(i), _location(rng), _location(rng),
+                  rng.randint(1, 60)) for i in range(count)]
+
+
+def _dispatcher(count, rng, extent=GRID):
+    """Return a dispatcher with <count> random idle drivers, placed in the
+    <extent> by <extent> corner of the grid.
+
+    @type count: int
+    @type rng: random.Random
+    @type extent: int
+    @rtype: Dispatcher
+    """
+    dispatcher = Dispatcher()
+    for i in range(count):
+        location = Location(rng.randrange(extent), rng.randrange(extent))
+        dispatcher.register(Driver('D{}'.format(i), location,
+                                   rng.randint(1, 5)))
+    return dispatcher
+
+
+def _event_file(count, rng):
+    """Return the name of an event file of <count> random events, a tenth of
+    them driver requests.
+
+    @type count: int
+    @type rng: random.Random
+    @rtype: str
+    """
+    filename = _event_files.get(count)
+    if filename is None:
+        fd, filename = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as file:
+            for i in range(count):
+                m, n = rng.randrange(GRID), rng.randrange(GRID)
+                if i % 10 == 0:
+                    file.write('{} DriverRequest D{} {},{} {}\n'.format(
+                        i // 10, i, m, n, rng.randint(1, 5)))
+                else:
+                    file.write('{} RiderRequest R{} {},{} {},{} {}\n'.format(
+                        i // 10, i, m, n, rng.randrange(GRID),
+                        rng.randrange(GRID), rng.randint(1, 60)))
+        _event_files[count] = filename
+    return filename
+
+
+def bench_priority_queue(size, rng):
+    """Add <size> events to a PriorityQueue one at a time, then remove them.
+
+    @type size: int
+    @type rng: random.Random
+    @rtype: callable
+    """
+    events = create_event_list(_event_file(size, rng))
+    rng.shuffle(events)
+
+    def run():
+        queue = PriorityQueue(key=event_time)
+        for event in events:
+            queue.add(event)
+        while not queue.is_empty():
+            queue.remove()
+    return run
+
+
+def bench_rider_queue(size, rng):
+    """Add <size> riders to a RiderQueue, cancel every other one, then
+    remove the rest.
+
+    @type size: int
+    @type rng: random.Random
+    @rtype: callable
+    """
+    riders = _riders(size, rng)
+
+    def run():
+        queue = RiderQueue()
+        for rider in riders:
+            queue.add(rider)
+        for rider in riders[::2]:
+            queue.remove_rider(rider)
+        while not queue.is_empty():
+            queue.remove()
+    return run
+
+
+def bench_request_driver(size, rng):
+    """Find drivers for REQUESTS riders among <size> idle drivers, making
+    each driver idle again after they are found.
+
+    @type size: int
+    @type rng: random.Random
+    @rtype: callable
+    """
+    dispatcher = _dispatcher(size, rng)
+    riders = _riders(REQUESTS, rng)
+
+    def run():
+        for rider in riders:
+            dispatcher.request_driver(rider).is_idle = True
+    return run
+
+
+def bench_request_driver_sparse(size, rng):
+    """Find drivers for REQUESTS riders spread over the whole grid among
+    <size> idle drivers crowded into a corner a tenth of its side, making
+    each driver idle again after they are found.
+
+    @type size: int
+    @type rng: random.Random
+    @rtype: callable
+    """
+    dispatcher = _dispatcher(size, rng, GRID // 10)
+    riders = _riders(REQUESTS, rng)
+
+    def run():
+        for rider in riders:
+            dispatcher.request_driver(rider).is_idle = True
+    return run
+
+
+def bench_request_rider(size, rng):
+    """Hand REQUESTS waiting riders to <size> drivers that ask for one.
+
+    @type size: int
+    @type rng: random.Random
+    @rtype: callable
+    """
+    dispatcher = _dispatcher(size, rng)
+    drivers = list(dispatcher.drivers.values())
+    for driver in drivers:
+        driver.is_idle = False
+    for rider in _riders(REQUESTS, rng):
+        dispatcher.request_driver(rider)
+
+    def run():
+        for i in range(REQUESTS):
+            dispatcher.request_rider(drivers[i % len(drivers)])
+    return run
+
+
+def bench_manhattan_distance(size, rng):
+    """Measure <size> distances between random locations.
+
+    @type size: int
+    @type rng: random.Random
+    @rtype: callable
+    """
+    pairs = [(_location(rng), _location(rng)) for _ in range(size)]
+
+    def run():
+        for origin, destination in pairs:
+            manhattan_distance(origin, destination)
+    return run
+
+
+def bench_create_event_list(size, rng):
+    """Parse an event file of <size> events.
+
+    @type size: int
+    @type rng: random.Random
+    @rtype: callable
+    """
+    filename = _event_file(size, rng)
+    return lambda: create_event_list(filename)
+
+
+def bench_simulation(size, rng):
+    """Simulate an event file of <size> events.
+
+    @type size: int
+    @type rng: random.Random
+    @rtype: callable
+    """
+    events = create_event_list(_event_file(size, rng))
+    return lambda: Simulation().run(events)
+
+
+# Each benchmark's function and sizes, by name.
+BENCHMARKS = {
+    'priority_queue': (bench_priority_queue, EVENT_SIZES),
+    'rider_queue': (bench_rider_queue, EVENT_SIZES),
+    'request_driver': (bench_request_driver, DRIVER_SIZES),
+    'request_driver_sparse': (bench_request_driver_sparse, DRIVER_SIZES),
+    'request_rider': (bench_request_rider, DRIVER_SIZES),
+    'manhattan_distance': (bench_manhattan_distance, EVENT_SIZES),
+    'create_event_list': (bench_create_event_list, EVENT_SIZES),
+    'simulation': (bench_simulation, EVENT_SIZES),
+}
+
+
+def percentile(values, fraction):
+    """Return the <fraction> percentile of <values> by the nearest-rank
+    method.
+
+    @type values: list[float]
+    @type fraction: float
+    @rtype: float
+
+    >>> percentile([4.0, 1.0, 3.0, 2.0], 0.95)
+    4.0
+    >>> percentile([4.0, 1.0, 3.0, 2.0], 0.5)
+    2.0
+    """
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(fraction * len(ordered))) - 1]
+
+
+def measure(benchmark, size, repeat=5, warmup=1, seed=0):
+    """Time <benchmark> at <size> and return a summary of the timings.
+
+    The benchmark is set up with a fresh random generator seeded with
+    <seed> before each run, so every run does the same work.
+
+    @type benchmark: callable
+    @type size: int
+    @type repeat: int
+    @type warmup: int
+    @type seed: int
+    @rtype: dict[str, float]
+
+    >>> result = measure(bench_manhattan_distance, 100, repeat=3)
+    >>> sorted(result)
+    ['max', 'median', 'min', 'p95', 'repeat']
+    """
+    times = []
+    for i in range(warmup + repeat):
+        run = benchmark(size, random.Random(seed))
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return {'median': statistics.median(times),
+            'p95': percentile(times, 0.95),
+            'min': min(times),
+            'max': max(times),
+            'repeat': repeat}
+
+
+def compare(results, baseline, threshold):
+    """Return the (benchmark, size, ratio) of every result in <results> whose
+    median is more than <threshold> slower than in <baseline>.
+
+    The ratio is the new median over the old one.
+
+    @type results: dict[str, dict[str, dict[str, float]]]
+    @type baseline: dict[str, dict[str, dict[str, float]]]
+    @type threshold: float
+    @rtype: list[(str, str, float)]
+
+    >>> compare({'q': {'10': {'median': 1.5}, '20': {'median': 1.0}}},
+    ...         {'q': {'10': {'median': 1.0}}}, 0.1)
+    [('q', '10', 1.5)]
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            old = baseline.get(name, {}).get(size)
+            if old is not None and old['median'] > 0:
+                ratio = result['median'] / old['median']
+                if ratio > 1 + threshold:
+                    regressions.append((name, size, ratio))
+    return regressions
+
+
+def main(argv=None):
+    """Run the suite with the command line arguments <argv>, print the
+    results, and exit with status 1 if any benchmark regressed.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*',
+                        help='benchmarks to run (default: all): ' +
+                        ', '.join(BENCHMARKS))
+    parser.add_argument('--max-size', type=int,
+                        help='skip sizes larger than this')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per size')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='untimed runs per size before the timed ones')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='file to save the results to')
+    parser.add_argument('--baseline', help='results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown of the median that is a regression')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: {}'.format(name))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+
+    results = {}
+    print('{:<20} {:>8} {:>10} {:>10} {:>8}'.format(
+        'benchmark', 'size', 'median ms', 'p95 ms', 'change'))
+    try:
+        for name in args.benchmarks or BENCHMARKS:
+            benchmark, sizes = BENCHMARKS[name]
+            results[name] = {}
+            for size in sizes:
+                if args.max_size is not None and size > args.max_size:
+                    continue
+                result = measure(benchmark, size, args.repeat, args.warmup,
+                                 args.seed)
+                results[name][str(size)] = result
+                old = baseline.get(name, {}).get(str(size))
+                change = '' if old is None else '{:+.1%}'.format(
+                    result['median'] / old['median'] - 1)
+                print('{:<20} {:>8} {:>10.3f} {:>10.3f} {:>8}'.format(
+                    name, size, result['median'] * 1000, result['p95'] * 1000,
+                    change))
+    finally:
+        # The event files can hold a million events each, so they are
+        # removed even if a benchmark fails or the run is interrupted.
+        for filename in _event_files.values():
+            os.remove(filename)
+        _event_files.clear()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, file, indent=2)
+    regressions = compare(results, baseline, args.threshold)
+    for name, size, ratio in regressions:
+        print('REGRESSION: {} at {} is {:.2f}x slower'.format(
+            name, size, ratio))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""
+The checkpoint module saves the full state of a running Simulation to disk
+now and then, so that a long run that dies can resume from where it was
+instead of from the start.
+
+A checkpoint holds the event queue, the dispatcher (with its drivers and
+waiting riders) and the monitor, pickled together so that the riders and
+drivers shared by events, the dispatcher and each other stay shared when
+they are loaded, and compressed with zlib. It is written to a temporary
+file and renamed into place, so a checkpoint is either complete or absent,
+never half written.
+
+Where os.fork is available, each checkpoint is written by a forked child
+process, which sees the state as it was when it was forked while the
+simulation goes on in the parent, so the run only stalls for the fork. A
+checkpoint that falls due while the last one is still being written is
+skipped. A Checkpointer for a new run first deletes the checkpoints left in
+its directory by earlier runs, and only ever deletes the ones it wrote
+itself after that.
+
+Every checkpoint records which event file it was taken of, so that a run is
+not resumed on another one.
+
+=== Constants ===
+@type PREFIX: str
+    The start of the name of every checkpoint file.
+@type SUFFIX: str
+    The end of the name of every checkpoint file.
+"""
+import glob
+import os
+import pickle
+import traceback
+import zlib
+
+PREFIX = 'checkpoint-'
+SUFFIX = '.pkl.z'
+
+
+def save_state(filename, state):
+    """Write <state> to the checkpoint file <filename>, atomically.
+
+    @type filename: str
+    @type state: dict[str, object]
+    @rtype: None
+    """
+    data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL), 1)
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, filename)
+
+
+def trace_identity(filename):
+    """Return what identifies the event file <filename>: its real path, size
+    and modification time.
+
+    @type filename: str
+    @rtype: (str, int, int)
+    """
+    status = os.stat(filename)
+    return os.path.realpath(filename), status.st_size, status.st_mtime_ns
+
+
+def load_state(filename):
+    """Return the state saved in the checkpoint file <filename>.
+
+    @type filename: str
+    @rtype: dict[str, object]
+
+    >>> import tempfile
+    >>> from location import Location
+    >>> from rider import Rider
+    >>> rider = Rider('Ann', Location(1, 1), Location(2, 2), 10)
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     filename = os.path.join(directory, 'state' + SUFFIX)
+    ...     save_state(filename, {'waiting': [rider], 'first': rider})
+    ...     state = load_state(filename)
+    >>> state['waiting'][0] is state['first']
+    True
+    """
+    with open(filename, 'rb') as file:
+        return pickle.loads(zlib.decompress(file.read()))
+
+
+def checkpoints(directory):
+    """Return the names of the checkpoint files in <directory>, oldest
+    first.
+
+    @type directory: str
+    @rtype: list[str]
+    """
+    return sorted(glob.glob(os.path.join(directory, PREFIX + '*' + SUFFIX)))
+
+
+def latest_checkpoint(directory):
+    """Return the name of the newest checkpoint file in <directory>, or None
+    if there is none.
+
+    @type directory: str
+    @rtype: str | None
+    """
+    found = checkpoints(directory)
+    return found[-1] if found else None
+
+
+class Counted:
+    """An iterator that counts the items taken from another one.
+
+    === Attributes ===
+    @type count: int
+        The number of items taken so far.
+    @type exhausted: bool
+        Whether the other iterator has run out.
+
+    >>> items = Counted(iter('ab'))
+    >>> next(items), items.count, items.exhausted
+    ('a', 1, False)
+    >>> list(items), items.count, items.exhausted
+    (['b'], 2, True)
+    """
+
+    # === Private Attributes ===
+    # @type _items: iterator
+    #     The iterator counted.
+
+    def __init__(self, items):
+        """Initialize a Counted over <items>.
+
+        @type self: Counted
+        @type items: iterator
+        @rtype: None
+        """
+        self._items = iter(items)
+        self.count = 0
+        self.exhausted = False
+
+    def __iter__(self):
+        """Return this iterator.
+
+        @type self: Counted
+        @rtype: Counted
+        """
+        return self
+
+    def __next__(self):
+        """Return the next item.
+
+        @type self: Counted
+        @rtype: object
+        """
+        try:
+            item = next(self._items)
+        except StopIteration:
+            self.exhausted = True
+            raise
+        self.count += 1
+        return item
+
+
+class Checkpointer:
+    """Writes the checkpoints of a simulation to a directory.
+
+    === Attributes ===
+    @type directory: str
+        The directory the checkpoints are written to.
+    @type every: int
+        The number of events done between checkpoints.
+    @type keep: int
+        The number of newest checkpoints kept; older ones are deleted.
+    @type background: bool
+        Whether checkpoints are written by forked child processes.
+    @type written: int
+        The number of checkpoints written.
+    @type skipped: int
+        The number of checkpoints skipped because the last one was still
+        being written.
+    @type failed: int
+        The number of checkpoints that could not be written.
+    """
+
+    # === Private Attributes ===
+    # @type _child: int | None
+    #     The process id of the child writing a checkpoint, if any.
+    # @type _writing: str | None
+    #     The name of the checkpoint file the child is writing, if any.
+    # @type _files: list[str]
+    #     The checkpoint files this Checkpointer has written and not yet
+    #     deleted, oldest first.
+
+    def __init__(self, directory, every=100000, keep=2, background=True,
+                 fresh=True):
+        """Initialize a Checkpointer, creating <directory> if need be.
+
+        @type self: Checkpointer
+        @type directory: str
+        @type every: int
+        @type keep: int
+        @type background: bool
+            Ignored where os.fork is not available.
+        @type fresh: bool
+            Whether the checkpoints already in <directory> are deleted, as
+            for a new run, instead of kept to resume from.
+        @rtype: None
+        """
+        os.makedirs(directory, exist_ok=True)
+        if fresh:
+            for old in checkpoints(directory):
+                os.remove(old)
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+        self.background = background and hasattr(os, 'fork')
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self._child = None
+        self._writing = None
+        self._files = []
+
+    def save(self, state, processed):
+        """Write a checkpoint of <state>, taken after <processed> events, and
+        return True, or return False if the last checkpoint is still being
+        written.
+
+        @type self: Checkpointer
+        @type state: dict[str, object]
+        @type processed: int
+        @rtype: bool
+
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as directory:
+        ...     save_state(os.path.join(directory, PREFIX + '99' + SUFFIX), {})
+        ...     checkpointer = Checkpointer(directory, keep=1)
+        ...     for processed in [10, 20]:
+        ...         checkpointer.save({'processed': processed}, processed)
+        ...         checkpointer.wait()
+        ...     names = [os.path.basename(name)
+        ...              for name in checkpoints(directory)]
+        True
+        True
+        >>> names, checkpointer.written, checkpointer.failed
+        (['checkpoint-000000000020.pkl.z'], 2, 0)
+        """
+        if self._busy():
+            self.skipped += 1
+            return False
+        filename = os.path.join(self.directory, '{}{:012d}{}'.format(
+            PREFIX, processed, SUFFIX))
+        if not self.background:
+            try:
+                save_state(filename, state)
+            except OSError:
+                traceback.print_exc()
+                self._finished(filename, False)
+            else:
+                self._finished(filename, True)
+            return True
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                save_state(filename, state)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        self._child = pid
+        self._writing = filename
+        return True
+
+    def _finished(self, filename, ok):
+        """Record that writing the checkpoint <filename> has finished, and
+        whether it was <ok>, and delete the checkpoints this Checkpointer
+        wrote beyond the newest <keep>.
+
+        @type self: Checkpointer
+        @type filename: str
+        @type ok: bool
+        @rtype: None
+        """
+        if not ok:
+            self.failed += 1
+            return
+        self.written += 1
+        self._files.append(filename)
+        while len(self._files) > self.keep:
+            os.remove(self._files.pop(0))
+
+    def _reap(self, options):
+        """Wait for the child writing a checkpoint with waitpid <options>,
+        and return True iff it has exited.
+
+        @type self: Checkpointer
+        @type options: int
+        @rtype: bool
+        """
+        pid, status = os.waitpid(self._child, options)
+        if pid == 0:
+            return False
+        self._finished(self._writing, os.WIFEXITED(status) and
+                       os.WEXITSTATUS(status) == 0)
+        self._child = None
+        self._writing = None
+        return True
+
+    def _busy(self):
+        """Return True iff a child is still writing a checkpoint.
+
+        @type self: Checkpointer
+        @rtype: bool
+        """
+        return self._child is not None and not self._reap(os.WNOHANG)
+
+    def wait(self):
+        """Wait until the checkpoint being written, if any, is finished.
+
+        @type self: Checkpointer
+        @rtype: None
+        """
+        if self._child is not None:
+            self._reap(0)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
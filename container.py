@@ -1,5 +1,12 @@
+from collections import OrderedDict, deque
+from heapq import heapify, heappop, heappush
+from itertools import chain
 from rider import *
 
+# The fraction of the entries in a queue that may be tombstoned before they
+# are all purged at once.
+COMPACT_FRACTION = 0.5
+
 
 class Container:
     """A container that holds objects.
@@ -32,6 +39,15 @@ class Container:
         """
         raise NotImplementedError("Implemented in a subclass")
 
+    def cancel(self, item):
+        """Tombstone <item>, so that it is never removed from this Container.
+
+        @type self: Container
+        @type item: Object
+        @rtype: None
+        """
+        raise NotImplementedError("Implemented in a subclass")
+
 
 class PriorityQueue(Container):
     """A queue of items that operates in priority order.
@@ -42,28 +58,67 @@ class PriorityQueue(Container):
     removed.
 
     Priority is defined by the rich comparison methods for the objects in the
-    container (__lt__, __le__, __gt__, __ge__).
+    container (__lt__, __le__, __gt__, __ge__), or by the value returned by
+    <key> for each object if a key function was given.
 
     If x < y, then x has a *HIGHER* priority than y.
 
     All objects in the container must be of the same type.
+
+    An item that will no longer be needed, such as the Cancellation of a
+    rider who has been picked up, can be tombstoned with cancel. Tombstoned
+    items stay in the heap and are skipped when they reach the front, until
+    they make up COMPACT_FRACTION of the heap and are purged in one pass.
     """
 
     # === Private Attributes ===
-    # @type _items: list
-    #     The items stored in the priority queue.
+    # @type _items: list[tuple]
+    #     A binary min-heap of (priority, sequence number, item) entries.
+    # @type _key: callable | None
+    #     The function used to compute the priority of an item, or None if
+    #     items are compared directly.
+    # @type _counter: int
+    #     The sequence number given to the next inserted item.
+    # @type _dead: int
+    #     The number of tombstoned items in _items.
+    # @type _stats: dict[str, int]
+    #     The counters returned by stats.
     #
     # === Representation Invariants ===
-    # _items is a sorted list, where the first item in the queue is the
-    # item with the highest priority.
+    # _items satisfies the heap invariant, so _items[0] holds the item with
+    # the highest priority. Sequence numbers are unique and increase with
+    # insertion order, which makes equal priorities leave in FIFO order.
+    # Exactly _dead items in _items have a true cancelled attribute.
 
-    def __init__(self):
+    def __init__(self, key=None):
         """Initialize an empty PriorityQueue.
 
         @type self: PriorityQueue
+        @type key: callable | None
+            A function returning the priority of an item. Use it when items
+            can be ranked by a cheap value such as an Event's timestamp.
         @rtype: None
         """
         self._items = []
+        self._key = key
+        self._counter = 0
+        self._dead = 0
+        self._stats = _tombstone_stats()
+
+    def _entry(self, item):
+        """Return the heap entry for <item> and advance the sequence number.
+
+        @type self: PriorityQueue
+        @type item: object
+        @rtype: tuple
+        """
+        if self._key is None:
+            priority = _Priority(item)
+        else:
+            priority = self._key(item)
+        entry = (priority, self._counter, item)
+        self._counter += 1
+        return entry
 
     def remove(self):
         """Remove and return the next item from this PriorityQueue.
@@ -87,7 +142,123 @@ class PriorityQueue(Container):
         >>> pq.remove()
         'yellow'
         """
-        return self._items.pop(0)
+        if self._dead:
+            self._skip_dead()
+        return heappop(self._items)[2]
+
+    def __len__(self):
+        """Return the number of items in this PriorityQueue, not counting
+        tombstoned ones.
+
+        @type self: PriorityQueue
+        @rtype: int
+        """
+        return len(self._items) - self._dead
+
+    def __iter__(self):
+        """Return an iterator over the items in this PriorityQueue that are
+        not tombstoned, in no particular order.
+
+        @type self: PriorityQueue
+        @rtype: iterator[object]
+
+        >>> pq = PriorityQueue(key=len)
+        >>> pq.add_many(["yellow", "blue", "red"])
+        >>> sorted(pq)
+        ['blue', 'red', 'yellow']
+        """
+        items = (entry[2] for entry in self._items)
+        if self._dead:
+            return (item for item in items if not item.cancelled)
+        return items
+
+    def cancel(self, item):
+        """Tombstone <item>, so that it is never removed from this
+        PriorityQueue.
+
+        The item's cancelled attribute is set to True, and it is skipped when
+        it reaches the front of the queue.
+
+        Precondition: <item> is in <self>, and has a cancelled attribute.
+
+        @type self: PriorityQueue
+        @type item: object
+        @rtype: None
+
+        >>> from types import SimpleNamespace
+        >>> pq = PriorityQueue(key=lambda item: item.t)
+        >>> a, b, c = [SimpleNamespace(t=t, cancelled=False) for t in (1, 2, 3)]
+        >>> pq.add_many([a, b, c])
+        >>> pq.cancel(a)
+        >>> len(pq), pq.remove() is b
+        (2, True)
+        >>> pq.stats()['skipped']
+        1
+        """
+        if item.cancelled:
+            return
+        item.cancelled = True
+        self._dead += 1
+        self._stats['cancelled'] += 1
+        if self._dead > COMPACT_FRACTION * len(self._items):
+            self._compact()
+
+    def _skip_dead(self):
+        """Pop the tombstoned items at the front of this PriorityQueue.
+
+        @type self: PriorityQueue
+        @rtype: None
+        """
+        items = self._items
+        while self._dead and items and items[0][2].cancelled:
+            heappop(items)
+            self._dead -= 1
+            self._stats['skipped'] += 1
+
+    def _compact(self):
+        """Remove every tombstoned item from this PriorityQueue.
+
+        @type self: PriorityQueue
+        @rtype: None
+        """
+        live = [entry for entry in self._items
+                if not entry[2].cancelled]
+        heapify(live)
+        self._stats['compacted'] += len(self._items) - len(live)
+        self._stats['compactions'] += 1
+        self._items = live
+        self._dead = 0
+
+    def stats(self):
+        """Return counters of the tombstoned items of this PriorityQueue:
+        how many were 'cancelled', how many were 'skipped' at the front of
+        the queue and how many were 'compacted' away, and the number of
+        'compactions'.
+
+        @type self: PriorityQueue
+        @rtype: dict[str, int]
+        """
+        return dict(self._stats)
+
+    def peek(self):
+        """Return the next item from this PriorityQueue without removing it.
+
+        Precondition: <self> should not be empty.
+
+        @type self: PriorityQueue
+        @rtype: object
+
+        >>> pq = PriorityQueue()
+        >>> pq.add("red")
+        >>> pq.add("blue")
+        >>> pq.peek()
+        'blue'
+        >>> pq.remove()
+        'blue'
+        """
+        if self._dead:
+            self._skip_dead()
+        return self._items[0][2]
 
     def is_empty(self):
         """
@@ -103,6 +274,8 @@ class PriorityQueue(Container):
         >>> pq.is_empty()
         False
         """
+        if self._dead:
+            self._skip_dead()
         return len(self._items) == 0
 
     def add(self, item):
@@ -112,17 +285,37 @@ class PriorityQueue(Container):
         @type item: object
         @rtype: None
 
-        >>> pq = PriorityQueue()
+        >>> pq = PriorityQueue(key=len)
         >>> pq.add("yellow")
         >>> pq.add("blue")
         >>> pq.add("red")
         >>> pq.add("green")
-        >>> pq._items
-        ['blue', 'green', 'red', 'yellow']
+        >>> [pq.remove() for _ in range(4)]
+        ['red', 'blue', 'green', 'yellow']
         """
         if item is not None:
-            self._items.append(item)
-            self._items.sort()
+            heappush(self._items, self._entry(item))
+
+    def add_many(self, items):
+        """Add every item in <items> to this PriorityQueue.
+
+        This is equivalent to adding the items one at a time in iteration
+        order, but it rebuilds the heap once in linear time instead of
+        sifting every item in. Use it to load the initial list of events.
+
+        @type self: PriorityQueue
+        @type items: iterable[object]
+        @rtype: None
+
+        >>> pq = PriorityQueue(key=len)
+        >>> pq.add("cyan")
+        >>> pq.add_many(["yellow", "blue", None, "red", "green"])
+        >>> [pq.remove() for _ in range(5)]
+        ['red', 'cyan', 'blue', 'green', 'yellow']
+        """
+        self._items.extend(self._entry(item) for item in items
+                           if item is not None)
+        heapify(self._items)
 
     def __str__(self):
         """Return a string representation of all objects in this PriorityQueue.
@@ -139,36 +332,420 @@ class PriorityQueue(Container):
         'Priority queue: blue, green, red, yellow'
         """
         obj_list = []
-        for item in self._items:
-            obj_list.append(str(item))
+        for entry in sorted(self._items):
+            if not (self._dead and entry[2].cancelled):
+                obj_list.append(str(entry[2]))
 
         string_list = ', '.join(obj_list)
         return "Priority queue: {}".format(string_list)
 
 
+class CalendarQueue(Container):
+    """A queue of items with non-negative integer priorities, such as the
+    timestamps of Events, that operates in priority order.
+
+    Items are removed in order of increasing priority, and ties are resolved
+    in FIFO order, exactly like a PriorityQueue with the same key. Unlike a
+    PriorityQueue, adding and removing items takes amortized constant time.
+
+    The queue is a timing wheel: a ring of FIFO buckets, one per tick, that
+    covers the <size> ticks from the current tick on. Items further in the
+    future wait in an overflow heap and move onto the wheel as it turns.
+    Removing from an empty stretch of wheel jumps straight to the next item.
+
+    Items are best added with a priority no lower than that of the last item
+    removed, which holds for events spawned by Event.do. Adding one with a
+    lower priority turns the wheel back, which takes time proportional to
+    <size>.
+
+    Items can be tombstoned with cancel, as in a PriorityQueue.
+    """
+
+    # === Private Attributes ===
+    # @type _key: callable
+    #     The function used to compute the priority of an item.
+    # @type _buckets: list[deque]
+    #     The wheel. The items with priority t are in _buckets[t % size].
+    # @type _mask: int
+    #     The number of buckets minus one.
+    # @type _now: int
+    #     The current tick.
+    # @type _on_wheel: int
+    #     The number of items in _buckets.
+    # @type _overflow: list[tuple]
+    #     A binary min-heap of (priority, sequence number, item) entries.
+    # @type _counter: int
+    #     The sequence number given to the next item put in _overflow.
+    # @type _dead: int
+    #     The number of tombstoned items in _buckets and _overflow.
+    # @type _stats: dict[str, int]
+    #     The counters returned by stats.
+    #
+    # === Representation Invariants ===
+    # Every item in _buckets has a priority in [_now, _now + size), and every
+    # item in _overflow has a priority of at least _now + size. Exactly _dead
+    # items in _buckets and _overflow have a true cancelled attribute.
+
+    def __init__(self, key, size=1024):
+        """Initialize an empty CalendarQueue.
+
+        @type self: CalendarQueue
+        @type key: callable
+            A function returning the priority of an item, a non-negative int.
+        @type size: int
+            The number of ticks on the wheel, rounded up to a power of two.
+            Choose it to cover how far ahead most items are scheduled.
+        @rtype: None
+        """
+        size = 1 << max(0, size - 1).bit_length()
+        self._key = key
+        self._buckets = [deque() for _ in range(size)]
+        self._mask = size - 1
+        self._now = 0
+        self._on_wheel = 0
+        self._overflow = []
+        self._counter = 0
+        self._dead = 0
+        self._stats = _tombstone_stats()
+
+    def add(self, item):
+        """Add <item> to this CalendarQueue.
+
+        @type self: CalendarQueue
+        @type item: object
+        @rtype: None
+
+        >>> cq = CalendarQueue(key=len, size=4)
+        >>> for word in ["yellow", "blue", "red", "green", "cyan"]:
+        ...     cq.add(word)
+        >>> [cq.remove() for _ in range(5)]
+        ['red', 'blue', 'cyan', 'green', 'yellow']
+        """
+        if item is None:
+            return
+        tick = self._key(item)
+        if tick < self._now:
+            self._rewind(tick)
+        elif self._on_wheel == 0 and not self._overflow:
+            self._now = tick
+        if tick - self._now <= self._mask:
+            self._buckets[tick & self._mask].append(item)
+            self._on_wheel += 1
+        else:
+            heappush(self._overflow, (tick, self._counter, item))
+            self._counter += 1
+
+    def add_many(self, items):
+        """Add every item in <items> to this CalendarQueue, in order.
+
+        The items are sorted first, so that an unsorted batch such as the
+        initial list of events does not make the wheel turn back.
+
+        @type self: CalendarQueue
+        @type items: iterable[object]
+        @rtype: None
+        """
+        for item in sorted((item for item in items if item is not None),
+                           key=self._key):
+            self.add(item)
+
+    def _rewind(self, tick):
+        """Turn the wheel back to <tick>, moving the items that are no longer
+        within reach of the wheel to the overflow heap.
+
+        This only happens when an item is added with a lower priority than
+        the current tick, e.g. while loading an unsorted list of events.
+
+        @type self: CalendarQueue
+        @type tick: int
+        @rtype: None
+        """
+        mask = self._mask
+        for later in range(max(self._now, tick + mask + 1),
+                           self._now + mask + 1):
+            bucket = self._buckets[later & mask]
+            while bucket:
+                heappush(self._overflow,
+                         (later, self._counter, bucket.popleft()))
+                self._counter += 1
+                self._on_wheel -= 1
+        self._now = tick
+
+    def _advance(self):
+        """Turn the wheel to the next tick that has an item.
+
+        Precondition: <self> should not be empty.
+
+        @type self: CalendarQueue
+        @rtype: None
+        """
+        buckets = self._buckets
+        mask = self._mask
+        overflow = self._overflow
+        while not buckets[self._now & mask]:
+            if self._on_wheel:
+                self._now += 1
+            else:
+                # Nothing on the wheel, so skip ahead to the next item.
+                self._now = overflow[0][0]
+            # Move the items that are now within reach onto the wheel.
+            while overflow and overflow[0][0] - self._now <= mask:
+                tick, _, item = heappop(overflow)
+                buckets[tick & mask].append(item)
+                self._on_wheel += 1
+
+    def peek(self):
+        """Return the next item from this CalendarQueue without removing it.
+
+        Precondition: <self> should not be empty.
+
+        @type self: CalendarQueue
+        @rtype: object
+        """
+        if self._dead:
+            self._skip_dead()
+        self._advance()
+        return self._buckets[self._now & self._mask][0]
+
+    def remove(self):
+        """Remove and return the next item from this CalendarQueue.
+
+        Precondition: <self> should not be empty.
+
+        @type self: CalendarQueue
+        @rtype: object
+
+        >>> cq = CalendarQueue(key=int, size=2)
+        >>> cq.add_many(['9000', '3', '2', '3'])
+        >>> [cq.remove() for _ in range(3)]
+        ['2', '3', '3']
+        >>> cq.add('9000')
+        >>> [cq.remove() for _ in range(2)]
+        ['9000', '9000']
+        >>> cq.is_empty()
+        True
+        """
+        if self._dead:
+            self._skip_dead()
+        self._advance()
+        self._on_wheel -= 1
+        return self._buckets[self._now & self._mask].popleft()
+
+    def is_empty(self):
+        """Return True iff this CalendarQueue is empty.
+
+        @type self: CalendarQueue
+        @rtype: bool
+        """
+        if self._dead:
+            self._skip_dead()
+        return self._on_wheel == 0 and not self._overflow
+
+    def __len__(self):
+        """Return the number of items in this CalendarQueue, not counting
+        tombstoned ones.
+
+        @type self: CalendarQueue
+        @rtype: int
+        """
+        return self._on_wheel + len(self._overflow) - self._dead
+
+    def __iter__(self):
+        """Return an iterator over the items in this CalendarQueue that are
+        not tombstoned, in no particular order.
+
+        @type self: CalendarQueue
+        @rtype: iterator[object]
+
+        >>> cq = CalendarQueue(key=len, size=4)
+        >>> cq.add_many(["yellow", "blue", "red"])
+        >>> sorted(cq)
+        ['blue', 'red', 'yellow']
+        """
+        items = chain(chain.from_iterable(self._buckets),
+                      (entry[2] for entry in self._overflow))
+        if self._dead:
+            return (item for item in items if not item.cancelled)
+        return items
+
+    def cancel(self, item):
+        """Tombstone <item>, so that it is never removed from this
+        CalendarQueue.
+
+        The item's cancelled attribute is set to True, and it is skipped when
+        it reaches the front of the queue.
+
+        Precondition: <item> is in <self>, and has a cancelled attribute.
+
+        @type self: CalendarQueue
+        @type item: object
+        @rtype: None
+
+        >>> from types import SimpleNamespace
+        >>> cq = CalendarQueue(key=lambda item: item.t, size=2)
+        >>> a, b, c = [SimpleNamespace(t=t, cancelled=False) for t in (1, 9, 9)]
+        >>> cq.add_many([a, b, c])
+        >>> cq.cancel(b)
+        >>> cq.cancel(a)
+        >>> len(cq), cq.remove() is c, cq.is_empty()
+        (1, True, True)
+        >>> sorted(cq.stats().items())
+        [('cancelled', 2), ('compacted', 0), ('compactions', 0), ('skipped', 2)]
+        """
+        if item.cancelled:
+            return
+        item.cancelled = True
+        self._dead += 1
+        self._stats['cancelled'] += 1
+        # Compacting visits every bucket, so count them in the queue's size.
+        if self._dead > COMPACT_FRACTION * (self._on_wheel + self._mask + 1 +
+                                            len(self._overflow)):
+            self._compact()
+
+    def _skip_dead(self):
+        """Remove the tombstoned items at the front of this CalendarQueue.
+
+        @type self: CalendarQueue
+        @rtype: None
+        """
+        while self._dead and (self._on_wheel or self._overflow):
+            self._advance()
+            bucket = self._buckets[self._now & self._mask]
+            if not bucket[0].cancelled:
+                return
+            bucket.popleft()
+            self._on_wheel -= 1
+            self._dead -= 1
+            self._stats['skipped'] += 1
+
+    def _compact(self):
+        """Remove every tombstoned item from this CalendarQueue.
+
+        @type self: CalendarQueue
+        @rtype: None
+        """
+        before = self._on_wheel + len(self._overflow)
+        self._on_wheel = 0
+        for index, bucket in enumerate(self._buckets):
+            if bucket:
+                bucket = self._buckets[index] = deque(
+                    item for item in bucket if not item.cancelled)
+                self._on_wheel += len(bucket)
+        self._overflow = [entry for entry in self._overflow
+                          if not entry[2].cancelled]
+        heapify(self._overflow)
+        self._stats['compacted'] += before - self._on_wheel - \
+            len(self._overflow)
+        self._stats['compactions'] += 1
+        self._dead = 0
+
+    def stats(self):
+        """Return counters of the tombstoned items of this CalendarQueue, as
+        described in PriorityQueue.stats.
+
+        @type self: CalendarQueue
+        @rtype: dict[str, int]
+        """
+        return dict(self._stats)
+
+
+def _tombstone_stats():
+    """Return a new set of counters for the tombstoned items of a queue.
+
+    @rtype: dict[str, int]
+    """
+    return {'cancelled': 0, 'skipped': 0, 'compacted': 0, 'compactions': 0}
+
+
+class _Priority:
+    """The priority of an item in a PriorityQueue without a key function.
+
+    Heap entries are compared as tuples, and tuple comparison checks == before
+    <. Events define == differently from <, so the item is wrapped in an
+    object whose == is derived from the item's < instead.
+
+    === Attributes ===
+    @type item: object
+        The wrapped item.
+    """
+
+    __slots__ = ('item',)
+
+    def __init__(self, item):
+        """Initialize the priority of <item>.
+
+        @type self: _Priority
+        @type item: object
+        @rtype: None
+        """
+        self.item = item
+
+    def __lt__(self, other):
+        """Return True iff this priority is higher than <other>'s.
+
+        @type self: _Priority
+        @type other: _Priority
+        @rtype: bool
+        """
+        return self.item < other.item
+
+    def __eq__(self, other):
+        """Return True iff neither priority is higher than the other.
+
+        @type self: _Priority
+        @type other: _Priority
+        @rtype: bool
+
+        >>> _Priority(3) == _Priority(3)
+        True
+        >>> _Priority(3) == _Priority(4)
+        False
+        """
+        return not (self.item < other.item or other.item < self.item)
+
+
 class RiderQueue(Container):
     """A first-in, first-out (FIFO) queue.
 
     Riders are removed from the queue according to rider that was inserted
-    *earlier*.
+    *earlier*. A rider can also be taken out of the middle of the queue by
+    their id, e.g. when they cancel their request.
     """
 
+    # === Private Attributes ===
+    # @type _riders: OrderedDict[str, Rider]
+    #     The waiting riders keyed by rider id, in the order they were added.
+
     def __init__(self):
         """Create and initialize new RiderQueue self.
 
         @type self: RiderQueue
         @rtype: None
         """
-        self._riders = []
+        self._riders = OrderedDict()
 
     def add(self, rider):
         """Add object at the back of RiderQueue self.
 
+        If a rider with the same id is already waiting, <rider> replaces them
+        and takes their place in the queue, so the newest request of a rider
+        is the one served.
+
         @type self: RiderQueue
         @type rider: Rider
         @rtype: None
+
+        >>> r = RiderQueue()
+        >>> r.add(Rider('Danny', Location(4,4), Location(9,0), 23))
+        >>> r.add(Rider('Bart', Location(3,3), Location(2,3), 2))
+        >>> r.add(Rider('Danny', Location(4,4), Location(1,1), 5))
+        >>> len(r)
+        2
+        >>> rider = r.remove()
+        >>> rider.rider_id, rider.destination.coordinate
+        ('Danny', (1, 1))
         """
-        self._riders.append(rider)
+        self._riders[rider.rider_id] = rider
 
     def remove(self):
         """Remove and return front object from RiderQueue self.
@@ -184,7 +761,36 @@ class RiderQueue(Container):
         >>> str(r.remove())
         'RiderID: Danny, Origin: (4, 4), Destination: (9, 0), Status: waiting, Patience: 23'
         """
-        return self._riders.pop(0)
+        return self._riders.popitem(last=False)[1]
+
+    def remove_rider(self, rider):
+        """Remove <rider> from RiderQueue self and return them, or return None
+        if they are not waiting.
+
+        A newer request of the same rider, which replaced <rider> in the
+        queue, is left where it is.
+
+        @type self: RiderQueue
+        @type rider: Rider
+        @rtype: Rider | None
+
+        >>> r = RiderQueue()
+        >>> danny = Rider('Danny', Location(4,4), Location(9,0), 23)
+        >>> r.add(danny)
+        >>> r.add(Rider('Bart', Location(3,3), Location(2,3), 2))
+        >>> r.remove_rider(danny).rider_id
+        'Danny'
+        >>> r.remove_rider(danny) is None
+        True
+        >>> r.add(Rider('Danny', Location(4,4), Location(1,1), 5))
+        >>> r.remove_rider(danny) is None
+        True
+        >>> [r.remove().rider_id for _ in range(len(r))]
+        ['Bart', 'Danny']
+        """
+        if self._riders.get(rider.rider_id) is not rider:
+            return None
+        return self._riders.pop(rider.rider_id)
 
     def is_empty(self):
         """Return whether RiderQueue self is empty.
@@ -193,15 +799,23 @@ class RiderQueue(Container):
         @rtype: bool
 
         >>> q = RiderQueue()
-        >>> q.add(5)
+        >>> q.add(Rider('Danny', Location(4,4), Location(9,0), 23))
         >>> q.is_empty()
         False
-        >>> q.remove()
-        5
+        >>> q.remove().rider_id
+        'Danny'
         >>> q.is_empty()
         True
         """
-        return self._riders == []
+        return not self._riders
+
+    def __len__(self):
+        """Return the number of riders waiting in RiderQueue self.
+
+        @type self: RiderQueue
+        @rtype: int
+        """
+        return len(self._riders)
 
     def __str__(self):
         """Return a string representation of all riders in this RiderQueue.
@@ -218,7 +832,7 @@ class RiderQueue(Container):
         'RiderID: Danny, Origin: (4, 4), Destination: (9, 0), Status: waiting, Patience: 23, RiderID: Bartholomew, Origin: (3, 3), Destination: (2, 3), Status: waiting, Patience: 2'
         """
         rider_list = []
-        for rider in self._riders:
+        for rider in self._riders.values():
             rider_list.append(str(rider))
 
         string_list = ', '.join(rider_list)
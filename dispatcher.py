@@ -2,6 +2,15 @@ from location import Location
 from driver import *
 from rider import Rider
 from container import *
+from grid import DriverGrid
+from matching import assign, eta_matrix
+
+# The largest number of (rider, driver) pairs scored at once. Larger batches
+# are matched in chunks, each rider with only the drivers near them.
+MAX_BATCH_PAIRS = 250000
+
+# The number of nearby drivers each rider of a chunked batch is scored with.
+BATCH_CANDIDATES = 8
 
 
 class Dispatcher:
@@ -13,6 +22,11 @@ class Dispatcher:
     list for the next available driver. A rider that has not yet been
     picked up by a driver may cancel their request.
 
+    In batch mode, the dispatcher does not assign drivers one rider at a
+    time. Rider requests are collected for <batch_window> time units instead,
+    and the whole batch is then matched with the idle drivers so that the
+    total time to pick everyone up is as small as possible.
+
     When a driver requests a rider, the dispatcher assigns a rider from
     the waiting list to the driver. If there is no rider on the waiting list
     the dispatcher does nothing. Once a driver requests a rider, the driver
@@ -20,20 +34,48 @@ class Dispatcher:
     rider requests.
 
     === Attributes ===
-    @type driver_list: list
-         A list of drivers.
+    @type drivers: dict[str, Driver]
+         The registered drivers keyed by identifier, in registration order.
     @type rq: RiderQueue
-         A sorted based on a priority queue of riders.
+         The riders waiting for a driver, in the order they requested one.
+    @type batch_window: int | None
+         The number of time units rider requests are collected for before
+         they are matched as a batch, or None to match each request as it
+         arrives. A window of 0 batches the requests made at the same time.
+    @type scheduler: Container | None
+         The event queue of the simulation, in which the Cancellations of
+         riders who have been picked up are tombstoned, or None to leave
+         them to be done.
     """
 
-    def __init__(self):
+    # === Private Attributes ===
+    # @type _idle: DriverGrid
+    #     A spatial index over the registered drivers that are idle. This is
+    #     the idle set; it is kept up to date by update_driver.
+    # @type _ranks: dict[str, int]
+    #     The order in which each registered driver was registered, keyed by
+    #     driver identifier. Used to break ties between equally fast drivers.
+    # @type _batch: RiderQueue
+    #     The riders collected for the next batch, in batch mode.
+    # @type _cancellations: dict[str, Cancellation]
+    #     The pending Cancellation of each waiting rider, keyed by rider id.
+
+    def __init__(self, batch_window=None):
         """Initialize a Dispatcher.
 
         @type self: Dispatcher
+        @type batch_window: int | None
+            Precondition: batch_window is None or batch_window >= 0
         @rtype: None
         """
-        self.driver_list = []
+        self.drivers = {}
         self.rq = RiderQueue()
+        self._idle = DriverGrid()
+        self._ranks = {}
+        self.batch_window = batch_window
+        self._batch = RiderQueue()
+        self.scheduler = None
+        self._cancellations = {}
 
     def __str__(self):
         """Return a string representation of the dispatcher.
@@ -49,7 +91,7 @@ class Dispatcher:
         "Drivers: ['Driver ID: Jum, Current Location: (4, 5), Speed: 10']\\nAvailable riders: []"
         """
         string_list_driver = []
-        for driver in self.driver_list:
+        for driver in self.drivers.values():
             string_list_driver.append(str(driver))
         return "Drivers: {}\nAvailable riders: [{}]".format(
             string_list_driver, str(self.rq))
@@ -57,33 +99,36 @@ class Dispatcher:
     def request_driver(self, rider):
         """Return a driver for the rider, or None if no driver is available.
 
+        The driver is the idle driver with the shortest travel time to the
+        rider; ties go to the driver who registered first.
+
         Add the rider to the waiting list if there is no available driver.
 
         @type self: Dispatcher
         @type rider: Rider
         @rtype: Driver | None
 
-        Since request_driver returns an object (Driver) or None the output is
-        not presentable. Therefore we omit the examples.
-        """
-        if self.driver_list != []:
-            for driver in self.driver_list:
-                if driver.is_idle:
-                    eta = driver.get_travel_time(rider.origin)
-                    fastest_driver = driver
-            i = 0
-
-            for i in range(len(self.driver_list)):
-                if self.driver_list[i].is_idle == True:
-                    new_eta = self.driver_list[i].get_travel_time(rider.origin)
-                    if new_eta < eta:
-                        eta = new_eta
-                        fastest_driver = self.driver_list[i]
-            fastest_driver.is_idle = False
-            return fastest_driver
-
-        else:
+        >>> d = Dispatcher()
+        >>> d.request_rider(Driver('Far', Location(9, 9), 1))
+        >>> d.request_rider(Driver('Near', Location(1, 2), 1))
+        >>> rider1 = Rider('Mark', Location(1, 1), Location(0, 4), 10)
+        >>> rider2 = Rider('Ann', Location(1, 1), Location(0, 4), 10)
+        >>> rider3 = Rider('Bo', Location(1, 1), Location(0, 4), 10)
+        >>> d.request_driver(rider1).identifier
+        'Near'
+        >>> d.request_driver(rider2).identifier
+        'Far'
+        >>> d.request_driver(rider3) is None
+        True
+        >>> d.rq.is_empty()
+        False
+        """
+        driver = self._idle.nearest(rider.origin)
+        if driver is None:
             self.rq.add(rider)
+            return None
+        driver.is_idle = False
+        return driver
 
     def request_rider(self, driver):
         """Return a rider for the driver, or None if no rider is available.
@@ -97,22 +142,351 @@ class Dispatcher:
         Since request_rider returns an object (Rider) or None the output is not
         presentable. Therefore we omit the examples.
         """
-        if driver not in self.driver_list:
-            self.driver_list.append(driver)
-            driver.is_idle = True
+        if self.drivers.get(driver.identifier) is not driver:
+            self.register(driver)
         if self.rq.is_empty():
             return None
         elif not self.rq.is_empty():
             return self.rq.remove()
 
+    def update_driver(self, driver):
+        """Record a change to the location or idleness of <driver>.
+
+        Registered drivers call this themselves, so that the dispatcher only
+        ever matches riders with drivers who are idle.
+
+        @type self: Dispatcher
+        @type driver: Driver
+        @rtype: None
+        """
+        if self.drivers.get(driver.identifier) is not driver:
+            # A driver replaced by a later registration under the same id.
+            return
+        if driver.is_idle:
+            self._idle.add(driver, self._ranks[driver.identifier])
+        else:
+            self._idle.discard(driver)
+
+    def register(self, driver):
+        """Register <driver> with this dispatcher as an idle driver.
+
+        A driver is known by their identifier. Registering a different Driver
+        with the identifier of a registered one replaces the registered one,
+        who keeps their place when breaking ties.
+
+        @type self: Dispatcher
+        @type driver: Driver
+        @rtype: None
+
+        >>> d = Dispatcher()
+        >>> d.register(Driver('Jum', Location(4, 5), 10))
+        >>> d.register(Driver('Jum', Location(1, 1), 10))
+        >>> d.num_drivers(), d.num_idle_drivers()
+        (1, 1)
+        >>> str(d.get_driver('Jum').location)
+        '(1, 1)'
+        """
+        old = self.drivers.get(driver.identifier)
+        if old is not None:
+            self._idle.discard(old)
+            old.dispatcher = None
+        self._ranks.setdefault(driver.identifier, len(self._ranks))
+        self.drivers[driver.identifier] = driver
+        driver.dispatcher = self
+        driver.is_idle = True
+
+    def unregister(self, driver):
+        """Stop using <driver> to fulfill rider requests.
+
+        The driver keeps their place when breaking ties if they are
+        registered again.
+
+        @type self: Dispatcher
+        @type driver: Driver
+        @rtype: None
+
+        >>> d = Dispatcher()
+        >>> jum = Driver('Jum', Location(4, 5), 10)
+        >>> d.register(jum)
+        >>> d.unregister(jum)
+        >>> d.num_drivers(), d.num_idle_drivers(), jum.dispatcher
+        (0, 0, None)
+        """
+        if self.drivers.get(driver.identifier) is driver:
+            del self.drivers[driver.identifier]
+            self._idle.discard(driver)
+            driver.dispatcher = None
+
+    def get_driver(self, identifier):
+        """Return the registered driver with <identifier>, or None if there
+        is no such driver.
+
+        @type self: Dispatcher
+        @type identifier: str
+        @rtype: Driver | None
+        """
+        return self.drivers.get(identifier)
+
+    def num_drivers(self):
+        """Return the number of drivers registered with this dispatcher.
+
+        @type self: Dispatcher
+        @rtype: int
+        """
+        return len(self.drivers)
+
+    def drivers_scanned(self):
+        """Return the number of idle drivers whose travel time to a rider
+        request_driver has worked out so far.
+
+        @type self: Dispatcher
+        @rtype: int
+
+        >>> d = Dispatcher()
+        >>> d.register(Driver('Jum', Location(4, 5), 10))
+        >>> d.register(Driver('Bo', Location(1, 1), 10))
+        >>> _ = d.request_driver(Rider('Ann', Location(4, 5), Location(0, 4),
+        ...                            10))
+        >>> d.drivers_scanned()
+        2
+        """
+        return self._idle.scanned
+
+    def num_idle_drivers(self):
+        """Return the number of registered drivers who are idle.
+
+        @type self: Dispatcher
+        @rtype: int
+
+        >>> d = Dispatcher()
+        >>> d.register(Driver('Jum', Location(4, 5), 10))
+        >>> rider1 = Rider('Mark', Location(4,5), Location(0,4), 10)
+        >>> d.request_driver(rider1).identifier
+        'Jum'
+        >>> d.num_idle_drivers()
+        0
+        """
+        return len(self._idle)
+
+    def num_waiting_riders(self):
+        """Return the number of riders waiting to be matched with a driver,
+        on the waiting list or in the next batch.
+
+        @type self: Dispatcher
+        @rtype: int
+
+        >>> d = Dispatcher()
+        >>> d.request_driver(Rider('Mark', Location(4,5), Location(0,4), 10))
+        >>> d.num_waiting_riders()
+        1
+        """
+        return len(self.rq) + len(self._batch)
+
     def cancel_ride(self, rider):
         """Cancel the ride for rider.
 
+        If the rider is still on the waiting list, they are taken off it so
+        that they are never handed to a driver. A newer request of the same
+        rider stays on it.
+
         @type self: Dispatcher
         @type rider: Rider
         @rtype: None
+
+        >>> d = Dispatcher()
+        >>> rider1 = Rider('Mark', Location(4,5), Location(0,4), 10)
+        >>> d.request_driver(rider1)
+        >>> d.cancel_ride(rider1)
+        >>> d.request_rider(Driver('Jum', Location(4,5), 10)) is None
+        True
+        >>> d = Dispatcher()
+        >>> first = Rider('Ann', Location(4,5), Location(0,4), 10)
+        >>> second = Rider('Ann', Location(4,5), Location(1,1), 10)
+        >>> d.request_driver(first)
+        >>> d.request_driver(second)
+        >>> d.cancel_ride(first)
+        >>> d.request_rider(Driver('Bo', Location(4,5), 10)) is second
+        True
         """
         rider.status = CANCELLED
+        self.rq.remove_rider(rider)
+        self._batch.remove_rider(rider)
+        self._forget_cancellation(rider)
+
+    def expect_cancellation(self, cancellation):
+        """Record <cancellation> as the pending Cancellation of its rider, to
+        be tombstoned if the rider is picked up first.
+
+        @type self: Dispatcher
+        @type cancellation: Cancellation
+        @rtype: None
+        """
+        self._cancellations[cancellation.rider.rider_id] = cancellation
+
+    def pending_cancellation(self, rider_id):
+        """Return the pending Cancellation of the waiting rider with
+        <rider_id>, or None if there is no such rider.
+
+        @type self: Dispatcher
+        @type rider_id: str
+        @rtype: Cancellation | None
+        """
+        return self._cancellations.get(rider_id)
+
+    def _forget_cancellation(self, rider):
+        """Stop tracking the pending Cancellation of <rider> and return it,
+        or return None if there is none.
+
+        A newer request of a rider with the same id has its own
+        Cancellation, which is left alone.
+
+        @type self: Dispatcher
+        @type rider: Rider
+        @rtype: Cancellation | None
+        """
+        cancellation = self._cancellations.get(rider.rider_id)
+        if cancellation is None or cancellation.rider is not rider:
+            return None
+        return self._cancellations.pop(rider.rider_id)
+
+    def picked_up(self, rider):
+        """Record that <rider> has been picked up, and tombstone their pending
+        Cancellation in the scheduler, since it can no longer do anything.
+
+        @type self: Dispatcher
+        @type rider: Rider
+        @rtype: None
+
+        >>> from container import PriorityQueue
+        >>> from event import RiderRequest
+        >>> from monitor import Monitor
+        >>> d = Dispatcher()
+        >>> d.scheduler = PriorityQueue()
+        >>> rider1 = Rider('Mark', Location(4,5), Location(0,4), 10)
+        >>> d.scheduler.add_many(RiderRequest(0, rider1).do(d, Monitor()))
+        >>> d.picked_up(rider1)
+        >>> d.scheduler.is_empty()
+        True
+
+        The Cancellation of a newer request from the same rider is kept.
+
+        >>> rider2 = Rider('Mark', Location(4,5), Location(0,4), 20)
+        >>> d.scheduler.add_many(RiderRequest(1, rider2).do(d, Monitor()))
+        >>> d.picked_up(rider1)
+        >>> len(d.scheduler), d.pending_cancellation('Mark').rider is rider2
+        (1, True)
+        """
+        cancellation = self._forget_cancellation(rider)
+        if cancellation is not None and self.scheduler is not None:
+            self.scheduler.cancel(cancellation)
+
+    def buffer_rider(self, rider):
+        """Add <rider> to the next batch, and return True iff they are the
+        first rider in it.
+
+        The caller is responsible for calling dispatch_batch <batch_window>
+        time units after the first rider was added.
+
+        @type self: Dispatcher
+        @type rider: Rider
+        @rtype: bool
+        """
+        first = self._batch.is_empty()
+        self._batch.add(rider)
+        return first
+
+    def dispatch_batch(self):
+        """Match the riders in the current batch with idle drivers, and
+        return the (rider, driver) pairs that were matched.
+
+        The matching minimizes the total travel time of the drivers to their
+        riders. A batch too large to score every pair is matched in chunks
+        (see _chunks), each optimally. Riders who could not be matched are
+        added to the waiting list.
+
+        @type self: Dispatcher
+        @rtype: list[(Rider, Driver)]
+
+        >>> d = Dispatcher(batch_window=0)
+        >>> d.register(Driver('Jum', Location(0, 0), 1))
+        >>> d.register(Driver('Ann', Location(3, 0), 1))
+        >>> d.buffer_rider(Rider('Mark', Location(2, 0), Location(0, 4), 10))
+        True
+        >>> d.buffer_rider(Rider('Bo', Location(0, 1), Location(0, 4), 10))
+        False
+        >>> [(rider.rider_id, driver.identifier)
+        ...  for rider, driver in d.dispatch_batch()]
+        [('Mark', 'Ann'), ('Bo', 'Jum')]
+        """
+        riders = []
+        while not self._batch.is_empty():
+            riders.append(self._batch.remove())
+        pairs = []
+        for chunk, drivers in self._chunks(riders):
+            drivers.sort(key=lambda driver: self._ranks[driver.identifier])
+            matched = set()
+            for row, col in assign(eta_matrix(
+                    [rider.origin for rider in chunk], drivers)):
+                pairs.append((chunk[row], drivers[col]))
+                drivers[col].is_idle = False
+                matched.add(row)
+            for row, rider in enumerate(chunk):
+                if row not in matched:
+                    self.rq.add(rider)
+        return pairs
+
+    def _chunks(self, riders):
+        """Yield the <riders> of a batch in chunks, in order, each with the
+        idle drivers to match it with, so that no chunk has more than
+        MAX_BATCH_PAIRS (rider, driver) pairs.
+
+        A batch small enough is one chunk with every idle driver. Otherwise
+        each rider brings the BATCH_CANDIDATES idle drivers nearest to them,
+        and a chunk ends before the next rider could take it over the bound.
+        The drivers of a chunk are looked for after the previous chunk has
+        been matched.
+
+        @type self: Dispatcher
+        @type riders: list[Rider]
+        @rtype: iterator[(list[Rider], list[Driver])]
+
+        >>> d = Dispatcher(batch_window=0)
+        >>> for i in range(5000):
+        ...     d.register(Driver(str(i), Location(i % 100, i // 100), 1))
+        >>> riders = [Rider(str(i), Location(i % 50, i // 50), Location(0, 0),
+        ...                 10) for i in range(600)]
+        >>> chunks = list(d._chunks(riders))
+        >>> sizes = [len(chunk) * len(drivers) for chunk, drivers in chunks]
+        >>> len(sizes) > 1 and max(sizes) <= MAX_BATCH_PAIRS
+        True
+        >>> [rider for chunk, _ in chunks for rider in chunk] == riders
+        True
+        >>> for rider in riders:
+        ...     _ = d.buffer_rider(rider)
+        >>> pairs = d.dispatch_batch()
+        >>> len(pairs), len({driver.identifier for _, driver in pairs})
+        (600, 600)
+        """
+        if len(riders) * len(self._idle) <= MAX_BATCH_PAIRS:
+            yield riders, list(self._idle)
+            return
+        chunk = []
+        candidates = {}
+        for rider in riders:
+            if chunk and (len(chunk) + 1) * (
+                    len(candidates) + BATCH_CANDIDATES) > MAX_BATCH_PAIRS:
+                # The drivers matched in this chunk are no longer idle when
+                # the next one looks for drivers.
+                yield chunk, list(candidates.values())
+                chunk = []
+                candidates = {}
+            chunk.append(rider)
+            origin = rider.origin
+            nearby = self._idle.nearby(origin, BATCH_CANDIDATES)
+            nearby.sort(key=lambda driver: driver.get_travel_time(origin))
+            for driver in nearby[:BATCH_CANDIDATES]:
+                candidates[driver.identifier] = driver
+        yield chunk, list(candidates.values())
 
 
 if __name__ == '__main__':
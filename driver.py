@@ -12,8 +12,20 @@ class Driver:
         The current location of the driver.
     @type is_idle: bool
         A property that is True if the driver is idle and False otherwise.
+    @type dispatcher: Dispatcher | None
+        The dispatcher this driver is registered with, which is told whenever
+        the driver's location or idleness changes.
     """
 
+    # === Private Attributes ===
+    # @type _location: Location
+    #     The value of the location property.
+    # @type _is_idle: bool
+    #     The value of the is_idle property.
+
+    __slots__ = ('dispatcher', 'identifier', '_location', 'speed',
+                 'destination', '_is_idle')
+
     def __init__(self, identifier, location, speed):
         """Initialize a Driver.
 
@@ -23,12 +35,55 @@ class Driver:
         @type speed: int
         @rtype: None
         """
+        self.dispatcher = None
         self.identifier = identifier
         self.location = location
         self.speed = speed
         self.destination = None
         self.is_idle = True
 
+    @property
+    def location(self):
+        """The current location of the driver.
+
+        @type self: Driver
+        @rtype: Location
+        """
+        return self._location
+
+    @location.setter
+    def location(self, location):
+        """Move the driver to <location>.
+
+        @type self: Driver
+        @type location: Location
+        @rtype: None
+        """
+        self._location = location
+        if self.dispatcher is not None:
+            self.dispatcher.update_driver(self)
+
+    @property
+    def is_idle(self):
+        """True if the driver is idle and False otherwise.
+
+        @type self: Driver
+        @rtype: bool
+        """
+        return self._is_idle
+
+    @is_idle.setter
+    def is_idle(self, is_idle):
+        """Mark the driver as idle or busy.
+
+        @type self: Driver
+        @type is_idle: bool
+        @rtype: None
+        """
+        self._is_idle = is_idle
+        if self.dispatcher is not None:
+            self.dispatcher.update_driver(self)
+
     def __str__(self):
         """Return a string representation of the Driver.
 
@@ -9,6 +9,14 @@ from driver import Driver
 from location import *
 from monitor import Monitor, RIDER, DRIVER, REQUEST, CANCEL, PICKUP, DROPOFF
 
+# The kinds of event that can appear in an event file, as stored in records.
+DRIVER_REQUEST = 0
+RIDER_REQUEST = 1
+EVENT_KINDS = {"DriverRequest": DRIVER_REQUEST, "RiderRequest": RIDER_REQUEST}
+
+# The number of whitespace-separated fields on a line of each kind.
+_FIELDS = {DRIVER_REQUEST: 5, RIDER_REQUEST: 6}
+
 
 class Event:
     """An event.
@@ -28,8 +36,15 @@ class Event:
     === Attributes ===
     @type timestamp: int
         A timestamp for this event.
+    @type cancelled: bool
+        True iff this event has been tombstoned in the event queue, and so
+        will never be done.
     """
 
+    # Events are the most numerous objects in a run, so every event class
+    # declares its attributes in __slots__ instead of having a __dict__.
+    __slots__ = ('timestamp', 'cancelled')
+
     def __init__(self, timestamp):
         """Initialize an Event with a given timestamp.
 
@@ -43,6 +58,7 @@ class Event:
         7
         """
         self.timestamp = timestamp
+        self.cancelled = False
 
     # The following six 'magic methods' are overridden to allow for easy
     # comparison of Event instances. All comparisons simply perform the
@@ -187,6 +203,8 @@ class RiderRequest(Event):
     """A rider requests a driver.=== Attributes ===@type rider: RideThe rider.
     """
 
+    __slots__ = ('rider',)
+
     def __init__(self, timestamp, rider):
         """Initialize a RiderRequest event.
 
@@ -240,6 +258,10 @@ class RiderRequest(Event):
         Return a Cancellation event. If the rider is assigned to a driver,
         also return a Pickup event.
 
+        If the dispatcher is in batch mode, the rider is added to the next
+        batch instead, and a BatchDispatch event is also returned if the
+        rider starts a new batch.
+
         @type self: RiderRequest
         @type dispatcher: Dispatcher
         @type monitor: Monitor
@@ -253,13 +275,20 @@ class RiderRequest(Event):
                        self.rider.rider_id, self.rider.origin)
 
         events = []
-        driver = dispatcher.request_driver(self.rider)
-        if driver is not None:
-            travel_time = driver.start_drive(self.rider.origin)
-            events.append(Pickup(self.timestamp + travel_time, self.rider,
-                                 driver))
-        events.append(Cancellation(self.timestamp + self.rider.patience,
-                                   self.rider))
+        if dispatcher.batch_window is not None:
+            if dispatcher.buffer_rider(self.rider):
+                events.append(BatchDispatch(
+                    self.timestamp + dispatcher.batch_window))
+        else:
+            driver = dispatcher.request_driver(self.rider)
+            if driver is not None:
+                travel_time = driver.start_drive(self.rider.origin)
+                events.append(Pickup(self.timestamp + travel_time, self.rider,
+                                     driver))
+        cancellation = Cancellation(self.timestamp + self.rider.patience,
+                                    self.rider)
+        dispatcher.expect_cancellation(cancellation)
+        events.append(cancellation)
         return events
 
 
@@ -274,6 +303,8 @@ class DriverRequest(Event):
          Precondition: must be a non-negative integer.
     """
 
+    __slots__ = ('driver',)
+
     def __init__(self, timestamp, driver):
         """Initialize a DriverRequest event.
 
@@ -360,6 +391,9 @@ class Cancellation(Event):
     @type driver: the Driver
     @type rider: the rider
     """
+
+    __slots__ = ('rider',)
+
     def __init__(self, timestamp, rider):
         """Initialize a cancelation event.
 
@@ -387,7 +421,7 @@ class Cancellation(Event):
             monitor.notify(
                 self.timestamp, RIDER, CANCEL, self.rider.rider_id,
                 self.rider.origin)
-            self.rider.status = CANCELLED
+            dispatcher.cancel_ride(self.rider)
         return []
 
     def __eq__(self, other):
@@ -431,6 +465,8 @@ class Pickup(Event):
     @type rider: Rider
     """
 
+    __slots__ = ('driver', 'rider')
+
     def __init__(self, timestamp, rider, driver):
         """Initialize a pickup event.
 
@@ -465,6 +501,7 @@ class Pickup(Event):
         self.driver.is_idle = False
         if self.rider.status == WAITING:
             self.rider.status = SATISFIED
+            dispatcher.picked_up(self.rider)
             travel_time = self.driver.start_ride(self.rider)
             monitor.notify(self.timestamp, RIDER, PICKUP, self.rider.rider_id,
                            self.rider.origin)
@@ -521,6 +558,9 @@ class Dropoff(Event):
     @type driver: the Driver
     @type rider: the rider
     """
+
+    __slots__ = ('driver', 'rider')
+
     def __init__(self, timestamp, driver, rider):
         """Initialize a drop off event.
 
@@ -591,6 +631,61 @@ class Dropoff(Event):
                                              self.rider.rider_id)
 
 
+class BatchDispatch(Event):
+    """The dispatcher matches the batch of riders collected in batch mode
+    with idle drivers.
+    """
+
+    __slots__ = ()
+
+    def do(self, dispatcher, monitor):
+        """Match the current batch of riders, and return a Pickup event for
+        every rider who was assigned a driver. Each assigned driver starts
+        driving to their rider.
+
+        @type self: BatchDispatch
+        @type dispatcher: Dispatcher
+        @type monitor: Monitor
+        @rtype: list[Event]
+
+        Since testing that method requires a Monitor, Dispatcher (which needs a
+        dictionary of activities, riders, and drivers with all their attributes)
+        and using notify method, we omit the examples.
+        """
+        events = []
+        for rider, driver in dispatcher.dispatch_batch():
+            travel_time = driver.start_drive(rider.origin)
+            events.append(Pickup(self.timestamp + travel_time, rider, driver))
+        return events
+
+    def __eq__(self, other):
+        """Return whether two BatchDispatch events are equivalent to one
+        another.
+
+        @type self: BatchDispatch
+        @type other: BatchDispatch
+        @rtype: Bool
+
+        >>> BatchDispatch(3) == BatchDispatch(3)
+        True
+        >>> BatchDispatch(3) == BatchDispatch(4)
+        False
+        """
+        if type(self) == BatchDispatch and type(other) == BatchDispatch:
+            return self.timestamp == other.timestamp
+
+    def __str__(self):
+        """Return a string representation of this event.
+
+        @type self: BatchDispatch
+        @rtype: str
+
+        >>> str(BatchDispatch(3))
+        '3 -- Dispatch batch'
+        """
+        return "{} -- Dispatch batch".format(self.timestamp)
+
+
 def create_event_list(filename):
     """Return a list of Events based on raw list of events in <filename>.
 
@@ -601,37 +696,144 @@ def create_event_list(filename):
         The name of a file that contains the list of events.
     @rtype: list[Event]
     """
-    events = []
+    return list(iter_events(filename))
+
+
+def iter_events(filename):
+    """Yield the Events in <filename> one at a time, in file order.
+
+    Unlike create_event_list, only one line of the file is held in memory at
+    a time, so the first event is available as soon as it has been read.
+
+    Raise ValueError naming the file and line number of the first line that
+    is not in the expected format.
+
+    @param filename: str
+        The name of a file that contains the list of events.
+    @rtype: iterator[Event]
+
+    >>> [str(event) for event in iter_events('events_small.txt')]
+    ['10 -- Arnold: Request a rider', '1 -- Dan: Request a driver']
+    """
     with open(filename, "r") as file:
-        for line in file:
-            line = line.strip()
-
-            if not line or line.startswith("#"):
-                # Skip lines that are blank or start with #.
-                continue
-
-            # Create a list of words in the line, e.g.
-            # ['10', 'RiderRequest', 'Cerise', '4,2', '1,5', '15'].
-            # Note that these are strings, and you'll need to convert some
-            # of them to a different type.
-            tokens = line.split()
-            timestamp = int(tokens[0])
-            event_type = tokens[1]
-
-            # HINT: Use Location.deserialize to convert the location string to
-            # a location.
-
-            if event_type == "DriverRequest":
-                location = deserialize_location(tokens[3])
-                driver = Driver(tokens[2], location, int(tokens[4]))
-                event = DriverRequest(timestamp, driver)
-            elif event_type == "RiderRequest":
-                origin = deserialize_location(tokens[3])
-                destination = deserialize_location(tokens[4])
-                rider = Rider(tokens[2], origin, destination, int(tokens[5]))
-                event = RiderRequest(timestamp, rider)
-            events.append(event)
-        return events
+        for line_number, line in enumerate(file, 1):
+            try:
+                record = parse_record(line)
+            except ValueError as error:
+                raise ValueError("{}:{}: {}".format(
+                    filename, line_number, error)) from None
+            if record is not None:
+                yield event_from_record(record)
+
+
+def parse_record(line):
+    """Return the event record for one line of an event file, or None if the
+    line is blank or a comment.
+
+    A record is a tuple (timestamp, kind, identifier, m, n, value, dest_m,
+    dest_n). For a DriverRequest, (m, n) is the driver's location and value
+    is their speed; for a RiderRequest, (m, n) and (dest_m, dest_n) are the
+    rider's origin and destination and value is their patience. Records are
+    cheap to build, pickle and store, and event_from_record turns them into
+    Events.
+
+    Raise ValueError if the line is not in the expected format.
+
+    @type line: str
+    @rtype: tuple | None
+
+    >>> parse_record('0 DriverRequest Amaranth 1,2 1')
+    (0, 0, 'Amaranth', 1, 2, 1, 0, 0)
+    >>> parse_record('5 RiderRequest Bisque 3,2 2,3 5')
+    (5, 1, 'Bisque', 3, 2, 5, 2, 3)
+    >>> parse_record('  # A comment') is None
+    True
+    >>> parse_record('5 RiderRequest Bisque 3,2')
+    Traceback (most recent call last):
+    ValueError: RiderRequest needs 6 fields, got 4
+    """
+    line = line.strip()
+
+    if not line or line.startswith("#"):
+        # Skip lines that are blank or start with #.
+        return None
+
+    # Create a list of words in the line, e.g.
+    # ['10', 'RiderRequest', 'Cerise', '4,2', '1,5', '15'].
+    tokens = line.split()
+    kind = EVENT_KINDS.get(tokens[1]) if len(tokens) > 1 else None
+    if kind is None:
+        raise ValueError("unknown event type in {!r}".format(line))
+    if len(tokens) != _FIELDS[kind]:
+        raise ValueError("{} needs {} fields, got {}".format(
+            tokens[1], _FIELDS[kind], len(tokens)))
+    m, n = deserialize_location(tokens[3]).coordinate
+    if kind == DRIVER_REQUEST:
+        return int(tokens[0]), kind, tokens[2], m, n, int(tokens[4]), 0, 0
+    dest_m, dest_n = deserialize_location(tokens[4]).coordinate
+    return int(tokens[0]), kind, tokens[2], m, n, int(tokens[5]), dest_m, \
+        dest_n
+
+
+def event_from_record(record):
+    """Return the Event described by <record>, a record returned by
+    parse_record.
+
+    @type record: tuple
+    @rtype: Event
+
+    >>> str(event_from_record((5, RIDER_REQUEST, 'Bisque', 3, 2, 5, 2, 3)))
+    '5 -- Bisque: Request a driver'
+    """
+    timestamp, kind, identifier, m, n, value, dest_m, dest_n = record
+    if kind == DRIVER_REQUEST:
+        return DriverRequest(timestamp,
+                             Driver(identifier, Location(m, n), value))
+    return RiderRequest(timestamp, Rider(identifier, Location(m, n),
+                                         Location(dest_m, dest_n), value))
+
+
+def merge_events(stream, queue):
+    """Yield the events of <stream> and <queue> in timestamp order.
+
+    <stream> is read only when its next event is due, so it can be a lazy
+    source such as iter_events. Events added to <queue> between steps of the
+    iteration are merged in as well, which is how events spawned by Event.do
+    are scheduled. Among events with the same timestamp, those from <stream>
+    come first, as if the whole stream had been added to <queue> up front.
+
+    Precondition: the timestamps of <stream> never decrease.
+
+    @type stream: iterator[Event]
+    @type queue: PriorityQueue
+    @rtype: iterator[Event]
+
+    >>> from container import PriorityQueue
+    >>> queue = PriorityQueue()
+    >>> queue.add(BatchDispatch(3))
+    >>> [str(event) for event in merge_events(
+    ...     iter([BatchDispatch(1), BatchDispatch(3)]), queue)]
+    ['1 -- Dispatch batch', '3 -- Dispatch batch', '3 -- Dispatch batch']
+    >>> list(merge_events(iter([BatchDispatch(2), BatchDispatch(1)]), queue))
+    Traceback (most recent call last):
+    ValueError: event stream is not in timestamp order at time 1
+    """
+    stream = iter(stream)
+    upcoming = next(stream, None)
+    while upcoming is not None:
+        if queue.is_empty() or upcoming.timestamp <= queue.peek().timestamp:
+            event = upcoming
+            upcoming = next(stream, None)
+            if upcoming is not None and upcoming.timestamp < event.timestamp:
+                raise ValueError(
+                    "event stream is not in timestamp order at time {}".format(
+                        upcoming.timestamp))
+            yield event
+        else:
+            yield queue.remove()
+    while not queue.is_empty():
+        yield queue.remove()
+
 
 if __name__ == '__main__':
     import doctest
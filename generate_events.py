@@ -0,0 +1,331 @@
+"""
+Generate large synthetic event files in the format read by create_event_list.
+
+The fleet of drivers all request a rider at time 0, at random locations.
+Riders then arrive as a Poisson process whose rate follows a time-of-day
+curve, generated by thinning: candidate arrivals are drawn at the peak rate
+and each is kept with probability rate(t) / peak rate, where t is the time
+unit the candidate falls in. Origins and
+destinations are drawn from a mixture of hotspots, each a normal spread
+around a centre, and a uniform background over the whole grid. Driver speeds
+and rider patience are drawn from distributions given as specs (see
+distribution).
+
+The file is written as it is generated, in timestamp order, so its size is
+only limited by the disk, and the same seed always gives the same file.
+
+Run it as a script, e.g.
+
+    python generate_events.py big.txt --riders 1000000 --fleet 5000 \\
+        --hotspot 20,30,5,2 --hotspot 80,60,10,1 --seed 7
+"""
+import argparse
+import random
+import sys
+from bisect import bisect_right
+from itertools import accumulate
+
+# The default relative rate of rider arrivals in each hour of the day, with
+# morning and evening rush hours.
+DEFAULT_CURVE = (0.2, 0.1, 0.1, 0.1, 0.2, 0.4, 0.8, 1.0, 1.0, 0.7, 0.6, 0.6,
+                 0.7, 0.6, 0.6, 0.7, 0.9, 1.0, 1.0, 0.8, 0.6, 0.5, 0.4, 0.3)
+
+# The number of lines written at once.
+_CHUNK = 4096
+
+
+def distribution(spec):
+    """Return a function that draws a positive int from the distribution
+    described by <spec>, using the random.Random it is called with.
+
+    <spec> is one of:
+        N                  always N
+        uniform:A:B        uniform on A..B
+        normal:MU:SIGMA    normal, rounded
+        exponential:MEAN   exponential, rounded
+        choice:A,B,...     one of A, B, ... with equal probability
+    Values below 1 are raised to 1.
+
+    @type spec: str
+    @rtype: callable
+
+    >>> rng = random.Random(0)
+    >>> [distribution('uniform:2:4')(rng) for _ in range(5)]
+    [3, 3, 2, 3, 4]
+    >>> distribution('normal:-5:1')(rng)
+    1
+    >>> distribution('gamma:2')
+    Traceback (most recent call last):
+    ValueError: unknown distribution: gamma:2
+    """
+    kind, _, arguments = spec.partition(':')
+    try:
+        if not arguments:
+            value = max(1, int(kind))
+            return lambda rng: value
+        if kind == 'uniform':
+            low, high = map(int, arguments.split(':'))
+            return lambda rng: max(1, rng.randint(low, high))
+        if kind == 'normal':
+            mu, sigma = map(float, arguments.split(':'))
+            return lambda rng: max(1, round(rng.gauss(mu, sigma)))
+        if kind == 'exponential':
+            rate = 1 / float(arguments)
+            return lambda rng: max(1, round(rng.expovariate(rate)))
+        if kind == 'choice':
+            values = [max(1, int(value)) for value in arguments.split(',')]
+            return lambda rng: rng.choice(values)
+    except ValueError:
+        pass
+    raise ValueError("unknown distribution: {}".format(spec))
+
+
+class WorkloadGenerator:
+    """A generator of synthetic event files.
+
+    === Attributes ===
+    @type width, height: int
+        The size of the grid; locations have 0 <= m < width and
+        0 <= n < height.
+    @type fleet: int
+        The number of drivers.
+    @type rate: float
+        The mean number of rider arrivals per time unit at the peak of the
+        curve.
+    @type curve: list[float]
+        The relative arrival rate over each equal part of a day, linearly
+        interpolated between the middles of the parts. The peak is 1.
+    @type day: int
+        The number of time units in a day.
+    @type hotspots: list[(int, int, float, float)]
+        The (m, n, spread, weight) of each hotspot: locations near it are
+        normally distributed around (m, n) with standard deviation <spread>,
+        and it is chosen in proportion to <weight>.
+    @type background: float
+        The weight of the uniform background in the mixture of hotspots.
+    @type speed: callable
+        Draws a driver's speed; see distribution.
+    @type patience: callable
+        Draws a rider's patience; see distribution.
+    @type seed: int
+        The seed of the random numbers.
+    """
+
+    def __init__(self, width=100, height=100, fleet=100, rate=1.0,
+                 curve=DEFAULT_CURVE, day=86400, hotspots=(), background=1.0,
+                 speed='uniform:1:5', patience='uniform:5:60', seed=0):
+        """Initialize a WorkloadGenerator.
+
+        @type self: WorkloadGenerator
+        @type width, height: int
+        @type fleet: int
+        @type rate: float
+        @type curve: list[float]
+        @type day: int
+        @type hotspots: list[(int, int, float, float)]
+        @type background: float
+        @type speed: str
+            A distribution spec.
+        @type patience: str
+            A distribution spec.
+        @type seed: int
+        @rtype: None
+
+        >>> WorkloadGenerator(curve=[0, 0])
+        Traceback (most recent call last):
+        ValueError: the curve must have no negative values and a positive peak
+        """
+        if min(curve) < 0 or max(curve) <= 0:
+            raise ValueError(
+                "the curve must have no negative values and a positive peak")
+        self.width = width
+        self.height = height
+        self.fleet = fleet
+        self.rate = rate
+        peak = max(curve)
+        self.curve = [value / peak for value in curve]
+        self.day = day
+        self.hotspots = list(hotspots)
+        self.background = background
+        self.speed = distribution(speed)
+        self.patience = distribution(patience)
+        self.seed = seed
+
+    def _rate(self, time):
+        """Return the relative arrival rate at <time>, in [0, 1].
+
+        @type self: WorkloadGenerator
+        @type time: float
+        @rtype: float
+        """
+        parts = len(self.curve)
+        position = (time % self.day) / self.day * parts - 0.5
+        index = int(position // 1)
+        fraction = position - index
+        return (self.curve[index % parts] * (1 - fraction) +
+                self.curve[(index + 1) % parts] * fraction)
+
+    def _location_sampler(self, rng):
+        """Return a function that draws a location from the mixture of
+        hotspots, as a pair of ints.
+
+        @type self: WorkloadGenerator
+        @type rng: random.Random
+        @rtype: callable
+        """
+        width, height = self.width, self.height
+        cumulative = list(accumulate(
+            [self.background] + [spot[3] for spot in self.hotspots]))
+        total = cumulative[-1]
+        random_ = rng.random
+        gauss = rng.gauss
+        hotspots = self.hotspots
+
+        def sample():
+            index = bisect_right(cumulative, random_() * total)
+            if index == 0 or index > len(hotspots):
+                return int(random_() * width), int(random_() * height)
+            m, n, spread, _ = hotspots[index - 1]
+            return (min(width - 1, max(0, round(gauss(m, spread)))),
+                    min(height - 1, max(0, round(gauss(n, spread)))))
+        return sample
+
+    def lines(self, riders=None, duration=None):
+        """Yield the lines of the event file, in timestamp order.
+
+        Riders stop arriving after <riders> riders or at time <duration>,
+        whichever comes first; at least one of them must be given.
+
+        @type self: WorkloadGenerator
+        @type riders: int | None
+        @type duration: int | None
+        @rtype: iterator[str]
+
+        >>> generator = WorkloadGenerator(width=10, height=10, fleet=2,
+        ...                               rate=0.5, seed=1)
+        >>> for line in generator.lines(riders=3):
+        ...     print(line, end='')
+        0 DriverRequest D0 8,7 3
+        0 DriverRequest D1 7,4 4
+        3 RiderRequest R0 8,4 0,4 51
+        30 RiderRequest R1 7,2 8,9 37
+        46 RiderRequest R2 4,1 7,6 28
+        """
+        if riders is None and duration is None:
+            raise ValueError("give a number of riders or a duration")
+        rng = random.Random(self.seed)
+        location = self._location_sampler(rng)
+        for i in range(self.fleet):
+            m, n = location()
+            yield '0 DriverRequest D%d %d,%d %d\n' % (i, m, n, self.speed(rng))
+        if self.rate <= 0:
+            return
+        expovariate = rng.expovariate
+        random_ = rng.random
+        patience = self.patience
+        relative_rate = self._rate
+        time = 0.0
+        count = 0
+        tick = -1
+        while riders is None or count < riders:
+            time += expovariate(self.rate)
+            if duration is not None and time >= duration:
+                return
+            # The rate changes slowly, so it is worked out once per tick.
+            if int(time) != tick:
+                tick = int(time)
+                accept = relative_rate(tick)
+            if random_() < accept:
+                origin = location()
+                destination = location()
+                yield '%d RiderRequest R%d %d,%d %d,%d %d\n' % (
+                    time, count, origin[0], origin[1], destination[0],
+                    destination[1], patience(rng))
+                count += 1
+
+    def write(self, file, riders=None, duration=None):
+        """Write the event file to the open text file <file>, and return the
+        number of events written.
+
+        @type self: WorkloadGenerator
+        @type file: file
+        @type riders: int | None
+        @type duration: int | None
+        @rtype: int
+        """
+        file.write('# Generated with seed {}\n'.format(self.seed))
+        count = 0
+        chunk = []
+        for line in self.lines(riders, duration):
+            chunk.append(line)
+            if len(chunk) == _CHUNK:
+                file.write(''.join(chunk))
+                count += len(chunk)
+                chunk = []
+        file.write(''.join(chunk))
+        return count + len(chunk)
+
+
+def _hotspot(text):
+    """Return the hotspot described by <text>, 'm,n,spread,weight'.
+
+    @type text: str
+    @rtype: (int, int, float, float)
+    """
+    m, n, spread, weight = text.split(',')
+    return int(m), int(n), float(spread), float(weight)
+
+
+def main(argv=None):
+    """Write the event file described by the command line arguments <argv>.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('output', help="file to write, or '-' for stdout")
+    parser.add_argument('--riders', type=int, help='riders to generate')
+    parser.add_argument('--duration', type=int,
+                        help='time units to generate riders for')
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--height', type=int, default=100)
+    parser.add_argument('--fleet', type=int, default=100,
+                        help='number of drivers')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='rider arrivals per time unit at the peak')
+    parser.add_argument('--curve', type=lambda text: [
+        float(value) for value in text.split(',')], default=DEFAULT_CURVE,
+                        help='comma-separated relative rates over a day')
+    parser.add_argument('--day', type=int, default=86400,
+                        help='time units in a day')
+    parser.add_argument('--hotspot', type=_hotspot, action='append',
+                        default=[], metavar='M,N,SPREAD,WEIGHT')
+    parser.add_argument('--background', type=float, default=1.0,
+                        help='weight of uniformly placed locations')
+    parser.add_argument('--speed', default='uniform:1:5',
+                        help='distribution of driver speeds')
+    parser.add_argument('--patience', default='uniform:5:60',
+                        help='distribution of rider patience')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.riders is None and args.duration is None:
+        args.duration = args.day
+
+    try:
+        generator = WorkloadGenerator(
+            args.width, args.height, args.fleet, args.rate, args.curve,
+            args.day, args.hotspot, args.background, args.speed,
+            args.patience, args.seed)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.output == '-':
+        generator.write(sys.stdout, args.riders, args.duration)
+    else:
+        with open(args.output, 'w') as file:
+            count = generator.write(file, args.riders, args.duration)
+        print('Wrote {} events to {}'.format(count, args.output),
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
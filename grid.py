@@ -0,0 +1,374 @@
+"""
+The grid module contains the DriverGrid class, a spatial index over the idle
+drivers of a Dispatcher.
+
+=== Constants ===
+@type CELL_SIZE: int
+    The smallest number of blocks along each side of an adaptive grid cell.
+@type RESIZE_FACTOR: int
+    How many times more or fewer drivers, or how many times larger an area,
+    makes an adaptive grid work out its cell size again.
+@type SCAN_CELLS: int
+    The most occupied cells for which a lookup just checks every driver.
+"""
+import math
+from location import Location
+
+CELL_SIZE = 4
+RESIZE_FACTOR = 4
+SCAN_CELLS = 16
+
+
+class DriverGrid:
+    """A spatial index that finds the idle driver who can reach a location
+    the fastest.
+
+    Drivers are bucketed by the square cell of the grid their location falls
+    in. A lookup visits the cells in rings of increasing Manhattan distance
+    from the target, and stops as soon as no driver in the next ring could
+    arrive sooner than the best one found, given the fastest speed of any
+    indexed driver.
+
+    Ties in arrival time go to the driver with the smallest rank.
+
+    Unless a cell size is given, the cells are sized from the number of
+    drivers and the area they span, so that a cell holds about one driver
+    whether the fleet is sparse, dense or bunched up. The
+    drivers are bucketed again whenever the number of drivers or the area
+    changes by RESIZE_FACTOR times.
+
+    === Attributes ===
+    @type cell_size: int
+        The number of blocks along each side of a cell.
+    @type scanned: int
+        The number of drivers whose travel time nearest has worked out.
+    """
+
+    # === Private Attributes ===
+    # @type _cells: dict[tuple[int, int], dict[str, tuple[int, Driver]]]
+    #     For each non-empty cell, the (rank, driver) pairs in that cell keyed
+    #     by driver identifier.
+    # @type _where: dict[str, tuple[int, int]]
+    #     The cell of every indexed driver, keyed by driver identifier.
+    # @type _speeds: dict[int, int]
+    #     The number of indexed drivers with each speed.
+    # @type _adaptive: bool
+    #     Whether the cell size follows the number of drivers and the area.
+    # @type _bounds: list[int] | None
+    #     The smallest and largest m and n of any driver's location, as
+    #     [min m, min n, max m, max n], or None before the first one.
+    # @type _counts: tuple[int, int]
+    #     The fewest and most drivers the cell size is kept for.
+    # @type _area: int
+    #     The area the cell size was worked out for.
+    #
+    # === Representation Invariants ===
+    # A driver is in _where iff they are in exactly one bucket of _cells, and
+    # that bucket is the cell of their current location. No bucket is empty.
+
+    def __init__(self, cell_size=None):
+        """Initialize an empty DriverGrid.
+
+        @type self: DriverGrid
+        @type cell_size: int | None
+            A fixed cell size, or None to size cells to the drivers.
+            Precondition: cell_size is None or cell_size > 0
+        @rtype: None
+        """
+        self._adaptive = cell_size is None
+        self.cell_size = CELL_SIZE if cell_size is None else cell_size
+        self.scanned = 0
+        self._cells = {}
+        self._where = {}
+        self._speeds = {}
+        self._bounds = None
+        self._counts = (0, 0)
+        self._area = 1
+
+    def __len__(self):
+        """Return the number of drivers in this DriverGrid.
+
+        @type self: DriverGrid
+        @rtype: int
+
+        >>> grid = DriverGrid()
+        >>> len(grid)
+        0
+        """
+        return len(self._where)
+
+    def __iter__(self):
+        """Return an iterator over the drivers in this DriverGrid.
+
+        @type self: DriverGrid
+        @rtype: iterator[Driver]
+        """
+        for bucket in self._cells.values():
+            for _, driver in bucket.values():
+                yield driver
+
+    def __contains__(self, driver):
+        """Return True iff <driver> is in this DriverGrid.
+
+        @type self: DriverGrid
+        @type driver: Driver
+        @rtype: bool
+        """
+        return driver.identifier in self._where
+
+    def _cell(self, location):
+        """Return the cell that <location> falls in.
+
+        @type self: DriverGrid
+        @type location: Location
+        @rtype: tuple[int, int]
+        """
+        m, n = location.coordinate
+        return m // self.cell_size, n // self.cell_size
+
+    def _see(self, location):
+        """Widen the area spanned by the drivers to take in <location>, and
+        return True iff it grew.
+
+        @type self: DriverGrid
+        @type location: Location
+        @rtype: bool
+        """
+        m, n = location.coordinate
+        bounds = self._bounds
+        if bounds is None:
+            self._bounds = [m, n, m, n]
+            return True
+        if bounds[0] <= m <= bounds[2] and bounds[1] <= n <= bounds[3]:
+            return False
+        self._bounds = [min(m, bounds[0]), min(n, bounds[1]),
+                        max(m, bounds[2]), max(n, bounds[3])]
+        return True
+
+    def _resize(self):
+        """Work out the cell size again if the number of drivers or the area
+        has changed by RESIZE_FACTOR times since it was last worked out, and
+        bucket the drivers again if it changed.
+
+        @type self: DriverGrid
+        @rtype: None
+
+        >>> from driver import Driver
+        >>> grid = DriverGrid()
+        >>> for i in range(10):
+        ...     grid.add(Driver(str(i), Location(i * 100, i * 100), 1), i)
+        >>> grid.cell_size
+        247
+        >>> for i in range(10, 10000):
+        ...     grid.add(Driver(str(i), Location(i % 100, i // 100), 1), i)
+        >>> grid.cell_size
+        9
+        """
+        count = len(self._where)
+        m0, n0, m1, n1 = self._bounds
+        area = (m1 - m0 + 1) * (n1 - n0 + 1)
+        low, high = self._counts
+        if low <= count <= high and area <= self._area * RESIZE_FACTOR:
+            return
+        self._counts = (count // RESIZE_FACTOR, count * RESIZE_FACTOR)
+        self._area = area
+        size = max(CELL_SIZE, math.isqrt(area // max(count, 1)))
+        if size == self.cell_size:
+            return
+        self.cell_size = size
+        drivers = list(self._cells.values())
+        self._cells = {}
+        for bucket in drivers:
+            for identifier, entry in bucket.items():
+                cell = self._cell(entry[1].location)
+                self._cells.setdefault(cell, {})[identifier] = entry
+                self._where[identifier] = cell
+
+    def add(self, driver, rank):
+        """Add <driver> to this DriverGrid at their current location, or move
+        them there if they are already in it.
+
+        @type self: DriverGrid
+        @type driver: Driver
+        @type rank: int
+            The position of the driver when breaking ties.
+        @rtype: None
+        """
+        cell = self._cell(driver.location)
+        old_cell = self._where.get(driver.identifier)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self.discard(driver)
+        self._cells.setdefault(cell, {})[driver.identifier] = (rank, driver)
+        self._where[driver.identifier] = cell
+        self._speeds[driver.speed] = self._speeds.get(driver.speed, 0) + 1
+        grew = self._see(driver.location)
+        if self._adaptive and (grew or len(self._where) > self._counts[1]):
+            self._resize()
+
+    def discard(self, driver):
+        """Remove <driver> from this DriverGrid if they are in it.
+
+        @type self: DriverGrid
+        @type driver: Driver
+        @rtype: None
+        """
+        cell = self._where.pop(driver.identifier, None)
+        if cell is None:
+            return
+        bucket = self._cells[cell]
+        del bucket[driver.identifier]
+        if not bucket:
+            del self._cells[cell]
+        count = self._speeds[driver.speed] - 1
+        if count:
+            self._speeds[driver.speed] = count
+        else:
+            del self._speeds[driver.speed]
+        if self._adaptive and self._where and \
+                len(self._where) < self._counts[0]:
+            self._resize()
+
+    def nearest(self, location):
+        """Return the driver in this DriverGrid with the shortest travel time
+        to <location>, or None if this DriverGrid is empty.
+
+        @type self: DriverGrid
+        @type location: Location
+        @rtype: Driver | None
+
+        >>> from driver import Driver
+        >>> grid = DriverGrid(cell_size=2)
+        >>> grid.add(Driver('Slow', Location(5, 5), 1), 0)
+        >>> grid.add(Driver('Fast', Location(12, 12), 10), 1)
+        >>> grid.nearest(Location(4, 4)).identifier
+        'Fast'
+        >>> grid.add(Driver('Near', Location(4, 4), 1), 2)
+        >>> grid.nearest(Location(4, 4)).identifier
+        'Near'
+        """
+        if not self._where:
+            return None
+        if len(self._cells) <= SCAN_CELLS:
+            # Too few cells are occupied for the rings to save anything.
+            return self._closest(self._cells.values(), location)[1]
+        size = self.cell_size
+        top_speed = max(self._speeds)
+        cx, cy = self._cell(location)
+        best = None
+        best_key = None
+        remaining = len(self._cells)
+        # Every ring closer than the drivers' area is empty.
+        m0, n0, m1, n1 = self._bounds
+        ring = (max(0, m0 // size - cx, cx - m1 // size) +
+                max(0, n0 // size - cy, cy - n1 // size))
+        while remaining:
+            # No block in a cell <ring> cells away is closer than this.
+            bound = max(0, (ring - 2) * size + 2)
+            if best_key is not None and bound // top_speed > best_key[0]:
+                break
+            if 4 * ring > remaining:
+                # The ring has more cells than are left to visit, so go
+                # through the occupied cells directly instead, nearest first.
+                cells = sorted(
+                    (abs(x - cx) + abs(y - cy), cell)
+                    for cell in self._cells for x, y in (cell,)
+                    if abs(x - cx) + abs(y - cy) >= ring)
+                for distance, cell in cells:
+                    bound = max(0, (distance - 2) * size + 2)
+                    if best_key is not None and \
+                            bound // top_speed > best_key[0]:
+                        break
+                    key, driver = self._closest([self._cells[cell]],
+                                                location)
+                    if best_key is None or key < best_key:
+                        best_key, best = key, driver
+                break
+            buckets = []
+            for dx in range(-ring, ring + 1):
+                dy = ring - abs(dx)
+                bucket = self._cells.get((cx + dx, cy + dy))
+                if bucket is not None:
+                    buckets.append(bucket)
+                if dy:
+                    bucket = self._cells.get((cx + dx, cy - dy))
+                    if bucket is not None:
+                        buckets.append(bucket)
+            remaining -= len(buckets)
+            if buckets:
+                key, driver = self._closest(buckets, location)
+                if best_key is None or key < best_key:
+                    best_key, best = key, driver
+            ring += 1
+        return best
+
+    def _closest(self, buckets, location):
+        """Return the (travel time, rank) key of the driver in <buckets> with
+        the shortest travel time to <location>, ties going to the smallest
+        rank, and that driver.
+
+        @type self: DriverGrid
+        @type buckets: iterable[dict[str, tuple[int, Driver]]]
+        @type location: Location
+        @rtype: ((int, int), Driver)
+        """
+        best = None
+        best_time = best_rank = None
+        for bucket in buckets:
+            self.scanned += len(bucket)
+            for rank, driver in bucket.values():
+                time = driver.get_travel_time(location)
+                if best is None or time < best_time or \
+                        (time == best_time and rank < best_rank):
+                    best_time, best_rank, best = time, rank, driver
+        return (best_time, best_rank), best
+
+    def nearby(self, location, count):
+        """Return at least <count> drivers from this DriverGrid that are
+        close to <location>, or all of them if there are not that many.
+
+        The drivers are collected ring by ring from the cell of <location>
+        outwards, so they are the nearest ones up to the resolution of a cell.
+
+        @type self: DriverGrid
+        @type location: Location
+        @type count: int
+        @rtype: list[Driver]
+
+        >>> from driver import Driver
+        >>> grid = DriverGrid(cell_size=1)
+        >>> for i in range(5):
+        ...     grid.add(Driver(str(i), Location(i, 0), 1), i)
+        >>> sorted(driver.identifier for driver in
+        ...        grid.nearby(Location(0, 0), 2))
+        ['0', '1']
+        >>> len(grid.nearby(Location(0, 0), 10))
+        5
+        """
+        if count >= len(self._where):
+            return list(self)
+        cx, cy = self._cell(location)
+        found = []
+        remaining = len(self._cells)
+        ring = 0
+        while len(found) < count:
+            if 4 * ring > remaining:
+                found.extend(driver for (x, y), bucket in self._cells.items()
+                             if abs(x - cx) + abs(y - cy) >= ring
+                             for _, driver in bucket.values())
+                break
+            for dx in range(-ring, ring + 1):
+                dy = ring - abs(dx)
+                for cell in {(cx + dx, cy + dy), (cx + dx, cy - dy)}:
+                    bucket = self._cells.get(cell)
+                    if bucket is not None:
+                        remaining -= 1
+                        found.extend(driver for _, driver in bucket.values())
+            ring += 1
+        return found
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,132 @@
+"""
+The ingest module parses large event files on several processes at once.
+
+The file is split into chunks at line boundaries, and each chunk is parsed in
+a process pool into records (see event.parse_record), which are cheap to send
+back to the parent. The records are then merged in order of timestamp and
+then line number, which is the order a PriorityQueue filled from
+create_event_list would remove the events in, and turned into Events.
+
+=== Constants ===
+@type MIN_PARALLEL_BYTES: int
+    Files smaller than this are parsed in the calling process, since
+    starting a pool would take longer than parsing them.
+@type CHUNKS_PER_WORKER: int
+    The number of chunks the file is split into per worker, so that workers
+    that finish early can pick up more work.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from heapq import merge
+from operator import itemgetter
+from event import parse_record, event_from_record
+
+MIN_PARALLEL_BYTES = 1 << 20
+CHUNKS_PER_WORKER = 4
+
+_timestamp = itemgetter(0)
+
+
+def _parse_chunk(filename, start, end):
+    """Parse the lines of <filename> that start at a byte offset in
+    [start, end).
+
+    Return the number of lines parsed, their records sorted by timestamp with
+    ties in line order, and None. If a line is malformed, stop there instead,
+    and return the line's index in the chunk as the number of lines parsed,
+    and (that index, the error message) in place of None.
+
+    @type filename: str
+    @type start: int
+    @type end: int
+    @rtype: (int, list[tuple], (int, str) | None)
+    """
+    records = []
+    lines = 0
+    with open(filename, "rb") as file:
+        if start:
+            # Skip the end of the line that started in the previous chunk.
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            try:
+                record = parse_record(line.decode("utf-8"))
+            except (ValueError, UnicodeDecodeError) as error:
+                return lines, records, (lines, str(error))
+            if record is not None:
+                records.append(record)
+            lines += 1
+    records.sort(key=_timestamp)
+    return lines, records, None
+
+
+def parse_records(filename, workers=None,
+                  min_parallel_bytes=MIN_PARALLEL_BYTES):
+    """Return the records of the events in <filename>, sorted by timestamp
+    with ties in file order.
+
+    Blank lines and comments are skipped as in create_event_list. Raise
+    ValueError naming the file and line number of the first malformed line.
+
+    @type filename: str
+    @type workers: int | None
+        The number of processes to parse with, or None for one per CPU.
+    @type min_parallel_bytes: int
+        Files smaller than this are parsed in the calling process.
+    @rtype: list[tuple]
+
+    >>> [record[:3] for record in parse_records('events_small.txt')]
+    [(1, 1, 'Dan'), (10, 0, 'Arnold')]
+    """
+    size = os.path.getsize(filename)
+    workers = workers or os.cpu_count() or 1
+    if size < min_parallel_bytes or workers == 1:
+        results = [_parse_chunk(filename, 0, size)]
+    else:
+        chunks = workers * CHUNKS_PER_WORKER
+        bounds = [size * i // chunks for i in range(chunks + 1)]
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_parse_chunk, [filename] * chunks,
+                                    bounds[:-1], bounds[1:]))
+    first_line = 1
+    for lines, _, error in results:
+        if error is not None:
+            raise ValueError("{}:{}: {}".format(
+                filename, first_line + error[0], error[1]))
+        first_line += lines
+    return list(merge(*[records for _, records, _ in results],
+                      key=_timestamp))
+
+
+def load_events(filename, workers=None,
+                min_parallel_bytes=MIN_PARALLEL_BYTES):
+    """Return the Events in <filename>, sorted by timestamp with ties in file
+    order, parsing the file on <workers> processes.
+
+    Adding the result to a PriorityQueue gives the same order of removal as
+    adding the result of create_event_list.
+
+    @type filename: str
+    @type workers: int | None
+        The number of processes to parse with, or None for one per CPU.
+    @type min_parallel_bytes: int
+        Files smaller than this are parsed in the calling process.
+    @rtype: list[Event]
+
+    >>> [str(event) for event in load_events(
+    ...     'eventsv2.txt', workers=3, min_parallel_bytes=0)][4:8]
+    ['0 -- Dahlia: Request a rider', '0 -- Edelweiss: Request a rider', \
+'0 -- Foxglove: Request a rider', '5 -- Bisque: Request a driver']
+    """
+    return [event_from_record(record) for record in
+            parse_records(filename, workers, min_parallel_bytes)]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
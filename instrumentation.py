@@ -0,0 +1,282 @@
+"""
+The instrumentation module contains the Profile class, which records where
+a simulation run spends its time.
+
+A Simulation given a Profile runs its events through a separate, instrumented
+loop; without one, the usual loop runs and nothing is measured, so
+instrumentation costs nothing when it is not used. While the profile is
+attached, the methods of its Dispatcher are wrapped to time each call, and
+to count the drivers each request_driver looks at. Only that Dispatcher is
+changed, so other simulations in the same process are not measured.
+
+=== Constants ===
+@type DISPATCHER_METHODS: tuple[str]
+    The Dispatcher methods that are timed.
+@type ROOT: str
+    The frame at the bottom of every stack in the collapsed output.
+"""
+import json
+import time
+from contextlib import contextmanager
+
+DISPATCHER_METHODS = ('request_driver', 'request_rider', 'update_driver',
+                      'register', 'unregister', 'cancel_ride', 'buffer_rider',
+                      'dispatch_batch', 'expect_cancellation', 'picked_up')
+ROOT = 'simulation'
+
+
+class Profile:
+    """Measurements of a simulation run.
+
+    Every timed call is recorded under its stack: the names of the calls it
+    was made from, outermost first, e.g. ('RiderRequest.do',
+    'Dispatcher.request_driver'). Times are wall times in seconds.
+
+    === Attributes ===
+    @type sample_interval: int
+        The simulated time between queue depth samples.
+    @type depth_samples: list[(int, int)]
+        The (simulated time, number of pending events) samples of the event
+        queue.
+    @type scans: dict[int, int]
+        For each number of drivers a call to request_driver looked at, the
+        number of calls that looked at that many.
+    """
+
+    # === Private Attributes ===
+    # @type _stacks: dict[tuple[str], list]
+    #     The [calls, total time, longest time, time in nested calls] of each
+    #     stack.
+    # @type _stack: list[str]
+    #     The names of the calls in progress, outermost first.
+    # @type _next_sample: int | None
+    #     The simulated time of the next queue depth sample, or None before
+    #     the first one.
+
+    def __init__(self, sample_interval=1):
+        """Initialize an empty Profile.
+
+        @type self: Profile
+        @type sample_interval: int
+        @rtype: None
+        """
+        self.sample_interval = sample_interval
+        self.depth_samples = []
+        self.scans = {}
+        self._stacks = {}
+        self._stack = []
+        self._next_sample = None
+
+    def record(self, name, seconds):
+        """Record a call <name> that took <seconds>, made from the calls in
+        progress.
+
+        @type self: Profile
+        @type name: str
+        @type seconds: float
+        @rtype: None
+        """
+        key = tuple(self._stack) + (name,)
+        stats = self._stacks.get(key)
+        if stats is None:
+            stats = self._stacks[key] = [0, 0.0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds > stats[2]:
+            stats[2] = seconds
+        if self._stack:
+            self._stacks[tuple(self._stack)][3] += seconds
+
+    def call(self, name, function, *args):
+        """Call <function> with <args>, record the call as <name>, and return
+        its result.
+
+        @type self: Profile
+        @type name: str
+        @type function: callable
+        @rtype: object
+
+        >>> profile = Profile()
+        >>> profile.call('outer', profile.call, 'inner', abs, -2)
+        2
+        >>> sorted(profile.calls())
+        ['inner', 'outer']
+        """
+        key = tuple(self._stack) + (name,)
+        if key not in self._stacks:
+            self._stacks[key] = [0, 0.0, 0.0, 0.0]
+        self._stack.append(name)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            self._stack.pop()
+            self.record(name, seconds)
+
+    def sample_depth(self, timestamp, depth):
+        """Record that <depth> events are pending at simulated time
+        <timestamp>, if a sample is due.
+
+        @type self: Profile
+        @type timestamp: int
+        @type depth: int
+        @rtype: None
+        """
+        if self._next_sample is None or timestamp >= self._next_sample:
+            self.depth_samples.append((timestamp, depth))
+            self._next_sample = timestamp + self.sample_interval
+
+    @contextmanager
+    def attached(self, dispatcher):
+        """Time the calls to the methods of <dispatcher> and count the
+        drivers each request_driver looks at, for the duration of a with
+        statement.
+
+        @type self: Profile
+        @type dispatcher: Dispatcher
+        @rtype: iterator[None]
+        """
+        for method in DISPATCHER_METHODS:
+            setattr(dispatcher, method, self._timed(
+                'Dispatcher.' + method, getattr(dispatcher, method)))
+        dispatcher.request_driver = self._counted(dispatcher)
+        try:
+            yield
+        finally:
+            for method in DISPATCHER_METHODS:
+                delattr(dispatcher, method)
+
+    def _timed(self, name, method):
+        """Return a function that calls <method> and records the call as
+        <name>.
+
+        @type self: Profile
+        @type name: str
+        @type method: callable
+        @rtype: callable
+        """
+        def timed(*args):
+            return self.call(name, method, *args)
+        return timed
+
+    def _counted(self, dispatcher):
+        """Return a function that calls the request_driver of <dispatcher>
+        and records the number of drivers it looked at.
+
+        @type self: Profile
+        @type dispatcher: Dispatcher
+        @rtype: callable
+        """
+        request_driver = dispatcher.request_driver
+
+        def counted(rider):
+            before = dispatcher.drivers_scanned()
+            driver = request_driver(rider)
+            scanned = dispatcher.drivers_scanned() - before
+            self.scans[scanned] = self.scans.get(scanned, 0) + 1
+            return driver
+        return counted
+
+    def calls(self):
+        """Return the number of calls, total time and longest time of each
+        kind of call, however it was reached, keyed by name.
+
+        @type self: Profile
+        @rtype: dict[str, dict[str, float]]
+
+        >>> profile = Profile()
+        >>> profile.record('Pickup.do', 0.5)
+        >>> profile.record('Pickup.do', 1.5)
+        >>> profile.calls()
+        {'Pickup.do': {'count': 2, 'total': 2.0, 'max': 1.5}}
+        """
+        calls = {}
+        for key, (count, total, longest, _) in self._stacks.items():
+            stats = calls.setdefault(key[-1],
+                                     {'count': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += count
+            if key[-1] not in key[:-1]:
+                # Recursive calls are already in the outer call's total.
+                stats['total'] += total
+            stats['max'] = max(stats['max'], longest)
+        return calls
+
+    def as_dict(self):
+        """Return the measurements as a dictionary, e.g. to save as JSON.
+
+        'events' and 'dispatcher' hold the calls of each event class's do
+        method and of each Dispatcher method, and 'queue' those of the event
+        queue. 'drivers_scanned' summarizes the drivers looked at by each
+        request_driver.
+
+        @type self: Profile
+        @rtype: dict[str, object]
+        """
+        calls = self.calls()
+        calls_made = sum(self.scans.values())
+        scanned = sum(count * calls for count, calls in self.scans.items())
+        return {
+            'events': {name[:-len('.do')]: stats
+                       for name, stats in calls.items()
+                       if name.endswith('.do')},
+            'dispatcher': {name[len('Dispatcher.'):]: stats
+                           for name, stats in calls.items()
+                           if name.startswith('Dispatcher.')},
+            'queue': {name[len('queue.'):]: stats
+                      for name, stats in calls.items()
+                      if name.startswith('queue.')},
+            'queue_depth': [list(sample) for sample in self.depth_samples],
+            'drivers_scanned': {
+                'calls': calls_made,
+                'mean': scanned / calls_made if calls_made else 0.0,
+                'max': max(self.scans, default=0),
+                'histogram': {str(count): calls for count, calls in
+                              sorted(self.scans.items())}}}
+
+    def write_json(self, file):
+        """Write the measurements to the open text file <file> as JSON.
+
+        @type self: Profile
+        @type file: file
+        @rtype: None
+        """
+        json.dump(self.as_dict(), file, indent=2)
+
+    def collapsed(self):
+        """Return the measurements in the collapsed stack format read by
+        flame graph tools: one line per stack, with the frames separated by
+        semicolons, then the microseconds spent in the innermost frame
+        itself.
+
+        @type self: Profile
+        @rtype: list[str]
+
+        >>> profile = Profile()
+        >>> profile.call('Pickup.do', profile.record, 'Dispatcher.picked_up',
+        ...              0.25)
+        >>> profile.collapsed()[1]
+        'simulation;Pickup.do;Dispatcher.picked_up 250000'
+        """
+        lines = []
+        for key, (_, total, _, nested) in self._stacks.items():
+            lines.append('{} {}'.format(
+                ';'.join((ROOT,) + key),
+                max(0, round((total - nested) * 1000000))))
+        return lines
+
+    def write_collapsed(self, file):
+        """Write the measurements to the open text file <file> in the
+        collapsed stack format.
+
+        @type self: Profile
+        @type file: file
+        @rtype: None
+        """
+        for line in self.collapsed():
+            file.write(line + '\n')
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
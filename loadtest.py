@@ -0,0 +1,448 @@
+"""
+The loadtest module drives the dispatch service with open-loop traffic and
+measures how long each request takes to be answered.
+
+The traffic is the requests of an event file, or of a synthetic one made by
+a WorkloadGenerator, with their timestamps dropped. They are sent at random
+times, as a Poisson process with a given rate, whether or not the earlier
+ones have been answered, as real riders would. The latency of a request is
+the time from when it was due to be sent to when its reply came back, so
+time spent waiting behind a slow request counts too. In process, the
+service time of each request, the time handle_line took, is also measured,
+so the dispatcher's own work can be told apart from the load generator's
+timing.
+
+The requests are made either in-process, by calling
+DispatchService.handle_line on the event loop of the load generator, or
+through a Unix socket to a service started in its own process, or through
+a running service at a given address. Each rate gets a fresh service.
+
+Running one test per rate gives a saturation curve: the latencies stay flat
+while the dispatcher keeps up, and climb once the rate is past what it can
+serve.
+
+Run it as a script, e.g.
+
+    python loadtest.py --rates 500 1000 2000 4000 --requests 5000 --socket
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from admission import AdmissionController
+from benchmark_suite import percentile
+from generate_events import WorkloadGenerator
+from service import DispatchService
+from sweep import format_table, write_csv
+
+# The first word of the lines that answer a request.
+REPLIES = ('OK', 'ERR', 'SHED')
+
+# The most seconds to wait for the last replies after the last request.
+DRAIN_TIMEOUT = 30.0
+
+
+def read_requests(filename):
+    """Return the requests of the event file <filename>, without their
+    timestamps.
+
+    @type filename: str
+    @rtype: list[str]
+    """
+    requests = []
+    with open(filename) as file:
+        for line in file:
+            tokens = line.split()
+            if tokens and not tokens[0].startswith('#'):
+                requests.append(' '.join(tokens[1:]))
+    return requests
+
+
+def synthetic_requests(count, fleet=100, seed=0):
+    """Return the requests of a synthetic event file with <fleet> drivers
+    and <count> riders, without their timestamps.
+
+    @type count: int
+    @type fleet: int
+    @type seed: int
+    @rtype: list[str]
+
+    >>> synthetic_requests(2, fleet=1, seed=1)
+    ['DriverRequest D0 84,76 3', 'RiderRequest R0 72,29 89,97 37']
+    """
+    generator = WorkloadGenerator(fleet=fleet, seed=seed)
+    return [line.split(' ', 1)[1].rstrip('\n')
+            for line in generator.lines(riders=max(0, count - fleet))][:count]
+
+
+def _tagged(request, tag):
+    """Return <request> with <tag> before its identifier, so that the
+    identifiers of different runs against one service do not collide.
+
+    @type request: str
+    @type tag: str
+    @rtype: str
+
+    >>> _tagged('Cancel Ann', 'r1-')
+    'Cancel r1-Ann'
+    """
+    tokens = request.split()
+    if len(tokens) > 1:
+        tokens[1] = tag + tokens[1]
+    return ' '.join(tokens)
+
+
+def arrivals(count, rate, seed=0):
+    """Return the times, in seconds from the start, at which <count>
+    requests arriving as a Poisson process with <rate> per second are sent.
+
+    @type count: int
+    @type rate: float
+    @type seed: int
+    @rtype: list[float]
+    """
+    rng = random.Random(seed)
+    return list(itertools.accumulate(
+        rng.expovariate(rate) for _ in range(count)))
+
+
+class _Recorder:
+    """The latencies and replies of one load test.
+
+    === Attributes ===
+    @type latencies: list[float]
+        The latency of each answered request, in seconds.
+    @type service_times: list[float]
+        The time the service took on each request, in seconds, if it was
+        measured.
+    @type replies: dict[str, int]
+        The number of replies of each kind.
+    @type last: float
+        The loop time of the last reply.
+    """
+
+    def __init__(self):
+        """Initialize an empty _Recorder.
+
+        @type self: _Recorder
+        @rtype: None
+        """
+        self.latencies = []
+        self.service_times = []
+        self.replies = dict.fromkeys(REPLIES, 0)
+        self.last = 0.0
+
+    def reply(self, word, due, now):
+        """Record a reply of kind <word> to a request due at <due>, which
+        came back at <now>.
+
+        @type self: _Recorder
+        @type word: str
+        @type due: float
+        @type now: float
+        @rtype: None
+        """
+        self.replies[word] += 1
+        self.latencies.append(now - due)
+        self.last = now
+
+
+async def _in_process(requests, times, speed, admission):
+    """Send <requests> at <times> to a DispatchService on this event loop,
+    and return the recorder and the loop time of the start.
+
+    The loop is yielded to before every request, even when the generator
+    is behind, so that the service's timers still fire.
+
+    @type requests: list[str]
+    @type times: list[float]
+    @type speed: float
+    @type admission: AdmissionController | None
+    @rtype: (_Recorder, float)
+    """
+    service = DispatchService(speed, admission=admission)
+    service.start_clock()
+    loop = asyncio.get_running_loop()
+    recorder = _Recorder()
+    start = loop.time()
+    for request, offset in zip(requests, times):
+        due = start + offset
+        delay = due - loop.time()
+        await asyncio.sleep(max(0.0, delay))
+        begin = time.perf_counter()
+        reply = service.handle_line(request)
+        recorder.service_times.append(time.perf_counter() - begin)
+        recorder.reply(reply.split(' ', 1)[0], due, loop.time())
+    return recorder, start
+
+
+async def _through_socket(requests, times, connect, connections):
+    """Send <requests> at <times> to a service over <connections>
+    connections opened by the coroutine function <connect>, and return the
+    recorder and the loop time of the start.
+
+    Requests are spread over the connections in turn, and each connection's
+    replies come back in the order of its requests.
+
+    @type requests: list[str]
+    @type times: list[float]
+    @type connect: callable
+    @type connections: int
+    @rtype: (_Recorder, float)
+    """
+    loop = asyncio.get_running_loop()
+    recorder = _Recorder()
+    streams = [await connect() for _ in range(connections)]
+    due_times = [deque() for _ in streams]
+    answered = asyncio.Event()
+    expected = len(requests)
+
+    async def read(reader, queue):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            word = line.split(b' ', 1)[0].strip().decode()
+            if word in REPLIES:
+                recorder.reply(word, queue.popleft(), loop.time())
+                if len(recorder.latencies) == expected:
+                    answered.set()
+
+    readers = [asyncio.ensure_future(read(reader, queue))
+               for (reader, _), queue in zip(streams, due_times)]
+    start = loop.time()
+    for index, (request, offset) in enumerate(zip(requests, times)):
+        due = start + offset
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        connection = index % connections
+        due_times[connection].append(due)
+        streams[connection][1].write((request + '\n').encode())
+    try:
+        await asyncio.wait_for(answered.wait(), DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    for reader in readers:
+        reader.cancel()
+    for _, writer in streams:
+        writer.close()
+    return recorder, start
+
+
+async def _serve_in_subprocess(path, speed, admission_args):
+    """Start a service listening on the Unix socket <path> in its own
+    process, wait until it accepts connections, and return the process.
+
+    @type path: str
+    @type speed: float
+    @type admission_args: list[str]
+    @rtype: asyncio.subprocess.Process
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'service.py')
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, script, '--unix', path, '--speed', str(speed),
+        *admission_args, stdout=subprocess.DEVNULL)
+    while not os.path.exists(path):
+        if process.returncode is not None:
+            raise RuntimeError("the service exited with status {}".format(
+                process.returncode))
+        await asyncio.sleep(0.01)
+    return process
+
+
+def _admission_args(admission):
+    """Return the command line arguments of service.py that set up
+    <admission>.
+
+    @type admission: AdmissionController | None
+    @rtype: list[str]
+    """
+    if admission is None:
+        return []
+    args = []
+    if admission.max_waiting is not None:
+        args += ['--max-waiting', str(admission.max_waiting)]
+    if admission.max_pending is not None:
+        args += ['--max-pending', str(admission.max_pending)]
+    if admission.shed_infeasible:
+        args.append('--shed-infeasible')
+    if admission.coalesce:
+        args.append('--coalesce')
+    return args
+
+
+async def _load_test(requests, times, mode, speed, admission, connections,
+                     address):
+    """Run one load test as described in load_test, and return the
+    recorder and the loop time of the start.
+
+    @rtype: (_Recorder, float)
+    """
+    if mode == 'in-process':
+        return await _in_process(requests, times, speed, admission)
+    if mode == 'connect':
+        host, port = address
+        return await _through_socket(
+            requests, times, lambda: asyncio.open_connection(host, port),
+            connections)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dispatch.sock')
+        process = await _serve_in_subprocess(path, speed,
+                                             _admission_args(admission))
+        try:
+            return await _through_socket(
+                requests, times, lambda: asyncio.open_unix_connection(path),
+                connections)
+        finally:
+            process.terminate()
+            await process.wait()
+
+
+def load_test(requests, rate, mode='in-process', speed=1.0, admission=None,
+              connections=16, address=None, seed=0):
+    """Send <requests> to a fresh dispatch service as an open-loop Poisson
+    process with <rate> requests per second, and return a summary.
+
+    The summary has the 'rate', the number of 'requests', the number of
+    replies of each kind ('ok', 'err' and 'shed'), the number 'lost'
+    without a reply, the 'throughput' in replies per second, and the 'p50',
+    'p95', 'p99' and 'max' latency in milliseconds. In process, it also has
+    the 'service_p50' and 'service_p99' time handle_line took on a request,
+    in milliseconds; otherwise they are None.
+
+    @type requests: list[str]
+    @type rate: float
+    @type mode: str
+        'in-process', 'socket' to start a service in its own process, or
+        'connect' to use the running service at <address>.
+    @type speed: float
+        The number of simulated time units per second of the service.
+    @type admission: AdmissionController | None
+        The admission control of the service, unless mode is 'connect'. In
+        process, its counters are those of the test afterwards.
+    @type connections: int
+        The number of connections to spread the requests over, unless mode
+        is 'in-process'.
+    @type address: (str, int) | None
+    @type seed: int
+    @rtype: dict[str, object]
+
+    >>> summary = load_test(synthetic_requests(50, fleet=5), rate=5000)
+    >>> summary['requests'], summary['ok'], summary['lost']
+    (50, 50, 0)
+    >>> sorted(summary)[:5]
+    ['err', 'lost', 'max', 'ok', 'p50']
+    >>> summary['service_p50'] <= summary['p50']
+    True
+    """
+    if mode == 'connect':
+        tag = 'L{}-'.format(random.Random(seed).getrandbits(32))
+        requests = [_tagged(request, tag) for request in requests]
+    times = arrivals(len(requests), rate, seed)
+    recorder, start = asyncio.run(_load_test(
+        requests, times, mode, speed, admission, connections, address))
+    latencies = [latency * 1000 for latency in recorder.latencies] or [0.0]
+    service_times = [seconds * 1000 for seconds in recorder.service_times]
+    elapsed = recorder.last - start
+    return {'rate': rate,
+            'requests': len(requests),
+            'ok': recorder.replies['OK'],
+            'err': recorder.replies['ERR'],
+            'shed': recorder.replies['SHED'],
+            'lost': len(requests) - len(recorder.latencies),
+            'throughput': len(recorder.latencies) / elapsed if elapsed > 0
+            else 0.0,
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies),
+            'service_p50': percentile(service_times, 0.5) if service_times
+            else None,
+            'service_p99': percentile(service_times, 0.99) if service_times
+            else None}
+
+
+def saturation_curve(requests, rates, **options):
+    """Run a load test of <requests> at each of <rates>, and return their
+    summaries, as described in load_test.
+
+    @type requests: list[str]
+    @type rates: list[float]
+    @rtype: list[dict[str, object]]
+    """
+    return [load_test(requests, rate, **options) for rate in rates]
+
+
+def main(argv=None):
+    """Run the load tests described by the command line arguments <argv>
+    and print the saturation curve.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        description='Measure dispatch latency under open-loop load.')
+    parser.add_argument('trace', nargs='?',
+                        help='event file to replay (default: synthetic)')
+    parser.add_argument('--rates', type=float, nargs='+',
+                        default=[250, 500, 1000, 2000, 4000],
+                        help='requests per second to test')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='synthetic requests per rate')
+    parser.add_argument('--fleet', type=int, default=100,
+                        help='synthetic drivers')
+    parser.add_argument('--socket', action='store_true',
+                        help='test a service in its own process over a '
+                             'Unix socket')
+    parser.add_argument('--connect', metavar='HOST:PORT',
+                        help='test the running service at this address')
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='simulated time units per second')
+    parser.add_argument('--max-waiting', type=int)
+    parser.add_argument('--max-pending', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='file to save the curve to as JSON')
+    parser.add_argument('--csv', help='file to save the curve to as CSV')
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        requests = read_requests(args.trace)
+    else:
+        requests = synthetic_requests(args.requests, args.fleet, args.seed)
+    address = None
+    mode = 'socket' if args.socket else 'in-process'
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        address = (host or '127.0.0.1', int(port))
+        mode = 'connect'
+    rows = []
+    for rate in args.rates:
+        admission = None
+        if args.max_waiting is not None or args.max_pending is not None:
+            admission = AdmissionController(args.max_waiting,
+                                            args.max_pending)
+        rows.append(load_test(requests, rate, mode, args.speed, admission,
+                              args.connections, address, args.seed))
+        print('rate {:g}: p99 {:.3f} ms'.format(rate, rows[-1]['p99']),
+              file=sys.stderr)
+    print(format_table(rows))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(rows, file, indent=2)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as file:
+            write_csv(rows, file)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,35 @@
+"""
+The location module contains the Location class and functions that measure
+distances between locations on the grid.
+
+The batch functions at the bottom of this module work on many locations in
+one call. They use NumPy arrays when NumPy is installed, and lists otherwise.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The number of strings deserialize_location remembers before it starts over.
+PARSE_CACHE_SIZE = 1 << 16
+
+# The number of locations Location interns before it starts over.
+INTERN_SIZE = 1 << 20
+
+# The Location each recently deserialized string was parsed into.
+_parsed = {}
+
+
 class Location:
     """A location based on two coordinates(m,n) on a two-dimensional grid.
+
+    Locations are immutable and hashable, and are interned: creating a
+    Location with the coordinates of an existing one returns the existing
+    object, so every point of the grid is stored once however many riders,
+    drivers and events refer to it. Once INTERN_SIZE locations are interned,
+    the table starts over, so it does not grow without bound; locations are
+    compared by coordinate, so one made before that still equals one made
+    after.
     
     ===Attributes===
     @type m: int 
@@ -9,16 +39,79 @@ class Location:
         The number of blocks the location is from the left of the grid
         A non-negative integer
     """
-    
-    def __init__(self, m, n):
-        """Initialize a location.
+
+    # === Private Attributes ===
+    # @type _interned: dict[tuple[int, int], Location]
+    #     The Locations created since the table last started over, keyed by
+    #     coordinate.
+
+    __slots__ = ('coordinate',)
+    _interned = {}
+
+    def __new__(cls, m, n):
+        """Return the location at (m, n).
+
+        @type cls: type
+        @type m: int
+        @type n: int
+        @rtype: Location
+
+        >>> Location(2, 3) is Location(2, 3)
+        True
+        """
+        coordinate = (m, n)
+        location = cls._interned.get(coordinate) if cls is Location else None
+        if location is None:
+            location = object.__new__(cls)
+            object.__setattr__(location, 'coordinate', coordinate)
+            if cls is Location:
+                if len(cls._interned) >= INTERN_SIZE:
+                    cls._interned.clear()
+                cls._interned[coordinate] = location
+        return location
+
+    def __setattr__(self, name, value):
+        """Raise AttributeError, since locations are immutable.
 
         @type self: Location
-        @type row: int
-        @type column: int
+        @type name: str
+        @type value: object
         @rtype: None
+
+        >>> Location(2, 3).coordinate = (1, 1)
+        Traceback (most recent call last):
+        AttributeError: Location is immutable
+        """
+        raise AttributeError("Location is immutable")
+
+    def __delattr__(self, name):
+        """Raise AttributeError, since locations are immutable.
+
+        @type self: Location
+        @type name: str
+        @rtype: None
+        """
+        raise AttributeError("Location is immutable")
+
+    def __reduce__(self):
+        """Return how to rebuild this location when it is unpickled, so that
+        unpickled locations are interned as well.
+
+        @type self: Location
+        @rtype: tuple
+        """
+        return type(self), self.coordinate
+
+    def __hash__(self):
+        """Return a hash of this location.
+
+        @type self: Location
+        @rtype: int
+
+        >>> len({Location(1, 2), Location(1, 2), Location(2, 1)})
+        2
         """
-        self.coordinate = (m, n)
+        return hash(self.coordinate)
 
     def __str__(self):
         """Return a string representation.
@@ -48,7 +141,8 @@ class Location:
         >>> loc2 == loc3
         False
         """
-        return type(self) == type(other) and self.coordinate == other.coordinate
+        return self is other or (type(self) == type(other) and
+                                 self.coordinate == other.coordinate)
 
 
 def manhattan_distance(origin, destination):
@@ -72,6 +166,9 @@ def manhattan_distance(origin, destination):
 def deserialize_location(location_str):
     """Deserialize a location.
 
+    Results are cached, so deserializing the same string again is a single
+    dictionary lookup.
+
     @type location_str: str
         A location in the format 'm,n'
     @rtype: Location
@@ -79,9 +176,111 @@ def deserialize_location(location_str):
     >>> point1 = deserialize_location('1,2')
     >>> print(point1)
     (1, 2)
+    >>> deserialize_location('1,2') is point1
+    True
+    """
+    location = _parsed.get(location_str)
+    if location is None:
+        if len(_parsed) >= PARSE_CACHE_SIZE:
+            _parsed.clear()
+        m, n = location_str.split(',')
+        location = Location(int(m), int(n))
+        _parsed[location_str] = location
+    return location
+
+
+def coordinates(locations):
+    """Return the coordinates of <locations> as an array of (m, n) rows, or
+    a list of (m, n) tuples without NumPy.
+
+    @type locations: list[Location] | numpy.ndarray
+    @rtype: numpy.ndarray | list[tuple[int, int]]
+
+    >>> [[int(x) for x in row]
+    ...  for row in coordinates([Location(1, 2), Location(3, 4)])]
+    [[1, 2], [3, 4]]
     """
-    location_list = location_str.split(',')
-    return Location(int(location_list[0]), int(location_list[1]))
+    if np is None:
+        return [location.coordinate for location in locations]
+    if isinstance(locations, np.ndarray):
+        return locations
+    return np.array([location.coordinate for location in locations],
+                    dtype=np.int64).reshape(-1, 2)
+
+
+def manhattan_distances(origins, destinations):
+    """Return the Manhattan distances between <origins> and <destinations>.
+
+    Either argument may be a single Location or a sequence of them. A single
+    Location is compared with every location in the other argument; two
+    sequences are compared pairwise. With NumPy, arrays of (m, n) rows are
+    accepted too, and are broadcast against each other, so a (k, 1, 2) array
+    of origins and a (1, j, 2) array of destinations give a k by j matrix.
+
+    @type origins: Location | list[Location] | numpy.ndarray
+    @type destinations: Location | list[Location] | numpy.ndarray
+    @rtype: list[int] | numpy.ndarray
+
+    >>> points = [Location(4, 4), Location(1, 0)]
+    >>> [int(d) for d in manhattan_distances(Location(1, 1), points)]
+    [6, 1]
+    >>> [int(d) for d in manhattan_distances(points, points[::-1])]
+    [7, 7]
+    """
+    if np is None:
+        if isinstance(origins, Location):
+            return [manhattan_distance(origins, destination)
+                    for destination in destinations]
+        if isinstance(destinations, Location):
+            return [manhattan_distance(origin, destinations)
+                    for origin in origins]
+        return [manhattan_distance(origin, destination)
+                for origin, destination in zip(origins, destinations)]
+    if isinstance(origins, Location):
+        origins = np.array(origins.coordinate, dtype=np.int64)
+    if isinstance(destinations, Location):
+        destinations = np.array(destinations.coordinate, dtype=np.int64)
+    return np.abs(coordinates(origins) -
+                  coordinates(destinations)).sum(axis=-1)
+
+
+def travel_times(distances, speeds):
+    """Return the times taken to travel <distances> at <speeds>, rounded down
+    like Driver.get_travel_time.
+
+    @type distances: list[int] | numpy.ndarray
+    @type speeds: int | list[int] | numpy.ndarray
+    @rtype: list[int] | numpy.ndarray
+
+    >>> [int(t) for t in travel_times([6, 3, 5], [3, 3, 2])]
+    [2, 1, 2]
+    """
+    if np is None:
+        if isinstance(speeds, int):
+            return [distance // speeds for distance in distances]
+        return [distance // speed
+                for distance, speed in zip(distances, speeds)]
+    return np.floor_divide(distances, speeds)
+
+
+def drive_times(distances, speeds):
+    """Return the times taken to travel <distances> at <speeds>, rounded to
+    the nearest integer like Driver.start_drive. Halves round to even.
+
+    @type distances: list[int] | numpy.ndarray
+    @type speeds: int | list[int] | numpy.ndarray
+    @rtype: list[int] | numpy.ndarray
+
+    >>> [int(t) for t in drive_times([10, 5, 3], [5, 2, 2])]
+    [2, 2, 2]
+    """
+    if np is None:
+        if isinstance(speeds, int):
+            return [round(distance / speeds) for distance in distances]
+        return [round(distance / speed)
+                for distance, speed in zip(distances, speeds)]
+    return np.rint(np.true_divide(distances, speeds)).astype(np.int64)
+
 
 if __name__ == '__main__':
     import doctest
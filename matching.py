@@ -0,0 +1,137 @@
+"""
+The matching module contains the functions the Dispatcher uses to assign a
+batch of riders to drivers so that the total time to pick them all up is as
+small as possible.
+
+NumPy and SciPy are used when they are installed; otherwise the cost matrix
+and the assignment are computed in pure Python with the same results.
+"""
+from location import coordinates, manhattan_distances, travel_times
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+
+def eta_matrix(origins, drivers):
+    """Return the travel time of every driver to every origin.
+
+    Entry [i][j] is drivers[j].get_travel_time(origins[i]).
+
+    @type origins: list[Location]
+    @type drivers: list[Driver]
+    @rtype: list[list[int]] | numpy.ndarray
+
+    >>> from location import Location
+    >>> from driver import Driver
+    >>> drivers = [Driver('A', Location(0, 0), 1),
+    ...            Driver('B', Location(4, 4), 2)]
+    >>> etas = eta_matrix([Location(1, 1), Location(4, 5)], drivers)
+    >>> [[int(eta) for eta in row] for row in etas]
+    [[2, 3], [9, 0]]
+    """
+    if np is not None:
+        rows = coordinates(origins)[:, None, :]
+        cols = coordinates([driver.location for driver in drivers])
+        cols = cols[None, :, :]
+        speeds = np.array([driver.speed for driver in drivers],
+                          dtype=np.int64)
+        return travel_times(manhattan_distances(rows, cols), speeds[None, :])
+    return [[driver.get_travel_time(origin) for driver in drivers]
+            for origin in origins]
+
+
+def assign(cost):
+    """Return a minimum-cost assignment of rows to columns of <cost>.
+
+    Every row is assigned a distinct column if there are at least as many
+    columns as rows, and every column a distinct row otherwise. The result is
+    a list of (row, column) pairs sorted by row.
+
+    @type cost: list[list[int]] | numpy.ndarray
+    @rtype: list[tuple[int, int]]
+
+    >>> assign([[4, 1, 3], [2, 0, 5], [3, 2, 2]])
+    [(0, 1), (1, 0), (2, 2)]
+    >>> assign([[7, 1], [1, 7], [5, 5]])
+    [(0, 1), (1, 0)]
+    >>> assign([])
+    []
+    """
+    if len(cost) == 0 or len(cost[0]) == 0:
+        return []
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(np.asarray(cost))
+        return [(int(row), int(col)) for row, col in zip(rows, cols)]
+    cost = [list(row) for row in cost]
+    if len(cost) <= len(cost[0]):
+        return _hungarian(cost)
+    transposed = [list(column) for column in zip(*cost)]
+    return sorted((row, col) for col, row in _hungarian(transposed))
+
+
+def _hungarian(cost):
+    """Return a minimum-cost assignment of every row of <cost> to a distinct
+    column, as a list of (row, column) pairs sorted by row.
+
+    This is the O(n^2 m) shortest augmenting path form of the Hungarian
+    algorithm.
+
+    Precondition: cost has at least one row and no more rows than columns.
+
+    @type cost: list[list[int]]
+    @rtype: list[tuple[int, int]]
+    """
+    n = len(cost)
+    m = len(cost[0])
+    infinity = float('inf')
+    # Potentials of rows (u) and columns (v), and the row matched to each
+    # column (p). Row and column 0 are sentinels; real indices start at 1.
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [infinity] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            delta = infinity
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    current = row[j - 1] - u[i0] - v[j]
+                    if current < minv[j]:
+                        minv[j] = current
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    return sorted((p[j] - 1, j - 1) for j in range(1, m + 1) if p[j])
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,372 @@
+"""
+The Monitor module contains the Monitor class, the Activity class,
+and a collection of constants. Together the elements of the module
+help keep a record of activities that have occurred.
+
+Activities fall into two categories: Rider activities and Driver
+activities. Each activity also has a description, which is one of
+request, cancel, pickup, or dropoff.
+
+=== Constants ===
+@type RIDER: str
+    A constant used for the Rider activity category.
+@type DRIVER: str
+    A constant used for the Driver activity category.
+@type REQUEST: str
+    A constant used for the request activity description.
+@type CANCEL: str
+    A constant used for the cancel activity description.
+@type PICKUP: str
+    A constant used for the pickup activity description.
+@type DROPOFF: str
+    A constant used for the dropoff activity description.
+"""
+from array import array
+from location import Location
+
+RIDER = "rider"
+DRIVER = "driver"
+
+REQUEST = "request"
+CANCEL = "cancel"
+PICKUP = "pickup"
+DROPOFF = "dropoff"
+
+# The codes that categories and descriptions are stored as.
+CATEGORIES = {RIDER: 0, DRIVER: 1}
+DESCRIPTIONS = {REQUEST: 0, CANCEL: 1, PICKUP: 2, DROPOFF: 3}
+_REQUEST, _CANCEL, _PICKUP, _DROPOFF = 0, 1, 2, 3
+_DESCRIPTION_NAMES = [REQUEST, CANCEL, PICKUP, DROPOFF]
+
+# The states of a rider in the monitor.
+_UNSEEN, _WAITING, _DONE = 0, 1, 2
+
+
+class Activity:
+    """An activity that occurs in the simulation.
+
+    === Attributes ===
+    @type timestamp: int
+        The time at which the activity occurred.
+    @type description: str
+        A description of the activity.
+    @type identifier: str
+        An identifier for the person doing the activity.
+    @type location: Location
+        The location at which the activity occurred.
+    """
+
+    def __init__(self, timestamp, description, identifier, location):
+        """Initialize an Activity.
+
+        @type self: Activity
+        @type timestamp: int
+        @type description: str
+        @type identifier: str
+        @type location: Location
+        @rtype: None
+        """
+        self.description = description
+        self.time = timestamp
+        self.id = identifier
+        self.location = location
+
+
+class Monitor:
+    """A monitor keeps a record of activities that it is notified about.
+    When required, it generates a report of the activities it has recorded.
+
+    Activities are stored in parallel typed arrays rather than as Activity
+    objects, and the statistics in the report are kept up to date as each
+    activity arrives, so report takes constant time however long the run.
+    """
+
+    # === Private Attributes ===
+    # @type _times: array[int]
+    #     The timestamp of each activity.
+    # @type _categories: array[int]
+    #     The code in CATEGORIES of the category of each activity.
+    # @type _descriptions: array[int]
+    #     The code in DESCRIPTIONS of the description of each activity.
+    # @type _ids: array[int]
+    #     The code of the identifier of each activity.
+    # @type _ms, _ns: array[int]
+    #     The coordinates of the location of each activity.
+    # @type _codes: dict[str, int]
+    #     The code of every identifier seen so far.
+    # @type _identifiers: list[str]
+    #     Every identifier seen so far, by code.
+    # @type _rider_states: bytearray
+    #     For each identifier code, _UNSEEN if no rider has it, _WAITING if
+    #     the rider is waiting, and _DONE if they have stopped waiting.
+    # @type _waiting: dict[int, int]
+    #     The time of the request of each waiting rider.
+    # @type _rider_count: int
+    #     The number of riders seen so far.
+    # @type _drivers: dict[int, (int, int, int) | None]
+    #     For each driver seen so far, the description code and coordinates
+    #     of their last activity, or None if forget_driver was called since.
+    # @type _wait_time, _waits: int
+    #     The total time riders waited, and the number of riders who stopped
+    #     waiting.
+    # @type _total_distance, _ride_distance: int
+    #     The total distance driven by drivers, and driven on rides.
+    # @type _requests, _cancellations: int
+    #     The number of rider requests and cancellations.
+
+    def __init__(self):
+        """Initialize a Monitor.
+
+        @type self: Monitor
+        """
+        self._times = array('q')
+        self._categories = array('B')
+        self._descriptions = array('B')
+        self._ids = array('I')
+        self._ms = array('i')
+        self._ns = array('i')
+        self._codes = {}
+        self._identifiers = []
+        self._rider_states = bytearray()
+        self._waiting = {}
+        self._rider_count = 0
+        self._drivers = {}
+        self._wait_time = 0
+        self._waits = 0
+        self._total_distance = 0
+        self._ride_distance = 0
+        self._requests = 0
+        self._cancellations = 0
+
+    def __str__(self):
+        """Return a string representation.
+
+        @type self: Monitor
+        @rtype: str
+        """
+        return "Monitor ({} drivers, {} riders)".format(
+                len(self._drivers), self._rider_count)
+
+    def __len__(self):
+        """Return the number of activities recorded.
+
+        @type self: Monitor
+        @rtype: int
+        """
+        return len(self._times)
+
+    def notify(self, timestamp, category, description, identifier, location):
+        """Notify the monitor of the activity.
+
+        @type self: Monitor
+        @type timestamp: int
+            The time of the activity.
+        @type category: DRIVER | RIDER
+            The category for the activity.
+        @type description: REQUEST | CANCEL | PICKUP | DROP_OFF
+            A description of the activity.
+        @type identifier: str
+            The identifier for the actor.
+        @type location: Location
+            The location of the activity.
+        @rtype: None
+        """
+        code = self._codes.get(identifier)
+        if code is None:
+            code = self._codes[identifier] = len(self._identifiers)
+            self._identifiers.append(identifier)
+            self._rider_states.append(_UNSEEN)
+        kind = DESCRIPTIONS[description]
+        m, n = location.coordinate
+        self._times.append(timestamp)
+        self._categories.append(CATEGORIES[category])
+        self._descriptions.append(kind)
+        self._ids.append(code)
+        self._ms.append(m)
+        self._ns.append(n)
+
+        if category == RIDER:
+            state = self._rider_states[code]
+            if state == _UNSEEN:
+                self._rider_count += 1
+            if kind == _REQUEST:
+                self._requests += 1
+                if state == _UNSEEN:
+                    self._waiting[code] = timestamp
+                    self._rider_states[code] = _WAITING
+            else:
+                if kind == _CANCEL:
+                    self._cancellations += 1
+                # Only the first activity after the request ends the wait.
+                if state == _WAITING:
+                    self._wait_time += timestamp - self._waiting.pop(code)
+                    self._waits += 1
+                self._rider_states[code] = _DONE
+        else:
+            last = self._drivers.get(code)
+            if last is not None:
+                distance = abs(m - last[1]) + abs(n - last[2])
+                self._total_distance += distance
+                if last[0] == _PICKUP and kind == _DROPOFF:
+                    self._ride_distance += distance
+            self._drivers[code] = (kind, m, n)
+
+    def forget_driver(self, identifier):
+        """Forget where the driver with <identifier> was last seen, e.g.
+        because they have moved to another monitor's part of the grid.
+
+        The distance they have driven so far still counts, and their next
+        activity, if any, is treated like their first.
+
+        @type self: Monitor
+        @type identifier: str
+        @rtype: None
+        """
+        code = self._codes.get(identifier)
+        if code in self._drivers:
+            self._drivers[code] = None
+
+    def merge(self, other):
+        """Add the activities recorded by the Monitor <other> to this one,
+        after those already recorded, as if this monitor had been notified
+        of them.
+
+        Every rider's activities must have been recorded by one monitor. A
+        driver's may be split between them, as when a driver moves from one
+        region of a sharded simulation to another, as long as each monitor
+        forgets the driver when they leave, and the driver's first activity
+        in their new monitor is where they left the old one.
+
+        @type self: Monitor
+        @type other: Monitor
+        @rtype: None
+
+        >>> west, east = Monitor(), Monitor()
+        >>> west.notify(0, DRIVER, REQUEST, 'Jum', Location(1, 1))
+        >>> west.notify(0, RIDER, REQUEST, 'Ann', Location(1, 1))
+        >>> west.notify(3, DRIVER, DROPOFF, 'Jum', Location(9, 1))
+        >>> west.forget_driver('Jum')
+        >>> east.notify(3, DRIVER, REQUEST, 'Jum', Location(9, 1))
+        >>> east.notify(5, RIDER, CANCEL, 'Bo', Location(9, 3))
+        >>> west.merge(east)
+        >>> len(west), west.report()['driver_total_distance']
+        (5, 8.0)
+        >>> [activity.id for activity in west.activities(RIDER)]
+        ['Ann', 'Bo']
+        """
+        codes = []
+        for identifier in other._identifiers:
+            code = self._codes.get(identifier)
+            if code is None:
+                code = self._codes[identifier] = len(self._identifiers)
+                self._identifiers.append(identifier)
+                self._rider_states.append(_UNSEEN)
+            codes.append(code)
+        self._times.extend(other._times)
+        self._categories.extend(other._categories)
+        self._descriptions.extend(other._descriptions)
+        self._ids.extend(codes[code] for code in other._ids)
+        self._ms.extend(other._ms)
+        self._ns.extend(other._ns)
+
+        for code, state in enumerate(other._rider_states):
+            if state != _UNSEEN:
+                self._rider_states[codes[code]] = state
+        for code, timestamp in other._waiting.items():
+            self._waiting[codes[code]] = timestamp
+        for code, last in other._drivers.items():
+            if last is not None or codes[code] not in self._drivers:
+                self._drivers[codes[code]] = last
+        self._rider_count += other._rider_count
+        self._wait_time += other._wait_time
+        self._waits += other._waits
+        self._total_distance += other._total_distance
+        self._ride_distance += other._ride_distance
+        self._requests += other._requests
+        self._cancellations += other._cancellations
+
+    def activities(self, category=None):
+        """Yield the recorded activities in the order they were recorded,
+        only those in <category> if it is given.
+
+        @type self: Monitor
+        @type category: RIDER | DRIVER | None
+        @rtype: iterator[Activity]
+
+        >>> m = Monitor()
+        >>> m.notify(0, RIDER, REQUEST, 'Ann', Location(1, 1))
+        >>> m.notify(0, DRIVER, REQUEST, 'Jum', Location(3, 3))
+        >>> [(a.time, a.description, a.id, str(a.location))
+        ...  for a in m.activities(DRIVER)]
+        [(0, 'request', 'Jum', '(3, 3)')]
+        """
+        wanted = None if category is None else CATEGORIES[category]
+        for index in range(len(self._times)):
+            if wanted is None or self._categories[index] == wanted:
+                yield Activity(self._times[index],
+                               _DESCRIPTION_NAMES[self._descriptions[index]],
+                               self._identifiers[self._ids[index]],
+                               Location(self._ms[index], self._ns[index]))
+
+    def report(self):
+        """Return a report of the activities that have occurred.
+
+        @type self: Monitor
+        @rtype: dict[str, object]
+
+        >>> m = Monitor()
+        >>> m.notify(0, RIDER, REQUEST, 'Ann', Location(1, 1))
+        >>> m.notify(0, RIDER, REQUEST, 'Bo', Location(2, 2))
+        >>> m.notify(0, DRIVER, REQUEST, 'Jum', Location(3, 3))
+        >>> m.notify(4, DRIVER, PICKUP, 'Jum', Location(1, 1))
+        >>> m.notify(4, RIDER, PICKUP, 'Ann', Location(1, 1))
+        >>> m.notify(5, RIDER, CANCEL, 'Bo', Location(2, 2))
+        >>> m.notify(7, DRIVER, DROPOFF, 'Jum', Location(4, 1))
+        >>> sorted(m.report().items())
+        [('cancellation_rate', 0.5), ('driver_ride_distance', 3.0), \
+('driver_total_distance', 7.0), ('rider_wait_time', 4.5)]
+        """
+        return {"rider_wait_time": self._average_wait_time(),
+                "driver_total_distance": self._average_total_distance(),
+                "driver_ride_distance": self._average_ride_distance(),
+                "cancellation_rate": self._cancellation_rate()}
+
+    def _average_wait_time(self):
+        """Return the average wait time of riders that have either been picked
+        up or have cancelled their ride.
+
+        @type self: Monitor
+        @rtype: float
+        """
+        return self._wait_time / self._waits if self._waits else 0.0
+
+    def _average_total_distance(self):
+        """Return the average distance drivers have driven.
+
+        @type self: Monitor
+        @rtype: float
+        """
+        count = len(self._drivers)
+        return self._total_distance / count if count else 0.0
+
+    def _average_ride_distance(self):
+        """Return the average distance drivers have driven on rides.
+
+        @type self: Monitor
+        @rtype: float
+        """
+        count = len(self._drivers)
+        return self._ride_distance / count if count else 0.0
+
+    def _cancellation_rate(self):
+        """Return the fraction of rider requests that were cancelled.
+
+        @type self: Monitor
+        @rtype: float
+        """
+        return self._cancellations / self._requests if self._requests else 0.0
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
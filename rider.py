@@ -34,6 +34,8 @@ class Rider:
     before they cancel their pickup request
     """
 
+    __slots__ = ('rider_id', 'origin', 'destination', 'status', 'patience')
+
     def __init__(self, rider_id, origin, destination, patience):
         """
         Initialize a new rider object.
@@ -0,0 +1,595 @@
+"""
+The service module runs a Dispatcher as a live service on the asyncio event
+loop, instead of replaying an event file.
+
+Clients connect over TCP or a Unix socket and send one request per line, in
+the format of an event file line (see event.parse_record), with the
+timestamp left out or ignored, since a request happens when it arrives:
+
+    RiderRequest <id> <m>,<n> <m>,<n> <patience>
+    DriverRequest <id> <m>,<n> <speed>
+    Cancel <id>
+    Subscribe
+
+Each request is answered with 'OK <id>' or 'ERR <reason>', or, if the
+service has an AdmissionController that sheds a rider request,
+'SHED <reason> <id>' (see the admission module). Requests are
+done as events, exactly as in a Simulation, and the events they spawn, such
+as Pickups, Dropoffs and Cancellations, are scheduled as timers on the event
+loop. Time is measured in simulated time units since the service started,
+running <speed> times faster than seconds.
+
+Every activity the monitor is notified of is sent to the client that made
+the request it concerns, and to every client that sent Subscribe, as
+
+    ACTIVITY <time> <category> <description> <id> <m>,<n>
+
+Each connection is served by a coroutine, so one process serves thousands of
+clients at once. Activities are sent without waiting for a client to read
+them, so a client that falls more than <max_buffer> bytes behind is
+disconnected, rather than buffering activities for it without limit.
+
+Run it as a script, e.g.
+
+    python service.py --port 7000 --speed 10 --max-waiting 500
+
+=== Constants ===
+@type MAX_BUFFER: int
+    The default number of bytes that may be waiting to be sent to a client
+    before it is disconnected.
+"""
+import argparse
+import asyncio
+from admission import AdmissionController
+from container import _tombstone_stats
+from dispatcher import Dispatcher
+from event import (RiderRequest, DRIVER_REQUEST, event_from_record,
+                   parse_record)
+from monitor import Monitor, RIDER, PICKUP, CANCEL
+
+MAX_BUFFER = 1 << 20
+
+
+class TimerScheduler:
+    """An event queue that schedules each event as a timer on an asyncio
+    event loop, to be done when its time comes.
+
+    It can be used as the scheduler of a Dispatcher, which tombstones the
+    Cancellations of riders who have been picked up by cancelling their
+    timers.
+    """
+
+    # === Private Attributes ===
+    # @type _loop: asyncio.AbstractEventLoop
+    #     The event loop the timers are on.
+    # @type _epoch: float
+    #     The loop time of simulated time 0.
+    # @type _speed: float
+    #     The number of simulated time units per second.
+    # @type _fire: callable
+    #     The function called with each event when its time comes.
+    # @type _handles: dict[int, asyncio.TimerHandle]
+    #     The timer of every pending event, by the id of the event, since
+    #     events compare by time and are not hashable.
+    # @type _stats: dict[str, int]
+    #     The counters returned by stats.
+
+    def __init__(self, loop, epoch, speed, fire):
+        """Initialize an empty TimerScheduler.
+
+        @type self: TimerScheduler
+        @type loop: asyncio.AbstractEventLoop
+        @type epoch: float
+        @type speed: float
+        @type fire: callable
+        @rtype: None
+        """
+        self._loop = loop
+        self._epoch = epoch
+        self._speed = speed
+        self._fire = fire
+        self._handles = {}
+        self._stats = _tombstone_stats()
+
+    def add(self, event):
+        """Schedule <event> to be done at its timestamp.
+
+        @type self: TimerScheduler
+        @type event: Event
+        @rtype: None
+        """
+        self._handles[id(event)] = self._loop.call_at(
+            self._epoch + event.timestamp / self._speed, self._done, event)
+
+    def _done(self, event):
+        """Do <event>, whose time has come.
+
+        @type self: TimerScheduler
+        @type event: Event
+        @rtype: None
+        """
+        del self._handles[id(event)]
+        self._fire(event)
+
+    def cancel(self, event):
+        """Tombstone <event>, so that it is never done.
+
+        @type self: TimerScheduler
+        @type event: Event
+        @rtype: None
+        """
+        handle = self._handles.pop(id(event), None)
+        if handle is not None:
+            handle.cancel()
+            event.cancelled = True
+            self._stats['cancelled'] += 1
+            self._stats['compacted'] += 1
+
+    def remove(self, event):
+        """Take <event> out of the pending events, to be done now instead of
+        at its timestamp. Unlike cancel, this does not tombstone it.
+
+        @type self: TimerScheduler
+        @type event: Event
+        @rtype: None
+        """
+        handle = self._handles.pop(id(event), None)
+        if handle is not None:
+            handle.cancel()
+
+    def is_empty(self):
+        """Return True iff no events are pending.
+
+        @type self: TimerScheduler
+        @rtype: bool
+        """
+        return not self._handles
+
+    def __len__(self):
+        """Return the number of pending events.
+
+        @type self: TimerScheduler
+        @rtype: int
+        """
+        return len(self._handles)
+
+    def stats(self):
+        """Return counters of the tombstoned events, as described in
+        PriorityQueue.stats. Cancelled timers are dropped at once, so every
+        tombstoned event counts as 'compacted'.
+
+        @type self: TimerScheduler
+        @rtype: dict[str, int]
+        """
+        return dict(self._stats)
+
+
+class StreamingMonitor(Monitor):
+    """A Monitor that also passes every activity on to a listener as it is
+    notified of it.
+    """
+
+    # === Private Attributes ===
+    # @type _listener: callable
+    #     Called with the arguments of every notify.
+
+    def __init__(self, listener):
+        """Initialize a StreamingMonitor that passes activities to
+        <listener>.
+
+        @type self: StreamingMonitor
+        @type listener: callable
+        @rtype: None
+        """
+        super().__init__()
+        self._listener = listener
+
+    def notify(self, timestamp, category, description, identifier, location):
+        """Record the activity and pass it on to the listener.
+
+        @type self: StreamingMonitor
+        @type timestamp: int
+        @type category: DRIVER | RIDER
+        @type description: REQUEST | CANCEL | PICKUP | DROP_OFF
+        @type identifier: str
+        @type location: Location
+        @rtype: None
+        """
+        super().notify(timestamp, category, description, identifier, location)
+        self._listener(timestamp, category, description, identifier, location)
+
+
+class DispatchService:
+    """A ride-sharing dispatch service that clients connect to.
+
+    === Attributes ===
+    @type dispatcher: Dispatcher
+        The dispatcher that matches riders and drivers.
+    @type monitor: StreamingMonitor
+        The monitor of every activity of the service.
+    @type speed: float
+        The number of simulated time units per second.
+    @type admission: AdmissionController | None
+        The controller that decides which rider requests are let in, or
+        None to let every request in.
+    @type max_buffer: int
+        The most bytes that may be waiting to be sent to a client before it
+        is disconnected.
+    @type disconnected: int
+        The number of clients disconnected for falling behind.
+    """
+
+    # === Private Attributes ===
+    # @type _events: TimerScheduler | None
+    #     The pending events, once the service has started.
+    # @type _loop: asyncio.AbstractEventLoop | None
+    #     The event loop the service runs on, once it has started.
+    # @type _epoch: float
+    #     The loop time at which the service started.
+    # @type _riders: dict[str, Rider]
+    #     The riders who are waiting to be picked up, by identifier.
+    # @type _owners: dict[str, asyncio.StreamWriter]
+    #     The connection of the client that made the last request for each
+    #     rider or driver, by identifier, until the rider is picked up or
+    #     cancels, or the client disconnects.
+    # @type _owned: dict[asyncio.StreamWriter, set[str]]
+    #     The identifiers owned by the client on each connection.
+    # @type _subscribers: set[asyncio.StreamWriter]
+    #     The connections of the clients that receive every activity.
+
+    def __init__(self, speed=1.0, batch_window=None, admission=None,
+                 max_buffer=MAX_BUFFER):
+        """Initialize a DispatchService.
+
+        @type self: DispatchService
+        @type speed: float
+        @type batch_window: int | None
+            The batch window of the dispatcher.
+        @type admission: AdmissionController | None
+        @type max_buffer: int
+        @rtype: None
+        """
+        self.dispatcher = Dispatcher(batch_window)
+        self.monitor = StreamingMonitor(self._broadcast)
+        self.speed = speed
+        self.admission = admission
+        self.max_buffer = max_buffer
+        self.disconnected = 0
+        self._events = None
+        self._loop = None
+        self._epoch = 0.0
+        self._riders = {}
+        self._owners = {}
+        self._owned = {}
+        self._subscribers = set()
+
+    def start_clock(self):
+        """Start the clock of the service on the running event loop.
+
+        @type self: DispatchService
+        @rtype: None
+        """
+        self._loop = asyncio.get_running_loop()
+        self._epoch = self._loop.time()
+        self._events = TimerScheduler(self._loop, self._epoch, self.speed,
+                                      self._do)
+        self.dispatcher.scheduler = self._events
+
+    def now(self):
+        """Return the current simulated time.
+
+        @type self: DispatchService
+        @rtype: int
+        """
+        return int((self._loop.time() - self._epoch) * self.speed)
+
+    def _do(self, event):
+        """Do <event> and schedule the events it spawns.
+
+        Spawned events due at the same time, such as the DriverRequest of a
+        Dropoff, are done at once, so that no client request is served
+        between the two. If one were, it could be given the driver of the
+        Dropoff while the driver is idle, before their DriverRequest hands
+        them the next waiting rider as well.
+
+        @type self: DispatchService
+        @type event: Event
+        @rtype: None
+
+        >>> from event import Dropoff
+        >>> from location import Location
+        >>> from rider import Rider
+        >>> async def demo():
+        ...     service = DispatchService()
+        ...     service.start_clock()
+        ...     for line in ['DriverRequest Jum 1,1 1',
+        ...                  'RiderRequest Ann 1,1 1,2 9',
+        ...                  'RiderRequest Bo 1,2 1,3 9']:
+        ...         _ = service.handle_line(line)
+        ...     jum = service.dispatcher.get_driver('Jum')
+        ...     ann = Rider('Ann', Location(1, 1), Location(1, 2), 9)
+        ...     service._do(Dropoff(1, jum, ann))
+        ...     return jum.is_idle, service.dispatcher.num_waiting_riders()
+        >>> asyncio.run(demo())
+        (False, 0)
+        """
+        for spawned in event.do(self.dispatcher, self.monitor):
+            if spawned.timestamp <= event.timestamp:
+                self._do(spawned)
+            else:
+                self._events.add(spawned)
+
+    def _broadcast(self, timestamp, category, description, identifier,
+                   location):
+        """Send an activity to the client that owns <identifier> and to the
+        subscribers.
+
+        @type self: DispatchService
+        @type timestamp: int
+        @type category: DRIVER | RIDER
+        @type description: REQUEST | CANCEL | PICKUP | DROP_OFF
+        @type identifier: str
+        @type location: Location
+        @rtype: None
+        """
+        final = category == RIDER and description in (PICKUP, CANCEL)
+        if final:
+            self._riders.pop(identifier, None)
+            if description == PICKUP and self.admission is not None:
+                self.admission.observe_pickup(timestamp)
+        data = 'ACTIVITY {} {} {} {} {},{}\n'.format(
+            timestamp, category, description, identifier,
+            *location.coordinate).encode()
+        owner = self._owners.get(identifier)
+        if owner is not None and owner not in self._subscribers:
+            self._send(owner, data)
+        for subscriber in list(self._subscribers):
+            self._send(subscriber, data)
+        if final:
+            # The rider has no more activities to be sent.
+            self._disown(identifier)
+
+    def _own(self, identifier, writer):
+        """Make the client on <writer> the owner of <identifier>.
+
+        @type self: DispatchService
+        @type identifier: str
+        @type writer: asyncio.StreamWriter
+        @rtype: None
+        """
+        owner = self._owners.get(identifier)
+        if owner is not writer:
+            if owner is not None:
+                self._owned[owner].discard(identifier)
+            self._owners[identifier] = writer
+            self._owned.setdefault(writer, set()).add(identifier)
+
+    def _disown(self, identifier):
+        """Forget the owner of <identifier>, if it has one.
+
+        @type self: DispatchService
+        @type identifier: str
+        @rtype: None
+        """
+        owner = self._owners.pop(identifier, None)
+        if owner is not None:
+            self._owned[owner].discard(identifier)
+
+    def _send(self, writer, data):
+        """Send <data> to the client on <writer>, or disconnect the client if
+        more than max_buffer bytes are already waiting to be sent to it.
+
+        @type self: DispatchService
+        @type writer: asyncio.StreamWriter
+        @type data: bytes
+        @rtype: None
+        """
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            self._subscribers.discard(writer)
+            self.disconnected += 1
+            writer.close()
+            return
+        writer.write(data)
+
+    def handle_line(self, line, writer=None):
+        """Carry out the request on <line> from the client on <writer>, and
+        return the reply.
+
+        @type self: DispatchService
+        @type line: str
+        @type writer: asyncio.StreamWriter | None
+        @rtype: str
+        """
+        tokens = line.split()
+        if not tokens:
+            return 'ERR empty request'
+        if tokens[0].isdigit():
+            # A timestamp, as in an event file, which is ignored.
+            tokens = tokens[1:]
+        if tokens == ['Subscribe']:
+            if writer is not None:
+                self._subscribers.add(writer)
+            return 'OK Subscribe'
+        if len(tokens) == 2 and tokens[0] == 'Cancel':
+            return self._cancel(tokens[1])
+        try:
+            record = parse_record('{} {}'.format(self.now(), ' '.join(tokens)))
+        except ValueError as error:
+            return 'ERR {}'.format(error)
+        if record is None:
+            return 'ERR empty request'
+        identifier = record[2]
+        if record[1] == DRIVER_REQUEST:
+            driver = self.dispatcher.get_driver(identifier)
+            if driver is not None and not driver.is_idle:
+                return 'ERR driver {} is busy'.format(identifier)
+        elif identifier in self._riders and not (
+                self.admission is not None and self.admission.coalesce):
+            return 'ERR rider {} is already waiting'.format(identifier)
+        event = event_from_record(record)
+        if type(event) is RiderRequest:
+            if self.admission is not None:
+                reason = self.admission.admit(event.rider, self.dispatcher,
+                                              len(self._events))
+                if reason is not None:
+                    return 'SHED {} {}'.format(reason, identifier)
+            self._riders[identifier] = event.rider
+        if writer is not None:
+            self._own(identifier, writer)
+        self._do(event)
+        return 'OK {}'.format(identifier)
+
+    def _cancel(self, rider_id):
+        """Cancel the ride of the waiting rider with <rider_id> now, and
+        return the reply.
+
+        The rider's pending Cancellation is done at once instead of when
+        their patience runs out.
+
+        @type self: DispatchService
+        @type rider_id: str
+        @rtype: str
+        """
+        cancellation = self.dispatcher.pending_cancellation(rider_id)
+        if cancellation is None:
+            return 'ERR no waiting rider {}'.format(rider_id)
+        self._events.remove(cancellation)
+        cancellation.timestamp = self.now()
+        self._do(cancellation)
+        return 'OK {}'.format(rider_id)
+
+    async def handle_client(self, reader, writer):
+        """Serve the client connected by <reader> and <writer> until it
+        disconnects.
+
+        @type self: DispatchService
+        @type reader: asyncio.StreamReader
+        @type writer: asyncio.StreamWriter
+        @rtype: None
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = self.handle_line(line.decode(), writer)
+                except UnicodeDecodeError:
+                    reply = 'ERR request is not UTF-8'
+                writer.write((reply + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            for identifier in self._owned.pop(writer, ()):
+                del self._owners[identifier]
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=None, path=None):
+        """Start the service on the TCP <host> and <port>, or on the Unix
+        socket at <path>, and return the asyncio Server.
+
+        @type self: DispatchService
+        @type host: str
+        @type port: int | None
+        @type path: str | None
+        @rtype: asyncio.Server
+
+        >>> import os, tempfile
+        >>> async def demo(path):
+        ...     service = DispatchService(speed=100)
+        ...     server = await service.serve(path=path)
+        ...     reader, writer = await asyncio.open_unix_connection(path)
+        ...     for line in ['DriverRequest Jum 1,1 1',
+        ...                  'RiderRequest Ann 1,3 1,4 10', 'Cancel Bo']:
+        ...         writer.write((line + '\\n').encode())
+        ...     lines = [(await reader.readline()).decode().split()[:5]
+        ...              for _ in range(9)]
+        ...     owners = sorted(service._owners)
+        ...     writer.close()
+        ...     await writer.wait_closed()
+        ...     server.close()
+        ...     await asyncio.sleep(0.01)
+        ...     return lines, owners, service._owners
+        >>> with tempfile.TemporaryDirectory() as directory:
+        ...     lines, owners, left = asyncio.run(
+        ...         demo(os.path.join(directory, 'socket')))
+        >>> owners, left
+        (['Jum'], {})
+        >>> for line in lines:
+        ...     print(*line)
+        ACTIVITY 0 driver request Jum
+        OK Jum
+        ACTIVITY 0 rider request Ann
+        OK Ann
+        ERR no waiting rider Bo
+        ACTIVITY 2 driver pickup Jum
+        ACTIVITY 2 rider pickup Ann
+        ACTIVITY 3 driver dropoff Jum
+        ACTIVITY 3 driver request Jum
+        """
+        if self._loop is None:
+            self.start_clock()
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_client, path)
+        return await asyncio.start_server(self.handle_client, host, port)
+
+
+async def _main(args):
+    """Run the service described by the parsed command line <args> until
+    it is interrupted.
+
+    @type args: argparse.Namespace
+    @rtype: None
+    """
+    admission = None
+    if (args.max_waiting is not None or args.max_pending is not None or
+            args.shed_infeasible or args.coalesce):
+        admission = AdmissionController(args.max_waiting, args.max_pending,
+                                        args.shed_infeasible, args.coalesce)
+    service = DispatchService(args.speed, args.batch_window, admission,
+                              args.max_buffer)
+    server = await service.serve(args.host, args.port, args.unix)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    """Run the service with the command line arguments <argv>.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        description='Run the ride-sharing dispatcher as a live service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7000)
+    parser.add_argument('--unix', help='Unix socket path to listen on '
+                                       'instead of TCP')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='simulated time units per second')
+    parser.add_argument('--batch-window', type=int,
+                        help='match riders in batches over this many ticks')
+    parser.add_argument('--max-waiting', type=int,
+                        help='shed rider requests while this many riders wait')
+    parser.add_argument('--max-pending', type=int,
+                        help='shed rider requests while this many events are '
+                             'pending')
+    parser.add_argument('--shed-infeasible', action='store_true',
+                        help="shed riders whose patience can't be met")
+    parser.add_argument('--coalesce', action='store_true',
+                        help='shed duplicate requests from a waiting rider')
+    parser.add_argument('--max-buffer', type=int, default=MAX_BUFFER,
+                        help='disconnect clients this many bytes behind')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,548 @@
+"""
+The sharding module runs a simulation split geographically across several
+processes.
+
+The grid is cut into vertical strips (regions) at values of m chosen so that
+each region starts with about the same number of events. Each region is
+simulated by a Shard, with its own Dispatcher, event queue and Monitor, in
+its own process. Riders are served by the shard of the region they request
+a ride in, and drivers by the shard of the region they are in.
+
+The shards are kept in step by conservative time windows: the coordinator
+lets every shard do its events up to the end of a window of <window> time
+units, then passes on the drivers that have left each region, and starts the
+next window. A driver whose ride ends in another region is handed off to
+that region's shard as a DriverRequest at the time of the dropoff, which is
+known from the moment of the pickup; this is the lookahead that lets the
+shards run a window at a time.
+
+At the end of each window the coordinator also rebalances the idle drivers.
+Each region needs an idle driver for each of its waiting riders and, out of
+the other idle drivers, as many as its recent demand or its share of them in
+proportion to that demand, whichever is fewer. A region short of that is
+sent idle drivers from the regions with drivers to spare, nearest regions
+first, and from those the drivers nearest to it. They are handed off as
+DriverRequests at the end of the window, where they are, so their riders
+are picked up from across the boundary.
+
+=== Tolerance ===
+With one shard the result is exactly that of a Simulation. With several, it
+differs in three ways:
+  - a rider is matched with a driver in their own region while it has an
+    idle one, although a nearer driver may be just across a boundary;
+  - a rider who finds no idle driver in their own region waits until the
+    end of the window for one to be sent from another region; and
+  - a ride that crosses a boundary and ends in the window it started in
+    hands the driver off at the end of that window instead, up to <window>
+    time units late.
+The first two effects grow as drivers become scarce and demand becomes
+clustered: a region with a hotspot runs out of idle drivers first, and a
+narrow region in the middle of one has many riders near a boundary. On a
+trace from generate_events.py of 20000 riders over 20000 time units on a
+100 x 100 grid, with two hotspots (20,30,5,2 and 80,60,10,1) and 200
+drivers, 4 shards without rebalancing made the average wait 64% longer and
+twelve times as many riders cancel. With rebalancing, 2 shards made it 5%
+longer and 4 shards 9% longer, with 1.4 times as many cancelling, for
+windows of 1 to 10; with a window of 50 it was 17%. With 400 drivers on the
+same hotspots, where no region runs short, 4 shards still made the wait
+about 19% longer, from riders near a boundary alone. On uniformly random
+traces the wait was 10% longer with 400 drivers and unchanged with 2000.
+The driving distances stayed within 2% throughout. Keep the window short
+and use fewer, larger regions when drivers are scarce or demand is
+clustered.
+"""
+import argparse
+import math
+import multiprocessing
+import sys
+import time
+from bisect import bisect_right
+from container import PriorityQueue
+from dispatcher import Dispatcher
+from event import (DriverRequest, Dropoff, RiderRequest, DRIVER_REQUEST,
+                   event_from_record)
+from ingest import parse_records
+from monitor import Monitor
+from simulation import Simulation, SimulationReport, event_time
+
+# The number of time units over which a region's RiderRequests count as its
+# recent demand, when sharing out the idle drivers. Older requests count for
+# exponentially less.
+DEMAND_HORIZON = 400
+
+
+def region_cuts(records, shards):
+    """Return the values of m at which to cut the grid into <shards> regions
+    with about as many of <records> in each.
+
+    A location is in region bisect_right(cuts, m).
+
+    @type records: list[tuple]
+    @type shards: int
+    @rtype: list[int]
+
+    >>> region_cuts([(0, 0, 'a', m, 0, 1, 0, 0) for m in range(8)], 4)
+    [2, 4, 6]
+    """
+    ms = sorted(record[3] for record in records)
+    if not ms:
+        return []
+    return [ms[len(ms) * i // shards] for i in range(1, shards)]
+
+
+def region_of(cuts, location):
+    """Return the region of <location> for the region <cuts>.
+
+    @type cuts: list[int]
+    @type location: Location
+    @rtype: int
+    """
+    return bisect_right(cuts, location.coordinate[0])
+
+
+class Shard:
+    """The simulation of one region of the grid.
+
+    === Attributes ===
+    @type index: int
+        The region this shard simulates.
+    @type processed: int
+        The number of events done so far.
+    @type requests: int
+        The number of RiderRequests done so far.
+    @type peak_queue_depth: int
+        The largest number of events waiting in the event queue at once.
+    """
+
+    # === Private Attributes ===
+    # @type _cuts: list[int]
+    #     The region cuts of the whole simulation.
+    # @type _events: PriorityQueue
+    #     The events of this region, in timestamp order.
+    # @type _dispatcher: Dispatcher
+    #     The dispatcher of this region.
+    # @type _monitor: Monitor
+    #     The monitor of this region.
+    # @type _leaving: set[str]
+    #     The identifiers of the drivers who have been handed off to another
+    #     region, and will leave this one when they drop off their rider.
+
+    def __init__(self, index, cuts, records, batch_window=None):
+        """Initialize the shard for region <index> with the events of
+        <records>.
+
+        @type self: Shard
+        @type index: int
+        @type cuts: list[int]
+        @type records: list[tuple]
+            The records of the region's initial events, sorted by timestamp.
+        @type batch_window: int | None
+        @rtype: None
+        """
+        self.index = index
+        self._cuts = cuts
+        self._events = PriorityQueue(key=event_time)
+        self._dispatcher = Dispatcher(batch_window)
+        self._dispatcher.scheduler = self._events
+        self._monitor = Monitor()
+        self._leaving = set()
+        self._events.add_many(event_from_record(record) for record in records)
+        self.processed = 0
+        self.requests = 0
+        self.peak_queue_depth = len(self._events)
+
+    def next_time(self):
+        """Return the time of the next event of this shard, or None if there
+        are none left.
+
+        @type self: Shard
+        @rtype: int | None
+        """
+        return None if self._events.is_empty() else \
+            self._events.peek().timestamp
+
+    def run_until(self, end, handoffs):
+        """Schedule the drivers handed off to this region in <handoffs>, and
+        do the events before time <end>.
+
+        Return the drivers handed off to other regions, as (region, record)
+        pairs where record is the record of a DriverRequest at a time no
+        earlier than <end>.
+
+        @type self: Shard
+        @type end: int
+        @type handoffs: list[tuple]
+        @rtype: list[(int, tuple)]
+        """
+        queue = self._events
+        dispatcher = self._dispatcher
+        monitor = self._monitor
+        cuts = self._cuts
+        leaving = self._leaving
+        outgoing = []
+        for record in handoffs:
+            queue.add(event_from_record(record))
+        while not queue.is_empty() and queue.peek().timestamp < end:
+            done = queue.remove()
+            if type(done) is RiderRequest:
+                self.requests += 1
+            spawned = done.do(dispatcher, monitor)
+            self.processed += 1
+            for event in spawned:
+                if type(event) is Dropoff:
+                    region = region_of(cuts, event.rider.destination)
+                    if region != self.index:
+                        driver = event.driver
+                        leaving.add(driver.identifier)
+                        m, n = event.rider.destination.coordinate
+                        outgoing.append((region, (
+                            max(event.timestamp, end), DRIVER_REQUEST,
+                            driver.identifier, m, n, driver.speed, 0, 0)))
+                elif type(event) is DriverRequest and \
+                        event.driver.identifier in leaving:
+                    leaving.discard(event.driver.identifier)
+                    dispatcher.unregister(event.driver)
+                    monitor.forget_driver(event.driver.identifier)
+                    continue
+                queue.add(event)
+            if spawned and len(queue) > self.peak_queue_depth:
+                self.peak_queue_depth = len(queue)
+        return outgoing
+
+    def balance(self):
+        """Return the number of riders waiting for a driver, the number of
+        idle drivers and the number of RiderRequests done so far in this
+        region.
+
+        @type self: Shard
+        @rtype: (int, int, int)
+        """
+        dispatcher = self._dispatcher
+        return (dispatcher.num_waiting_riders(),
+                dispatcher.num_idle_drivers(), self.requests)
+
+    def release(self, region, count, time):
+        """Hand off up to <count> of this region's idle drivers, those
+        nearest to <region>, to that region at <time>.
+
+        Return the records of their DriverRequests in <region>.
+
+        @type self: Shard
+        @type region: int
+        @type count: int
+        @type time: int
+            Precondition: no event of this shard before <time> is left.
+        @rtype: list[tuple]
+
+        >>> shard = Shard(0, [10], [(0, DRIVER_REQUEST, name, m, 5, 2, 0, 0)
+        ...                         for name, m in [('Al', 1), ('Bo', 8)]])
+        >>> _ = shard.run_until(1, [])
+        >>> shard.release(1, 1, 4)
+        [(4, 0, 'Bo', 8, 5, 2, 0, 0)]
+        >>> shard.balance()
+        (0, 1, 0)
+        """
+        dispatcher = self._dispatcher
+        idle = [driver for driver in dispatcher.drivers.values()
+                if driver.is_idle]
+        idle.sort(key=lambda driver: driver.location.coordinate[0],
+                  reverse=region > self.index)
+        records = []
+        for driver in idle[:count]:
+            dispatcher.unregister(driver)
+            self._monitor.forget_driver(driver.identifier)
+            m, n = driver.location.coordinate
+            records.append((time, DRIVER_REQUEST, driver.identifier, m, n,
+                            driver.speed, 0, 0))
+        return records
+
+    def results(self):
+        """Return the number of events done, the peak depth of the event
+        queue, the monitor and the counters of tombstoned events.
+
+        @type self: Shard
+        @rtype: (int, int, Monitor, dict[str, int])
+        """
+        return (self.processed, self.peak_queue_depth, self._monitor,
+                self._events.stats())
+
+
+def _serve(connection, index, cuts, records, batch_window):
+    """Run the Shard for region <index> in a worker process, taking orders
+    from the coordinator over <connection>.
+
+    The shard first sends the time of its next event. Then, for each
+    (end, handoffs) message, it runs until <end> and sends back its outgoing
+    handoffs, the time of its next event and its balance. For each
+    (region, count, time) message it sends back the records of the drivers
+    it releases. A None message makes it send its results and stop.
+
+    @type connection: multiprocessing.connection.Connection
+    @type index: int
+    @type cuts: list[int]
+    @type records: list[tuple]
+    @type batch_window: int | None
+    @rtype: None
+    """
+    shard = Shard(index, cuts, records, batch_window)
+    connection.send(shard.next_time())
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        if len(message) == 3:
+            connection.send(shard.release(*message))
+            continue
+        outgoing = shard.run_until(*message)
+        connection.send((outgoing, shard.next_time(), shard.balance()))
+    connection.send(shard.results())
+    connection.close()
+
+
+class ShardedSimulation:
+    """A simulation split across one process per region of the grid.
+
+    === Attributes ===
+    @type shards: int
+        The number of regions.
+    @type window: int
+        The number of time units the shards run for between handoffs.
+    @type batch_window: int | None
+        The batch window of each shard's Dispatcher.
+    """
+
+    def __init__(self, shards, window=10, batch_window=None):
+        """Initialize a ShardedSimulation.
+
+        @type self: ShardedSimulation
+        @type shards: int
+            Precondition: shards >= 1
+        @type window: int
+            Precondition: window >= 1
+        @type batch_window: int | None
+        @rtype: None
+        """
+        self.shards = shards
+        self.window = window
+        self.batch_window = batch_window
+
+    def run(self, filename):
+        """Run the simulation on the event file <filename> and return a
+        report on the run.
+
+        The peak queue depth in the report is the sum of the shards' peaks,
+        and the statistics are those of the shards' monitors merged.
+
+        @type self: ShardedSimulation
+        @type filename: str
+        @rtype: SimulationReport
+
+        >>> single = Simulation().run('eventsv2.txt')
+        >>> sharded = ShardedSimulation(1).run('eventsv2.txt')
+        >>> sharded.statistics == single.statistics
+        True
+        >>> sharded.events_processed == single.events_processed
+        True
+
+        On clustered demand, rebalancing keeps 4 shards close to one process;
+        without it the average wait here was 79% longer.
+
+        >>> import os, tempfile
+        >>> from generate_events import WorkloadGenerator
+        >>> generator = WorkloadGenerator(
+        ...     fleet=80, day=4000, hotspots=[(20, 30, 5, 2), (80, 60, 10, 1)],
+        ...     seed=7)
+        >>> with tempfile.TemporaryDirectory() as directory:
+        ...     path = os.path.join(directory, 'clustered.txt')
+        ...     with open(path, 'w') as file:
+        ...         _ = generator.write(file, riders=4000)
+        ...     single = Simulation().run(path).statistics
+        ...     sharded = ShardedSimulation(4).run(path).statistics
+        >>> sharded['rider_wait_time'] < 1.3 * single['rider_wait_time']
+        True
+        >>> sharded['cancellation_rate'] < single['cancellation_rate'] + 0.01
+        True
+        """
+        phase_times = {}
+        start = time.perf_counter()
+        records = parse_records(filename)
+        cuts = region_cuts(records, self.shards)
+        regions = [[] for _ in range(self.shards)]
+        for record in records:
+            regions[bisect_right(cuts, record[3])].append(record)
+        connections = []
+        workers = []
+        try:
+            for index, region in enumerate(regions):
+                connection, child = multiprocessing.Pipe()
+                worker = multiprocessing.Process(
+                    target=_serve,
+                    args=(child, index, cuts, region, self.batch_window))
+                worker.start()
+                child.close()
+                connections.append(connection)
+                workers.append(worker)
+            next_times = [connection.recv() for connection in connections]
+            phase_times['load'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            self._coordinate(connections, next_times)
+            phase_times['run'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            monitor = Monitor()
+            processed = peak = 0
+            tombstones = {}
+            for connection, worker in zip(connections, workers):
+                connection.send(None)
+                shard_processed, shard_peak, shard_monitor, stats = \
+                    connection.recv()
+                worker.join()
+                processed += shard_processed
+                peak += shard_peak
+                monitor.merge(shard_monitor)
+                for name, count in stats.items():
+                    tombstones[name] = tombstones.get(name, 0) + count
+        finally:
+            # A shard that failed leaves the others waiting for orders.
+            for connection in connections:
+                connection.close()
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+        statistics = monitor.report()
+        phase_times['report'] = time.perf_counter() - start
+        return SimulationReport(processed, peak, phase_times, statistics,
+                                tombstones)
+
+    def _coordinate(self, connections, next_times):
+        """Run the shards on <connections> window by window until none of
+        them has any events left.
+
+        @type self: ShardedSimulation
+        @type connections: list[multiprocessing.connection.Connection]
+        @type next_times: list[int | None]
+            The time of the next event of each shard.
+        @rtype: None
+        """
+        pending = [[] for _ in connections]
+        balances = [(0, 0, 0) for _ in connections]
+        demand = [0.0 for _ in connections]
+        decay = math.exp(-self.window / DEMAND_HORIZON)
+        end = None
+        while True:
+            if end is not None:
+                self._rebalance(connections, balances, demand, pending, end)
+            times = [t for t in next_times if t is not None]
+            times.extend(record[0] for handoffs in pending
+                         for record in handoffs)
+            if not times:
+                return
+            end = min(times) + self.window
+            # Only the shards with something to do in this window run.
+            running = [index for index, handoffs in enumerate(pending)
+                       if handoffs or (next_times[index] is not None and
+                                       next_times[index] < end)]
+            for index in running:
+                connections[index].send((end, pending[index]))
+                pending[index] = []
+            requested = [balance[2] for balance in balances]
+            for index in running:
+                outgoing, next_times[index], balances[index] = \
+                    connections[index].recv()
+                for region, record in outgoing:
+                    pending[region].append(record)
+            for index, balance in enumerate(balances):
+                demand[index] = (demand[index] * decay +
+                                 balance[2] - requested[index])
+
+    @staticmethod
+    def _rebalance(connections, balances, demand, pending, time):
+        """Send idle drivers at <time> from the regions with drivers to
+        spare to those short of them, nearest regions first.
+
+        A region needs an idle driver for each of its waiting riders and, of
+        the other idle drivers, its recent demand or its share in proportion
+        to that demand, whichever is fewer.
+
+        @type connections: list[multiprocessing.connection.Connection]
+        @type balances: list[(int, int, int)]
+            The balance of each shard, updated for the drivers sent.
+        @type demand: list[float]
+            The recent number of RiderRequests of each shard.
+        @type pending: list[list[tuple]]
+            The handoffs to each shard, to which the drivers sent are added.
+        @type time: int
+            The end of the window every shard has run to.
+        @rtype: None
+        """
+        free = sum(idle - waiting for waiting, idle, _ in balances)
+        total = sum(demand)
+        spare = []
+        for (waiting, idle, _), recent in zip(balances, demand):
+            share = free * recent / total if free > 0 and total else 0
+            spare.append(idle - waiting - min(recent, share))
+        for region in range(len(spare)):
+            donors = sorted(range(len(spare)),
+                            key=lambda index: abs(index - region))
+            for donor in donors:
+                short = math.ceil(-spare[region])
+                if short <= 0:
+                    break
+                count = min(short, math.floor(spare[donor]))
+                if count <= 0:
+                    continue
+                connections[donor].send((region, count, time))
+                records = connections[donor].recv()
+                pending[region].extend(records)
+                moved = len(records)
+                spare[donor] -= moved
+                spare[region] += moved
+                waiting, idle, requests = balances[donor]
+                balances[donor] = (waiting, idle - moved, requests)
+                waiting, idle, requests = balances[region]
+                balances[region] = (waiting, idle + moved, requests)
+
+
+def main(argv=None):
+    """Run a sharded simulation of the event file named in the command line
+    arguments <argv> and print the report.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        description='Run a ride-sharing simulation split across processes.')
+    parser.add_argument('events', nargs='?', default='events.txt')
+    parser.add_argument('--shards', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='regions to split the grid into')
+    parser.add_argument('--window', type=int, default=10,
+                        help='time units to run between handoffs')
+    parser.add_argument('--batch-window', type=int,
+                        help='match riders in batches over this many ticks')
+    parser.add_argument('--compare', action='store_true',
+                        help='also run in one process and compare')
+    args = parser.parse_args(argv)
+
+    report = ShardedSimulation(args.shards, args.window,
+                               args.batch_window).run(args.events)
+    print(report)
+    if args.shards > 1:
+        print('\nThe statistics of a run split across {} regions are '
+              'approximate: riders near a boundary, and riders in a region '
+              'short of drivers, wait longer than in one process, more so '
+              'when drivers are scarce or demand is clustered.'.format(
+                  args.shards), file=sys.stderr)
+    if args.compare:
+        single = Simulation(dispatcher=Dispatcher(args.batch_window)).run(
+            args.events)
+        print('\nSingle process:')
+        print(single)
+        print('\nSpeedup: {:.2f}x'.format(
+            single.phase_times['run'] / report.phase_times['run']))
+
+
+if __name__ == '__main__':
+    main()
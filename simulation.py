@@ -0,0 +1,585 @@
+"""
+The simulation module contains the Simulation class, which runs a ride-sharing
+simulation over a list or file of events, and the SimulationReport class that
+describes a finished run.
+
+Run it as a script to simulate an event file and print the report, e.g.
+
+    python simulation.py events.txt --scheduler calendar
+
+Add --profile PREFIX to also save where the time went (see Profile), and
+--checkpoint-dir DIR to save checkpoints of long runs; run the same command
+again with --resume to carry on from the latest one (see the checkpoint
+module).
+"""
+import argparse
+import itertools
+import os
+import time
+from operator import attrgetter
+from checkpoint import (Checkpointer, Counted, latest_checkpoint, load_state,
+                        trace_identity)
+from container import PriorityQueue, CalendarQueue
+from dispatcher import Dispatcher
+from event import create_event_list, iter_events, merge_events
+from instrumentation import Profile
+from monitor import Monitor
+
+# The priority of an event in the event queue.
+event_time = attrgetter('timestamp')
+
+
+class SimulationReport:
+    """A report on a finished simulation run.
+
+    === Attributes ===
+    @type events_processed: int
+        The number of events that were done.
+    @type peak_queue_depth: int
+        The largest number of events that were waiting in the event queue at
+        once.
+    @type phase_times: dict[str, float]
+        The wall time in seconds taken by each phase of the run: 'load' to
+        read and schedule the initial events, 'run' to do every event, and
+        'report' to compute the monitor's statistics.
+    @type statistics: dict[str, object]
+        The report of the monitor.
+    @type tombstones: dict[str, int]
+        The counters of the event queue's tombstoned events (see
+        PriorityQueue.stats), which were never done.
+    """
+
+    def __init__(self, events_processed, peak_queue_depth, phase_times,
+                 statistics, tombstones=None):
+        """Initialize a SimulationReport.
+
+        @type self: SimulationReport
+        @type events_processed: int
+        @type peak_queue_depth: int
+        @type phase_times: dict[str, float]
+        @type statistics: dict[str, object]
+        @type tombstones: dict[str, int] | None
+        @rtype: None
+        """
+        self.events_processed = events_processed
+        self.peak_queue_depth = peak_queue_depth
+        self.phase_times = phase_times
+        self.statistics = statistics
+        self.tombstones = tombstones if tombstones is not None else {}
+
+    @property
+    def dead_events_avoided(self):
+        """The number of tombstoned events that were dropped from the event
+        queue without being done.
+
+        @type self: SimulationReport
+        @rtype: int
+        """
+        return self.tombstones.get('skipped', 0) + \
+            self.tombstones.get('compacted', 0)
+
+    @property
+    def events_per_second(self):
+        """The number of events done per second of the 'run' phase.
+
+        @type self: SimulationReport
+        @rtype: float
+        """
+        run_time = self.phase_times['run']
+        return self.events_processed / run_time if run_time else 0.0
+
+    def as_dict(self):
+        """Return this report as a dictionary, e.g. to save it as JSON.
+
+        @type self: SimulationReport
+        @rtype: dict[str, object]
+        """
+        return {'events_processed': self.events_processed,
+                'events_per_second': self.events_per_second,
+                'peak_queue_depth': self.peak_queue_depth,
+                'phase_times': dict(self.phase_times),
+                'statistics': dict(self.statistics),
+                'tombstones': dict(self.tombstones)}
+
+    def __str__(self):
+        """Return a string representation of this report.
+
+        @type self: SimulationReport
+        @rtype: str
+
+        >>> print(SimulationReport(10, 4, {'load': 0.5, 'run': 2.0,
+        ...                                'report': 0.0}, {'x': 1},
+        ...                        {'skipped': 2, 'compacted': 1}))
+        Events processed: 10 (5 per second)
+        Peak queue depth: 4
+        Dead events avoided: 3
+        Wall time: load 0.500 s, run 2.000 s, report 0.000 s
+        x: 1
+        """
+        lines = ['Events processed: {} ({:.0f} per second)'.format(
+                     self.events_processed, self.events_per_second),
+                 'Peak queue depth: {}'.format(self.peak_queue_depth),
+                 'Dead events avoided: {}'.format(self.dead_events_avoided),
+                 'Wall time: ' + ', '.join(
+                     '{} {:.3f} s'.format(phase, seconds)
+                     for phase, seconds in self.phase_times.items())]
+        for name, value in self.statistics.items():
+            lines.append('{}: {}'.format(name, value))
+        return '\n'.join(lines)
+
+
+class Simulation:
+    """A simulation.
+
+    This is the class which is responsible for setting up and running a
+    simulation. The event queue, dispatcher and monitor can all be supplied,
+    so that different schedulers and dispatch policies can be compared on
+    the same events.
+
+    Given a Profile, the simulation records where the time of a run goes in
+    it (see the instrumentation module). Given a Checkpointer, it saves its
+    state every so many events, and Simulation.resume carries on from the
+    latest checkpoint.
+    """
+
+    # === Private Attributes ===
+    # @type _events: PriorityQueue | CalendarQueue
+    #     A sequence of events arranged in priority determined by the event
+    #     sorting order.
+    # @type _dispatcher: Dispatcher
+    #     The dispatcher associated with the simulation.
+    # @type _monitor: Monitor
+    #     The monitor associated with the simulation.
+    # @type _profile: Profile | None
+    #     The profile runs are recorded in, if any.
+    # @type _checkpointer: Checkpointer | None
+    #     The checkpointer that saves the state of runs, if any.
+    # @type _resumed: dict[str, int] | None
+    #     The 'processed' and 'peak' events and the 'position' in the event
+    #     stream of the checkpoint this simulation was resumed from, if any.
+    # @type _trace: (str, int, int) | None
+    #     The identity of the event file being run, if the events come from
+    #     one.
+
+    def __init__(self, scheduler=None, dispatcher=None, monitor=None,
+                 profile=None, checkpointer=None):
+        """Initialize a Simulation.
+
+        @type self: Simulation
+        @type scheduler: PriorityQueue | CalendarQueue | None
+            The empty event queue to use, or None for a PriorityQueue.
+        @type dispatcher: Dispatcher | None
+        @type monitor: Monitor | None
+        @type profile: Profile | None
+        @type checkpointer: Checkpointer | None
+        @rtype: None
+        """
+        if profile is not None and checkpointer is not None:
+            raise ValueError("a profiled simulation cannot be checkpointed")
+        self._events = scheduler if scheduler is not None else \
+            PriorityQueue(key=event_time)
+        self._dispatcher = dispatcher if dispatcher is not None else \
+            Dispatcher()
+        self._monitor = monitor if monitor is not None else Monitor()
+        self._profile = profile
+        self._checkpointer = checkpointer
+        self._resumed = None
+        self._trace = None
+        self._dispatcher.scheduler = self._events
+
+    @classmethod
+    def resume(cls, checkpoint, checkpointer=None, trace=None):
+        """Return the simulation saved in <checkpoint>, a checkpoint file or
+        a directory of them, of which the latest is used.
+
+        Running it on the same events as the run that was checkpointed
+        carries on from where the checkpoint was taken: the events that had
+        already been read are skipped, and the report covers the whole run.
+        Raise ValueError if <trace> is given, or the simulation is later run
+        on an event file, and it is not the event file the checkpoint was
+        taken of.
+
+        @type checkpoint: str
+        @type checkpointer: Checkpointer | None
+            The checkpointer of the rest of the run, if any.
+        @type trace: str | None
+            The name of the event file the run carries on with.
+        @rtype: Simulation
+
+        >>> import shutil, tempfile
+        >>> from checkpoint import Checkpointer
+        >>> with tempfile.TemporaryDirectory() as directory:
+        ...     checkpointer = Checkpointer(directory, every=20)
+        ...     full = Simulation(checkpointer=checkpointer).run('events.txt')
+        ...     report = Simulation.resume(directory).run('events.txt')
+        ...     copy = shutil.copy('events.txt', directory)
+        ...     Simulation.resume(directory, trace=copy)  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ValueError: the checkpoint was not taken of the event file ...
+        >>> report.events_processed
+        30
+        >>> report.statistics == full.statistics
+        True
+        """
+        if os.path.isdir(checkpoint):
+            directory = checkpoint
+            checkpoint = latest_checkpoint(directory)
+            if checkpoint is None:
+                raise FileNotFoundError(
+                    "no checkpoint in {}".format(directory))
+        state = load_state(checkpoint)
+        simulation = cls(state['events'], state['dispatcher'],
+                         state['monitor'], checkpointer=checkpointer)
+        simulation._resumed = {name: state[name] for name in
+                               ('processed', 'peak', 'position', 'trace')}
+        if trace is not None:
+            simulation._check_trace(trace)
+        return simulation
+
+    def _check_trace(self, filename):
+        """Record that the events come from the event file <filename>.
+
+        Raise ValueError if this simulation was resumed from a checkpoint of
+        another event file.
+
+        @type self: Simulation
+        @type filename: str
+        @rtype: None
+        """
+        self._trace = trace_identity(filename)
+        if self._resumed is not None and self._resumed['trace'] is not None \
+                and self._resumed['trace'] != self._trace:
+            raise ValueError(
+                "the checkpoint was not taken of the event file {}".format(
+                    filename))
+
+    def _checkpoint(self, processed, peak, stream=None):
+        """Save a checkpoint of the run after <processed> events, with a
+        peak queue depth of <peak>, having read the events of <stream> up to
+        the one that is waiting to be merged in.
+
+        @type self: Simulation
+        @type processed: int
+        @type peak: int
+        @type stream: Counted | None
+        @rtype: None
+        """
+        position = 0
+        if stream is not None:
+            position = stream.count if stream.exhausted else stream.count - 1
+        if self._resumed is not None:
+            position += self._resumed['position']
+        self._checkpointer.save({'events': self._events,
+                                 'dispatcher': self._dispatcher,
+                                 'monitor': self._monitor,
+                                 'processed': processed,
+                                 'peak': peak,
+                                 'position': position,
+                                 'trace': self._trace}, processed)
+
+    def run(self, initial_events, stream=False, time_limit=None,
+            until=None):
+        """Run the simulation on the list of events in <initial_events> and
+        return a report on the run.
+
+        <initial_events> is either a list of Events or the name of an event
+        file. With <stream>, the events are read lazily and merged with the
+        spawned events as they become due, instead of all being scheduled up
+        front; they must then be in timestamp order.
+
+        Raise TimeoutError if <time_limit> is given and doing the events
+        takes longer than that many seconds. The clock is only checked
+        between events, so one long event can overrun the limit.
+
+        With <until>, the run stops before the first event due at or after
+        that time, which is left in the event queue with the rest; running
+        the simulation again with no new events carries on from there. This
+        cannot be combined with <stream> or a profile.
+
+        @type self: Simulation
+        @type initial_events: list[Event] | iterator[Event] | str
+        @type stream: bool
+        @type time_limit: float | None
+        @type until: int | None
+        @rtype: SimulationReport
+
+        >>> report = Simulation().run('events.txt')
+        >>> report.events_processed, report.peak_queue_depth
+        (30, 12)
+        >>> report.dead_events_avoided
+        5
+        >>> report = Simulation(CalendarQueue(event_time)).run(
+        ...     'events.txt', stream=True)
+        >>> report.events_processed, report.peak_queue_depth
+        (30, 3)
+        >>> simulation = Simulation()
+        >>> simulation.run('events.txt', until=10).events_processed
+        14
+        >>> simulation.run([]).events_processed
+        16
+        """
+        if until is not None and (stream or self._profile is not None):
+            raise ValueError("a streamed or profiled run cannot stop early")
+        phase_times = {}
+        start = time.perf_counter()
+        if isinstance(initial_events, str):
+            self._check_trace(initial_events)
+            initial_events = iter_events(initial_events) if stream else \
+                create_event_list(initial_events)
+        if stream and self._resumed is not None:
+            initial_events = itertools.islice(
+                initial_events, self._resumed['position'], None)
+        if not stream and self._resumed is None:
+            self._events.add_many(initial_events)
+        phase_times['load'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        deadline = None if time_limit is None else start + time_limit
+        try:
+            if self._profile is not None:
+                processed, peak = self._run_profiled(
+                    initial_events if stream else None, deadline)
+            elif stream:
+                processed, peak = self._run_stream(initial_events, deadline)
+            else:
+                processed, peak = self._run_queue(deadline, until)
+        finally:
+            # A checkpoint being written is finished, counted and pruned
+            # even if the run fails.
+            if self._checkpointer is not None:
+                self._checkpointer.wait()
+        phase_times['run'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        statistics = self._monitor.report()
+        phase_times['report'] = time.perf_counter() - start
+        return SimulationReport(processed, peak, phase_times, statistics,
+                                self._events.stats())
+
+    def _run_queue(self, deadline=None, until=None):
+        """Do the events in the event queue until it is empty, or until the
+        next one is due at or after <until>, and return the number of events
+        done and the peak depth of the queue.
+
+        @type self: Simulation
+        @type deadline: float | None
+            The time.perf_counter() value to stop at with TimeoutError.
+        @type until: int | None
+        @rtype: (int, int)
+        """
+        queue = self._events
+        dispatcher = self._dispatcher
+        monitor = self._monitor
+        add = queue.add
+        remove = queue.remove
+        is_empty = queue.is_empty
+        if until is not None:
+            def is_empty():
+                return queue.is_empty() or queue.peek().timestamp >= until
+        processed, peak, next_checkpoint = self._start_counts()
+        while not is_empty():
+            spawned = remove().do(dispatcher, monitor)
+            processed += 1
+            if deadline is not None:
+                _check_deadline(deadline, processed)
+            for event in spawned:
+                add(event)
+            if spawned:
+                depth = len(queue)
+                if depth > peak:
+                    peak = depth
+            if processed == next_checkpoint:
+                self._checkpoint(processed, peak)
+                next_checkpoint += self._checkpointer.every
+        return processed, peak
+
+    def _run_stream(self, events, deadline=None):
+        """Do the events of <events> and the events they spawn in timestamp
+        order, and return the number of events done and the peak depth of the
+        event queue.
+
+        @type self: Simulation
+        @type events: iterator[Event]
+        @type deadline: float | None
+            The time.perf_counter() value to stop at with TimeoutError.
+        @rtype: (int, int)
+        """
+        queue = self._events
+        dispatcher = self._dispatcher
+        monitor = self._monitor
+        add = queue.add
+        processed, peak, next_checkpoint = self._start_counts()
+        if next_checkpoint is not None:
+            events = Counted(events)
+        for event in merge_events(events, queue):
+            spawned = event.do(dispatcher, monitor)
+            processed += 1
+            if deadline is not None:
+                _check_deadline(deadline, processed)
+            for new_event in spawned:
+                add(new_event)
+            if spawned:
+                depth = len(queue)
+                if depth > peak:
+                    peak = depth
+            if processed == next_checkpoint:
+                self._checkpoint(processed, peak, events)
+                next_checkpoint += self._checkpointer.every
+        return processed, peak
+
+    def _start_counts(self):
+        """Return the number of events done and the peak depth of the event
+        queue at the start of a run, counting those of the checkpoint it
+        resumes from, and the number of events done at which the first
+        checkpoint is due, or None if there are no checkpoints.
+
+        @type self: Simulation
+        @rtype: (int, int, int | None)
+        """
+        processed, peak = 0, len(self._events)
+        if self._resumed is not None:
+            processed = self._resumed['processed']
+            peak = max(peak, self._resumed['peak'])
+        if self._checkpointer is None:
+            return processed, peak, None
+        return processed, peak, processed + self._checkpointer.every
+
+    def _run_profiled(self, events=None, deadline=None):
+        """Do the events like _run_stream if <events> is given, and like
+        _run_queue otherwise, recording each step in the profile. Return
+        the number of events done and the peak depth of the event queue.
+
+        @type self: Simulation
+        @type events: iterator[Event] | None
+        @type deadline: float | None
+            The time.perf_counter() value to stop at with TimeoutError.
+        @rtype: (int, int)
+
+        >>> from instrumentation import Profile
+        >>> profile = Profile()
+        >>> report = Simulation(profile=profile).run('events.txt')
+        >>> report.events_processed, report.peak_queue_depth
+        (30, 12)
+        >>> profile.as_dict()['events']['RiderRequest']['count']
+        6
+        """
+        queue = self._events
+        dispatcher = self._dispatcher
+        monitor = self._monitor
+        profile = self._profile
+        perf_counter = time.perf_counter
+        source = None if events is None else merge_events(events, queue)
+        processed = 0
+        peak = len(queue)
+        # The profile label of each type of event, made once per type.
+        labels = {}
+        with profile.attached(dispatcher):
+            while True:
+                start = perf_counter()
+                if source is not None:
+                    event = next(source, None)
+                elif not queue.is_empty():
+                    event = queue.remove()
+                else:
+                    event = None
+                profile.record('queue.remove', perf_counter() - start)
+                if event is None:
+                    break
+                kind = type(event)
+                label = labels.get(kind)
+                if label is None:
+                    label = labels[kind] = kind.__name__ + '.do'
+                spawned = profile.call(label, event.do, dispatcher, monitor)
+                processed += 1
+                if deadline is not None:
+                    _check_deadline(deadline, processed)
+                start = perf_counter()
+                for new_event in spawned:
+                    queue.add(new_event)
+                profile.record('queue.add', perf_counter() - start)
+                depth = len(queue)
+                if depth > peak:
+                    peak = depth
+                profile.sample_depth(event.timestamp, depth)
+        return processed, peak
+
+
+def _check_deadline(deadline, processed):
+    """Raise TimeoutError if <deadline> has passed, checking the clock only
+    once every 1024 events.
+
+    @type deadline: float
+    @type processed: int
+        The number of events done so far.
+    @rtype: None
+
+    >>> _check_deadline(0.0, 1)
+    >>> _check_deadline(0.0, 1024)
+    Traceback (most recent call last):
+    TimeoutError: simulation ran out of time after 1024 events
+    """
+    if not processed & 1023 and time.perf_counter() > deadline:
+        raise TimeoutError(
+            "simulation ran out of time after {} events".format(processed))
+
+
+def main(argv=None):
+    """Simulate the event file named in the command line arguments <argv>
+    and print the report.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        description='Run a ride-sharing simulation on an event file.')
+    parser.add_argument('events', nargs='?', default='events.txt')
+    parser.add_argument('--scheduler', choices=['heap', 'calendar'],
+                        help='event queue to use (default: heap)')
+    parser.add_argument('--stream', action='store_true',
+                        help='read the (sorted) event file lazily')
+    parser.add_argument('--profile', metavar='PREFIX',
+                        help='save a profile of the run to PREFIX.json and '
+                             'PREFIX.collapsed')
+    parser.add_argument('--batch-window', type=int,
+                        help='match riders in batches over this many ticks')
+    parser.add_argument('--checkpoint-dir',
+                        help='save checkpoints of the run in this directory')
+    parser.add_argument('--checkpoint-every', type=int, default=100000,
+                        help='events done between checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help='carry on from the latest checkpoint')
+    args = parser.parse_args(argv)
+    if args.resume and not args.checkpoint_dir:
+        parser.error('--resume needs --checkpoint-dir')
+    if args.profile and args.checkpoint_dir:
+        parser.error('--profile cannot be combined with --checkpoint-dir')
+    if args.resume and (args.scheduler or args.batch_window is not None):
+        parser.error('--scheduler and --batch-window cannot be changed '
+                     'on --resume')
+
+    checkpointer = None
+    if args.checkpoint_dir:
+        checkpointer = Checkpointer(args.checkpoint_dir, args.checkpoint_every,
+                                    fresh=not args.resume)
+    profile = Profile() if args.profile else None
+    if args.resume and latest_checkpoint(args.checkpoint_dir) is not None:
+        try:
+            simulation = Simulation.resume(args.checkpoint_dir, checkpointer,
+                                           args.events)
+        except ValueError as error:
+            parser.error(str(error))
+    else:
+        scheduler = CalendarQueue(event_time) \
+            if args.scheduler == 'calendar' else PriorityQueue(key=event_time)
+        simulation = Simulation(scheduler, Dispatcher(args.batch_window),
+                                profile=profile, checkpointer=checkpointer)
+    print(simulation.run(args.events, stream=args.stream))
+    if profile is not None:
+        with open(args.profile + '.json', 'w') as file:
+            profile.write_json(file)
+        with open(args.profile + '.collapsed', 'w') as file:
+            profile.write_collapsed(file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""
+The sweep module runs one event trace many times over a grid of parameters,
+on a pool of processes, and collects the monitor reports into one table.
+
+The parameters of a run are:
+    fleet: the number of drivers, a random sample of the trace's drivers.
+    speed: the speed of every driver.
+    patience: the patience of every rider.
+    batch_window: the Dispatcher's batch window.
+A parameter that is left out, or None, is as in the trace.
+
+The trace is converted to a binary trace (see the tracefile module) once,
+and each worker memory maps it, so the text is never parsed again and every
+worker shares the same pages of the file. The random choices of run i of a
+sweep with seed s are made with seed s + i, so a sweep gives the same results
+however many workers it runs on.
+
+A run's timeout is checked by the run itself between events, and also by
+the sweep, which cannot interrupt one event: a run still going TIMEOUT_GRACE
+seconds after its timeout, as in one very long event, has its worker killed.
+The pool is then started again for the runs that had not finished, which
+start over.
+
+Run it as a script, e.g.
+
+    python sweep.py events.txt --fleet 50 100 --patience 5 10 --csv out.csv
+"""
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dispatcher import Dispatcher
+from event import DRIVER_REQUEST, RIDER_REQUEST, event_from_record
+from simulation import Simulation
+from tracefile import MAGIC, TraceFile, convert
+
+PARAMETERS = ('fleet', 'speed', 'patience', 'batch_window')
+
+# The seconds past its timeout that a run may take to stop on its own before
+# its worker is killed.
+TIMEOUT_GRACE = 1.0
+
+# The trace opened by each worker process.
+_trace = None
+
+# The queue on which each worker process says which run it has started.
+_started = None
+
+
+def parameter_grid(grid):
+    """Return every combination of the values in <grid>, a dictionary from
+    parameter name to a list of values, as a list of dictionaries.
+
+    @type grid: dict[str, list]
+    @rtype: list[dict[str, object]]
+
+    >>> parameter_grid({'fleet': [1, 2], 'speed': [3]})
+    [{'fleet': 1, 'speed': 3}, {'fleet': 2, 'speed': 3}]
+    """
+    for name in grid:
+        if name not in PARAMETERS:
+            raise ValueError("unknown parameter: {}".format(name))
+    names = list(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*grid.values())]
+
+
+def _open_trace(filename, started):
+    """Open the binary trace <filename> for the runs of this worker, which
+    says on <started> which run it starts.
+
+    @type filename: str
+    @type started: multiprocessing.Queue
+    @rtype: None
+    """
+    global _trace, _started
+    _trace = TraceFile(filename)
+    _started = started
+
+
+def scenario(trace, parameters, seed):
+    """Return the Events of <trace> changed as described by <parameters>,
+    making any random choices with <seed>.
+
+    @type trace: TraceFile
+    @type parameters: dict[str, object]
+    @type seed: int
+    @rtype: list[Event]
+    """
+    records = [trace.record(index) for index in range(len(trace))]
+    fleet = parameters.get('fleet')
+    if fleet is not None:
+        drivers = sorted({record[2] for record in records
+                          if record[1] == DRIVER_REQUEST})
+        if fleet < len(drivers):
+            kept = set(random.Random(seed).sample(drivers, fleet))
+            records = [record for record in records
+                       if record[1] != DRIVER_REQUEST or record[2] in kept]
+    overrides = {DRIVER_REQUEST: parameters.get('speed'),
+                 RIDER_REQUEST: parameters.get('patience')}
+    events = []
+    for record in records:
+        value = overrides[record[1]]
+        if value is not None:
+            record = record[:5] + (value,) + record[6:]
+        events.append(event_from_record(record))
+    return events
+
+
+def _run(index, parameters, seed, timeout):
+    """Simulate the trace of this worker with <parameters> as run <index>
+    of the sweep and return the row of the sweep's table for the run.
+
+    The <timeout> covers making the run's scenario as well as simulating it.
+
+    @type index: int
+    @type parameters: dict[str, object]
+    @type seed: int
+    @type timeout: float | None
+    @rtype: dict[str, object]
+    """
+    _started.put((index, os.getpid()))
+    row = dict(parameters, seed=seed)
+    start = time.perf_counter()
+    simulation = Simulation(
+        dispatcher=Dispatcher(parameters.get('batch_window')))
+    try:
+        events = scenario(_trace, parameters, seed)
+        time_limit = None
+        if timeout is not None:
+            time_limit = timeout - (time.perf_counter() - start)
+            if time_limit <= 0:
+                raise TimeoutError("ran out of time making the scenario")
+        report = simulation.run(events, time_limit=time_limit)
+    except TimeoutError:
+        row['status'] = 'timeout'
+    else:
+        row['status'] = 'ok'
+        row['events'] = report.events_processed
+        row.update(report.statistics)
+    row['seconds'] = round(time.perf_counter() - start, 3)
+    return row
+
+
+def sweep(trace, grid, workers=None, timeout=None, seed=0, progress=None):
+    """Simulate the event file <trace> once for every combination of the
+    parameters in <grid>, and return one row per run, in the order of
+    parameter_grid.
+
+    Each row has the run's parameters, its 'seed', its 'status' ('ok', or
+    'timeout' if it took longer than <timeout> seconds), the number of
+    'events' done, the statistics of the monitor's report and the
+    'seconds' it took.
+
+    @type trace: str
+        An event file, or a binary trace made by tracefile.convert.
+    @type grid: dict[str, list]
+    @type workers: int | None
+        The number of processes, or None for one per CPU.
+    @type timeout: float | None
+        The most seconds each run may take, or None for no limit. A run
+        that is still going TIMEOUT_GRACE seconds later is killed.
+    @type seed: int
+    @type progress: callable | None
+        Called as progress(done, total, row) as each run finishes.
+    @rtype: list[dict[str, object]]
+
+    >>> rows = sweep('events.txt', {'fleet': [1, 4], 'patience': [2]},
+    ...              workers=2)
+    >>> [(row['fleet'], row['status'], round(row['cancellation_rate'], 2))
+    ...  for row in rows]
+    [(1, 'ok', 0.83), (4, 'ok', 0.17)]
+    >>> sweep('events.txt', {'fleet': [1]}, workers=1,
+    ...       timeout=0.0)[0]['status']
+    'timeout'
+    """
+    combinations = parameter_grid(grid)
+    with tempfile.TemporaryDirectory() as directory:
+        with open(trace, 'rb') as file:
+            binary = file.read(len(MAGIC)) == MAGIC
+        if not binary:
+            path = os.path.join(directory, 'trace.bin')
+            convert(trace, path)
+            trace = path
+        rows = [None] * len(combinations)
+        runs = [(index, parameters, seed + index)
+                for index, parameters in enumerate(combinations)]
+        while runs:
+            runs = _run_pool(trace, runs, rows, workers, timeout, progress)
+    return rows
+
+
+def _run_pool(trace, runs, rows, workers, timeout, progress):
+    """Do the <runs> on a new pool of <workers> processes, putting the row
+    of each into <rows>, until they are all done or one of them overruns
+    its <timeout> by TIMEOUT_GRACE.
+
+    An overrunning run is given a 'timeout' row and the pool is shut down.
+    Return the runs that were not done.
+
+    @type trace: str
+        A binary trace.
+    @type runs: list[(int, dict[str, object], int)]
+        The index in <rows>, parameters and seed of each run.
+    @type rows: list[dict[str, object] | None]
+    @type workers: int | None
+    @type timeout: float | None
+    @type progress: callable | None
+    @rtype: list[(int, dict[str, object], int)]
+    """
+    details = {index: (parameters, seed) for index, parameters, seed in runs}
+    started = multiprocessing.Queue()
+    pool = ProcessPoolExecutor(workers, initializer=_open_trace,
+                               initargs=(trace, started))
+    running = {}
+    overrun = False
+    try:
+        futures = {pool.submit(_run, index, parameters, seed, timeout):
+                   index for index, parameters, seed in runs}
+        pending = set(futures)
+        while pending and not overrun:
+            done, pending = wait(
+                pending, None if timeout is None else TIMEOUT_GRACE / 4,
+                FIRST_COMPLETED)
+            for future in done:
+                _finish(rows, futures[future], future.result(), progress)
+            now = time.perf_counter()
+            while True:
+                try:
+                    index, pid = started.get_nowait()
+                except queue.Empty:
+                    break
+                running[index] = (now, pid)
+            if timeout is None:
+                continue
+            for index, (start, pid) in running.items():
+                if rows[index] is None and \
+                        now - start > timeout + TIMEOUT_GRACE:
+                    overrun = True
+                    _kill(pid)
+                    parameters, seed = details[index]
+                    _finish(rows, index, dict(
+                        parameters, seed=seed, status='timeout',
+                        seconds=round(now - start, 3)), progress)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        started.close()
+        started.join_thread()
+    return [run for run in runs if rows[run[0]] is None]
+
+
+def _finish(rows, index, row, progress):
+    """Put <row> into <rows> as the row of run <index>, and report it to
+    <progress>.
+
+    @type rows: list[dict[str, object] | None]
+    @type index: int
+    @type row: dict[str, object]
+    @type progress: callable | None
+    @rtype: None
+    """
+    rows[index] = row
+    if progress is not None:
+        progress(len(rows) - rows.count(None), len(rows), row)
+
+
+def _kill(pid):
+    """Kill the worker process <pid>, if it is still alive.
+
+    @type pid: int
+    @rtype: None
+    """
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+
+def _columns(rows):
+    """Return the names of the columns of <rows>, in order of first
+    appearance.
+
+    @type rows: list[dict[str, object]]
+    @rtype: list[str]
+    """
+    columns = {}
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+    return list(columns)
+
+
+def format_table(rows):
+    """Return <rows> as a text table with a header line.
+
+    @type rows: list[dict[str, object]]
+    @rtype: str
+
+    >>> print(format_table([{'fleet': 1, 'status': 'ok'},
+    ...                     {'fleet': 20, 'status': 'timeout'}]))
+    fleet  status
+        1  ok
+       20  timeout
+    """
+    columns = _columns(rows)
+    cells = [columns] + [[_format(row.get(column)) for column in columns]
+                         for row in rows]
+    widths = [max(len(line[i]) for line in cells)
+              for i in range(len(columns))]
+    lines = []
+    for line in cells:
+        lines.append('  '.join(
+            cell.ljust(width) if line is cells[0] or not _numeric(cell)
+            else cell.rjust(width)
+            for cell, width in zip(line, widths)).rstrip())
+    return '\n'.join(lines)
+
+
+def _format(value):
+    """Return the text of a cell holding <value>.
+
+    @type value: object
+    @rtype: str
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '{:.6g}'.format(value)
+    return str(value)
+
+
+def _numeric(cell):
+    """Return True iff <cell> is the text of a number.
+
+    @type cell: str
+    @rtype: bool
+    """
+    try:
+        float(cell)
+    except ValueError:
+        return False
+    return True
+
+
+def write_csv(rows, file):
+    """Write <rows> to the open text file <file> as CSV with a header line.
+
+    @type rows: list[dict[str, object]]
+    @type file: file
+    @rtype: None
+    """
+    writer = csv.DictWriter(file, _columns(rows))
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def main(argv=None):
+    """Run the sweep described by the command line arguments <argv> and
+    print its table.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        description='Run a trace over a grid of simulation parameters.')
+    parser.add_argument('trace', help='event file or binary trace')
+    parser.add_argument('--fleet', type=int, nargs='+',
+                        help='numbers of drivers to keep')
+    parser.add_argument('--speed', type=int, nargs='+',
+                        help='driver speeds')
+    parser.add_argument('--patience', type=int, nargs='+',
+                        help='rider patience values')
+    parser.add_argument('--batch-window', type=int, nargs='+',
+                        help='dispatcher batch windows')
+    parser.add_argument('--workers', type=int,
+                        help='processes to run on (default: one per CPU)')
+    parser.add_argument('--timeout', type=float,
+                        help='most seconds each run may take')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', help='file to save the table to as CSV')
+    args = parser.parse_args(argv)
+
+    grid = {name: getattr(args, name) for name in PARAMETERS
+            if getattr(args, name) is not None}
+
+    def progress(done, total, row):
+        print('[{}/{}] {} {} in {} s'.format(
+            done, total, {name: row[name] for name in grid}, row['status'],
+            row['seconds']), file=sys.stderr)
+
+    rows = sweep(args.trace, grid, args.workers, args.timeout, args.seed,
+                 progress)
+    print(format_table(rows))
+    if args.csv:
+        with open(args.csv, 'w', newline='') as file:
+            write_csv(rows, file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+The tracefile module converts event files into a compact binary trace
+format, and loads binary traces back by memory mapping them.
+
+A binary trace stores the records of an event file (see event.parse_record)
+column by column, so loading one does not tokenize any text: the columns are
+read straight out of the mapped file, and Events are only built as they are
+iterated over.
+
+=== File format ===
+All numbers are little-endian. The file starts with a header of the 8 bytes
+of MAGIC followed by three unsigned 64-bit integers: the number of events,
+the number of distinct identifiers, and the size of the identifier blob in
+bytes. Then come the columns of COLUMNS in order, one value per event, then
+the (identifier count + 1) unsigned 64-bit offsets of each identifier in the
+blob, then the blob of UTF-8 identifiers. Every column and the offsets start
+on an 8-byte boundary.
+
+=== Constants ===
+@type MAGIC: bytes
+    The first bytes of every binary trace.
+@type COLUMNS: tuple[(str, str)]
+    The name and array typecode of each column, in the order of the fields
+    of a record.
+"""
+import mmap
+import struct
+import sys
+from array import array
+from event import parse_record, event_from_record
+
+MAGIC = b'RIDETRC1'
+COLUMNS = (('timestamp', 'q'), ('kind', 'B'), ('identifier', 'I'),
+           ('m', 'i'), ('n', 'i'), ('value', 'i'), ('dest_m', 'i'),
+           ('dest_n', 'i'))
+
+_HEADER = struct.Struct('<8sQQQ')
+_ALIGNMENT = 8
+
+
+def _padding(size):
+    """Return the number of bytes needed after <size> bytes to reach the next
+    8-byte boundary.
+
+    @type size: int
+    @rtype: int
+
+    >>> _padding(13), _padding(16)
+    (3, 0)
+    """
+    return -size % _ALIGNMENT
+
+
+def convert(source, target):
+    """Convert the event file <source> into a binary trace at <target>, and
+    return the number of events written.
+
+    Raise ValueError naming the line of <source> that is not in the expected
+    format, if there is one.
+
+    @type source: str
+    @type target: str
+    @rtype: int
+    """
+    columns = [array(typecode) for _, typecode in COLUMNS]
+    identifiers = {}
+    with open(source, "r") as file:
+        for line_number, line in enumerate(file, 1):
+            try:
+                record = parse_record(line)
+            except ValueError as error:
+                raise ValueError("{}:{}: {}".format(
+                    source, line_number, error)) from None
+            if record is None:
+                continue
+            record = list(record)
+            record[2] = identifiers.setdefault(record[2], len(identifiers))
+            for column, value in zip(columns, record):
+                column.append(value)
+
+    blob = bytearray()
+    offsets = array('Q', [0])
+    for identifier in identifiers:
+        blob += identifier.encode('utf-8')
+        offsets.append(len(blob))
+
+    with open(target, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, len(columns[0]), len(identifiers),
+                                len(blob)))
+        for column in columns + [offsets]:
+            if sys.byteorder == 'big':
+                column.byteswap()
+            data = column.tobytes()
+            file.write(data)
+            file.write(bytes(_padding(len(data))))
+        file.write(blob)
+    return len(columns[0])
+
+
+class TraceFile:
+    """A binary trace opened for reading.
+
+    The file is memory mapped, and each column is a memoryview of the mapped
+    file, so opening a trace takes the same time however large it is.
+
+    === Attributes ===
+    @type columns: dict[str, memoryview]
+        The values of each column of COLUMNS, one per event. Identifiers are
+        stored as indexes; see identifier.
+    """
+
+    # === Private Attributes ===
+    # @type _file: file
+    #     The open trace file.
+    # @type _map: mmap.mmap
+    #     The memory map of the file.
+    # @type _views: list[memoryview]
+    #     Every view of _map, so that they can be released before closing it.
+    # @type _offsets: memoryview
+    #     The offsets of each identifier in _blob.
+    # @type _blob: memoryview
+    #     The UTF-8 identifiers.
+    # @type _identifiers: list[str | None]
+    #     The identifiers decoded so far, by index.
+
+    def __init__(self, filename):
+        """Open the binary trace at <filename>.
+
+        Raise ValueError if the file is not a binary trace.
+
+        @type self: TraceFile
+        @type filename: str
+        @rtype: None
+
+        >>> import os, tempfile
+        >>> with tempfile.TemporaryDirectory() as directory:
+        ...     path = os.path.join(directory, 'empty.bin')
+        ...     open(path, 'wb').close()
+        ...     try:
+        ...         TraceFile(path)
+        ...     except ValueError as error:
+        ...         print(str(error).endswith('is not a binary event trace'))
+        True
+        """
+        self._file = open(filename, "rb")
+        try:
+            # An empty file cannot be mapped.
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("{} is not a binary event trace".format(filename))
+        self._views = []
+        if len(self._map) < _HEADER.size or \
+                self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("{} is not a binary event trace".format(filename))
+        magic, count, identifiers, blob_size = _HEADER.unpack_from(self._map)
+        position = _HEADER.size
+        self.columns = {}
+        for name, typecode in COLUMNS:
+            self.columns[name], position = self._column(
+                position, typecode, count)
+        self._offsets, position = self._column(position, 'Q', identifiers + 1)
+        self._blob = self._view(position, blob_size)
+        self._identifiers = [None] * identifiers
+
+    def _view(self, position, size):
+        """Return a view of <size> bytes of the file from <position>.
+
+        @type self: TraceFile
+        @type position: int
+        @type size: int
+        @rtype: memoryview
+        """
+        view = memoryview(self._map)[position:position + size]
+        self._views.append(view)
+        return view
+
+    def _column(self, position, typecode, count):
+        """Return a view of the <count> values of type <typecode> at
+        <position>, and the position of the next column.
+
+        @type self: TraceFile
+        @type position: int
+        @type typecode: str
+        @type count: int
+        @rtype: (memoryview | array, int)
+        """
+        size = array(typecode).itemsize * count
+        view = self._view(position, size)
+        if sys.byteorder == 'big':
+            column = array(typecode, view.tobytes())
+            column.byteswap()
+        else:
+            column = view.cast(typecode)
+            self._views.append(column)
+        return column, position + size + _padding(size)
+
+    def __len__(self):
+        """Return the number of events in this trace.
+
+        @type self: TraceFile
+        @rtype: int
+        """
+        return len(self.columns['timestamp'])
+
+    def identifier(self, index):
+        """Return the identifier with <index>.
+
+        Each identifier is decoded once and then shared by every event that
+        uses it.
+
+        @type self: TraceFile
+        @type index: int
+        @rtype: str
+        """
+        identifier = self._identifiers[index]
+        if identifier is None:
+            identifier = str(self._blob[self._offsets[index]:
+                                        self._offsets[index + 1]], 'utf-8')
+            self._identifiers[index] = identifier
+        return identifier
+
+    def record(self, index):
+        """Return the record of the event at <index>, in the form returned by
+        event.parse_record.
+
+        @type self: TraceFile
+        @type index: int
+        @rtype: tuple
+        """
+        record = [self.columns[name][index] for name, _ in COLUMNS]
+        record[2] = self.identifier(record[2])
+        return tuple(record)
+
+    def __iter__(self):
+        """Yield the events of this trace in order, building each one only
+        when it is reached.
+
+        @type self: TraceFile
+        @rtype: iterator[Event]
+        """
+        for index in range(len(self)):
+            yield event_from_record(self.record(index))
+
+    def close(self):
+        """Close this trace. Events already built remain valid.
+
+        @type self: TraceFile
+        @rtype: None
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        """Return this trace, to be closed at the end of a with statement.
+
+        @type self: TraceFile
+        @rtype: TraceFile
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close this trace at the end of a with statement.
+
+        @type self: TraceFile
+        @rtype: None
+        """
+        self.close()
+
+
+def load_events(filename):
+    """Return the list of Events in the binary trace at <filename>.
+
+    @type filename: str
+    @rtype: list[Event]
+
+    >>> import os, tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = os.path.join(directory, 'events.bin')
+    ...     convert('events.txt', path)
+    ...     events = load_events(path)
+    12
+    >>> [str(event) for event in events[5:7]]
+    ['0 -- Foxglove: Request a rider', '0 -- Almond: Request a driver']
+    >>> from event import create_event_list
+    >>> [str(event) for event in events] == [
+    ...     str(event) for event in create_event_list('events.txt')]
+    True
+    """
+    with TraceFile(filename) as trace:
+        return list(trace)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        print("Wrote {} events to {}".format(
+            convert(sys.argv[1], sys.argv[2]), sys.argv[2]))
+    else:
+        import doctest
+        doctest.testmod()
@@ -0,0 +1,280 @@
+"""
+The whatif module compares dispatch policies from the same point of a run.
+
+The event trace is simulated once up to time T. The simulation is then
+forked once per scenario, and each copy carries on from T with its own
+policy, such as a batch window or a driver speed. N policies cost one shared
+prefix and N suffixes, instead of N full runs.
+
+Where os.fork is available, each scenario runs in a forked child process.
+The child shares the memory of the prefix copy-on-write, so forking costs
+almost nothing however large the state is, and the scenarios run in
+parallel. Each child sends its SimulationReport back through a pipe.
+Elsewhere, each scenario runs in turn on a copy.deepcopy of the state.
+
+Run it as a script, e.g.
+
+    python whatif.py events.txt --at 500 --batch-window 0 5 10 --speed 2
+"""
+import argparse
+import copy
+import os
+import pickle
+import signal
+import sys
+import traceback
+from collections import deque
+from container import CalendarQueue, PriorityQueue
+from dispatcher import Dispatcher
+from event import DriverRequest
+from simulation import Simulation, event_time
+from sweep import format_table
+
+# The name of the scenario that carries on without changing anything.
+AS_IS = 'as is'
+
+
+def batch_window(window):
+    """Return a policy that sets the dispatcher's batch window to
+    <window>.
+
+    @type window: int | None
+    @rtype: callable
+    """
+    def policy(dispatcher):
+        dispatcher.batch_window = window
+    return policy
+
+
+def driver_speed(speed):
+    """Return a policy that sets the speed of every driver to <speed>,
+    including the drivers whose DriverRequest is still to come.
+
+    Drives already under way keep their arrival times.
+
+    @type speed: int
+    @rtype: callable
+    """
+    def policy(dispatcher):
+        drivers = list(dispatcher.drivers.values())
+        if dispatcher.scheduler is not None:
+            drivers.extend(event.driver for event in dispatcher.scheduler
+                           if type(event) is DriverRequest)
+        for driver in drivers:
+            if driver.is_idle and driver.dispatcher is dispatcher:
+                # The dispatcher indexes idle drivers by speed, so they are
+                # taken out of the index while their speed changes.
+                driver.is_idle = False
+                driver.speed = speed
+                driver.is_idle = True
+            else:
+                driver.speed = speed
+    return policy
+
+
+def _carry_on(simulation, dispatcher, policy):
+    """Apply <policy> to <dispatcher> and run <simulation> to the end.
+
+    @type simulation: Simulation
+    @type dispatcher: Dispatcher
+    @type policy: callable | None
+    @rtype: SimulationReport
+    """
+    if policy is not None:
+        policy(dispatcher)
+    return simulation.run([])
+
+
+def _fork(simulation, dispatcher, policy):
+    """Run a scenario in a forked child process, and return the child's
+    process id and the read end of the pipe its result comes through.
+
+    @type simulation: Simulation
+    @type dispatcher: Dispatcher
+    @type policy: callable | None
+    @rtype: (int, int)
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # The child must never return into the parent's code, whatever
+        # goes wrong, so it always ends with os._exit.
+        status = 1
+        try:
+            os.close(read)
+            try:
+                result = ('ok', _carry_on(simulation, dispatcher, policy))
+            except BaseException:
+                result = ('error', traceback.format_exc())
+            with os.fdopen(write, 'wb') as file:
+                pickle.dump(result, file, pickle.HIGHEST_PROTOCOL)
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write)
+    return pid, read
+
+
+def _abandon(running):
+    """Kill and reap the children of the scenarios in <running>, each a
+    name, process id and pipe read end, and close their pipes.
+
+    The children have not been collected, so they have not been reaped.
+
+    @type running: iterable[(str, int, int)]
+    @rtype: None
+    """
+    for _, pid, read in running:
+        os.close(read)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # exited, but not yet reaped
+        os.waitpid(pid, 0)
+
+
+def _collect(name, pid, read):
+    """Return the report of the scenario <name> run by the child <pid>,
+    read from the pipe <read>.
+
+    @type name: str
+    @type pid: int
+    @type read: int
+    @rtype: SimulationReport
+    """
+    with os.fdopen(read, 'rb') as file:
+        data = file.read()
+    os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError("scenario {} died".format(name))
+    status, result = pickle.loads(data)
+    if status == 'error':
+        raise RuntimeError("scenario {} failed:\n{}".format(name, result))
+    return result
+
+
+def what_if(trace, at, policies, scheduler='heap', batch_window=None,
+            workers=None, fork=None):
+    """Simulate the event file <trace> up to time <at>, then carry on with
+    each of <policies> from there, and return the report of the shared
+    prefix and the report of each scenario's suffix, by name.
+
+    The statistics of a suffix's report cover the whole run, prefix
+    included, so they can be compared with those of a full run.
+
+    @type trace: str
+    @type at: int
+    @type policies: dict[str, callable | None]
+        Each function changes the Dispatcher it is called with; None leaves
+        it as it is.
+    @type scheduler: str
+        'heap' or 'calendar'.
+    @type batch_window: int | None
+        The batch window of the prefix.
+    @type workers: int | None
+        The most scenarios run at once, or None for one per CPU.
+    @type fork: bool | None
+        Whether to fork, or None to fork where os.fork is available.
+    @rtype: (SimulationReport, dict[str, SimulationReport])
+
+    >>> prefix, reports = what_if('events.txt', 10, {
+    ...     AS_IS: None, 'batched': batch_window(3)})
+    >>> prefix.events_processed
+    14
+    >>> reports[AS_IS].statistics == Simulation().run('events.txt').statistics
+    True
+    >>> [(name, report.statistics['rider_wait_time'])
+    ...  for name, report in reports.items()]
+    [('as is', 0.5), ('batched', 2.0)]
+
+    A policy also applies to the drivers who arrive after <at>; here every
+    driver arrives at time 0, after the fork.
+
+    >>> prefix, reports = what_if('events.txt', 0, {
+    ...     AS_IS: None, 'fast': driver_speed(100)})
+    >>> prefix.events_processed
+    0
+    >>> [(name, report.statistics['rider_wait_time'])
+    ...  for name, report in reports.items()]
+    [('as is', 0.5), ('fast', 0.0)]
+    """
+    if fork is None:
+        fork = hasattr(os, 'fork')
+    queue = CalendarQueue(event_time) if scheduler == 'calendar' else \
+        PriorityQueue(key=event_time)
+    dispatcher = Dispatcher(batch_window)
+    simulation = Simulation(queue, dispatcher)
+    prefix = simulation.run(trace, until=at)
+
+    reports = {}
+    if not fork:
+        for name, policy in policies.items():
+            reports[name] = _carry_on(
+                *copy.deepcopy((simulation, dispatcher)), policy)
+        return prefix, reports
+
+    workers = workers or os.cpu_count() or 1
+    running = deque()
+    try:
+        for name, policy in policies.items():
+            if len(running) == workers:
+                # Taken off first, since _collect closes the pipe and reaps
+                # the child even if it fails.
+                done = running.popleft()
+                reports[done[0]] = _collect(*done)
+            running.append((name,) + _fork(simulation, dispatcher, policy))
+        while running:
+            done = running.popleft()
+            reports[done[0]] = _collect(*done)
+    finally:
+        _abandon(running)
+    return prefix, {name: reports[name] for name in policies}
+
+
+def main(argv=None):
+    """Compare the scenarios described by the command line arguments <argv>
+    and print a table of their results.
+
+    @type argv: list[str] | None
+    @rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        description='Compare dispatch policies from the same point of a run.')
+    parser.add_argument('trace', help='event file')
+    parser.add_argument('--at', type=int, required=True,
+                        help='time to fork the scenarios at')
+    parser.add_argument('--batch-window', type=int, nargs='+', default=[],
+                        help='batch windows to try (-1 for none)')
+    parser.add_argument('--speed', type=int, nargs='+', default=[],
+                        help='driver speeds to try')
+    parser.add_argument('--scheduler', choices=['heap', 'calendar'],
+                        default='heap')
+    parser.add_argument('--workers', type=int,
+                        help='scenarios to run at once (default: one per CPU)')
+    parser.add_argument('--no-fork', action='store_true',
+                        help='copy the state instead of forking')
+    args = parser.parse_args(argv)
+
+    policies = {AS_IS: None}
+    for window in args.batch_window:
+        policies['batch_window={}'.format(window)] = batch_window(
+            None if window < 0 else window)
+    for speed in args.speed:
+        policies['speed={}'.format(speed)] = driver_speed(speed)
+    prefix, reports = what_if(args.trace, args.at, policies, args.scheduler,
+                              workers=args.workers,
+                              fork=False if args.no_fork else None)
+    print('Shared prefix: {} events in {:.3f} s'.format(
+        prefix.events_processed, sum(prefix.phase_times.values())),
+        file=sys.stderr)
+    rows = []
+    for name, report in reports.items():
+        row = {'scenario': name, 'events': report.events_processed,
+               'seconds': round(report.phase_times['run'], 3)}
+        row.update(report.statistics)
+        rows.append(row)
+    print(format_table(rows))
+
+
+if __name__ == '__main__':
+    main()